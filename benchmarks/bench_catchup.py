@@ -0,0 +1,69 @@
+"""Catch-up of a follower that is far behind a newly elected leader.
+
+The leader starts with sent_length at the end of its log, as after an
+election, and replicate_log has to find where the follower's log ends.
+Without conflict hints (an old follower) that takes one round trip per
+missing entry, so it is only measured on a short log.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_catchup
+"""
+
+import asyncio
+import json
+from time import perf_counter
+from typing import Any, Awaitable, Callable, List
+from aiohttp import web
+from server.raft_node import Node
+from benchmarks.cluster import start_cluster, stop_cluster
+
+
+def follower_setup(hints: bool, requests: List[int]) -> Callable[[Node], None]:
+    @web.middleware
+    async def count(
+        request: web.Request, handler: Callable[[web.Request], Awaitable[Any]]
+    ) -> Any:
+        requests.append(1)
+        resp = await handler(request)
+        if not hints and request.path == "/append_entries":
+            data = json.loads(resp.text)
+            data.pop("conflict_term", None)
+            data.pop("conflict_index", None)
+            resp = web.json_response(data)
+        return resp
+
+    def setup(node: Node) -> None:
+        node.app.middlewares.append(count)
+
+    return setup
+
+
+async def run(entries: int, hints: bool) -> None:
+    requests: List[int] = []
+    nodes = await start_cluster(size=2, setup=follower_setup(hints, requests))
+    leader, follower = nodes
+    leader.log = [(1, f"msg{i}") for i in range(entries)]
+    leader.sent_length[follower.node_id] = entries
+
+    start = perf_counter()
+    await leader.replicate_log(follower.node_id)
+    elapsed = perf_counter() - start
+
+    assert follower.log == leader.log
+    label = "with conflict hints" if hints else "decrement by one"
+    print(
+        f"{entries:>7} entries behind, {label:<20}"
+        f" {len(requests):>6} round trips {elapsed:>9.3f} s"
+    )
+    await stop_cluster(nodes)
+
+
+async def main() -> None:
+    await run(1_000, hints=False)
+    await run(1_000, hints=True)
+    await run(100_000, hints=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
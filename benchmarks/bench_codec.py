@@ -0,0 +1,62 @@
+"""Encode and decode cost and size of AppendEntries, JSON against the binary codec.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_codec
+"""
+
+import json
+from time import perf_counter
+from typing import Callable
+from server import codec
+from server.log_store import LogStore
+from server.raft_node import RequestAppend
+
+COMMAND_SIZE = 100
+
+
+def per_call(func: Callable[[], object], repeat: int) -> float:
+    start = perf_counter()
+    for _ in range(repeat):
+        func()
+    return (perf_counter() - start) / repeat
+
+
+def main() -> None:
+    print(
+        f"{'entries':>8} {'json encode':>12} {'decode':>10} {'size':>10}"
+        f" {'binary encode':>14} {'decode':>10} {'size':>10}"
+    )
+    for count in (1, 100, 10_000):
+        log = [(1, f"{i:0{COMMAND_SIZE}d}") for i in range(count)]
+        request = RequestAppend(
+            term=1,
+            leader_id="127.0.0.1:9100",
+            log_length=0,
+            log_term=0,
+            entries=log,
+            leader_commit=0,
+        )
+        repeat = max(1, 10_000 // count)
+
+        as_json = json.dumps(request).encode()
+        json_encode = per_call(lambda: json.dumps(request).encode(), repeat)
+        json_decode = per_call(lambda: json.loads(as_json), repeat)
+
+        # what a leader pays per follower, its LogStore holds the encoded entries
+        store = LogStore(log)
+        as_binary = codec.encode_append(request, store.columns(0, count))
+        binary_encode = per_call(
+            lambda: codec.encode_append(request, store.columns(0, count)), repeat
+        )
+        binary_decode = per_call(lambda: codec.decode_append(as_binary), repeat)
+
+        print(
+            f"{count:>8} {json_encode * 1e6:>9.1f} us {json_decode * 1e6:>7.1f} us"
+            f" {len(as_json):>10} {binary_encode * 1e6:>11.1f} us"
+            f" {binary_decode * 1e6:>7.1f} us {len(as_binary):>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Cost of advancing the commit index after one ack, on logs of up to 10^6 entries.
+
+Compares the quorum median of acked_length with the former scan over every
+log index (kept here as a reference implementation).
+
+Run from the repository root:
+
+    python -m benchmarks.bench_commit_index
+"""
+
+from time import perf_counter
+from typing import Dict
+from server.raft_node import Node
+
+
+def scan_ready(log_length: int, acked_length: Dict[str, int], majority: int) -> int:
+    """The former implementation: count the acks of every log index."""
+
+    def acks(length: int) -> int:
+        return len({k for k, v in acked_length.items() if v >= length})
+
+    ready = {r for r in range(1, log_length + 1) if acks(r) >= majority}
+    return max(ready) if ready else 0
+
+
+def per_call(func, repeat: int) -> float:
+    start = perf_counter()
+    for _ in range(repeat):
+        func()
+    return (perf_counter() - start) / repeat
+
+
+def main() -> None:
+    for cluster_size in (3, 5):
+        names = [f"node{i}" for i in range(1, cluster_size + 1)]
+        for log_length in (10**3, 10**4, 10**5, 10**6):
+            node = Node(names[0], names[1:])
+            node.acked_length = {name: log_length - i for i, name in enumerate(names)}
+            expected = node.quorum_length()
+
+            median = per_call(node.quorum_length, 10_000)
+            repeat = max(1, 10**5 // log_length)
+            scan = per_call(
+                lambda: scan_ready(log_length, node.acked_length, node.majority),
+                repeat,
+            )
+            assert scan_ready(log_length, node.acked_length, node.majority) == expected
+            print(
+                f"{cluster_size} nodes, log {log_length:>8}:"
+                f"  quorum median {median * 1e6:8.2f} us"
+                f"  full scan {scan * 1e6:14.2f} us"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Time for a 3-node cluster to elect a new leader after its leader crashes.
+
+The election and heartbeat timers are deadlines on the event loop, so a
+follower notices the crash after its election timeout with no polling delay on
+top, and sub-100ms timeouts work. The timeout is random and adapts to the gaps
+between heartbeats, about two heartbeat periods here instead of the
+election_timeout cap, and a PreVote round precedes every election.
+
+An idle cluster quiesces: its leader sends heartbeats QUIESCE_TIMEOUT /
+ELECTION_TIMEOUT times less often, and a crash is noticed after
+QUIESCE_TIMEOUT instead, the last row shows the bound that trades for it.
+
+A planned restart hands leadership over first (POST /transfer_leadership):
+the leader brings a follower up to date and sends it TimeoutNow, so the
+cluster is without a leader for about one round trip.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_failover
+"""
+
+import asyncio
+from time import perf_counter
+from typing import List
+from server.raft_node import Node
+from benchmarks.cluster import report, start_cluster, stop_cluster
+
+RUNS = 20
+TIMEOUTS = [(0.5, 0.1), (0.1, 0.02), (0.05, 0.01)]  # election, heartbeat
+QUIESCE = (0.1, 0.02, 0.5)  # election, heartbeat, quiesce timeout
+
+
+def set_timeouts(election: float, heartbeat: float, quiesce: float = 0.0):
+    def setup(node: Node) -> None:
+        node.election_timeout = election
+        node.heartbeat_timeout = heartbeat
+        node.quiesce_timeout = quiesce
+
+    return setup
+
+
+async def failover(election: float, heartbeat: float, quiesce: float = 0.0) -> float:
+    nodes = await start_cluster(setup=set_timeouts(election, heartbeat, quiesce))
+    for node in nodes:
+        node.timers_running = True
+        node.reset_election_timer()
+    leader = nodes[0]
+    leader.schedule_heartbeat()
+    await asyncio.sleep(5 * heartbeat)
+
+    await leader.stop()
+    start = perf_counter()
+    while not any(node.current_role == "LEADER" for node in nodes[1:]):
+        await asyncio.sleep(0.001)
+    elapsed = perf_counter() - start
+    await stop_cluster(nodes[1:])
+    return elapsed
+
+
+async def transfer(election: float, heartbeat: float) -> float:
+    nodes = await start_cluster(setup=set_timeouts(election, heartbeat))
+    for node in nodes:
+        node.timers_running = True
+        node.reset_election_timer()
+    leader = nodes[0]
+    leader.schedule_heartbeat()
+    await asyncio.sleep(5 * heartbeat)
+
+    start = perf_counter()
+    transfer = asyncio.create_task(leader.transfer_leadership(nodes[1].node_id))
+    while not any(node.current_role == "LEADER" for node in nodes[1:]):
+        await asyncio.sleep(0.001)
+    elapsed = perf_counter() - start
+    await transfer
+    await stop_cluster(nodes)
+    return elapsed
+
+
+async def main() -> None:
+    for election, heartbeat in TIMEOUTS:
+        samples: List[float] = []
+        for _ in range(RUNS):
+            samples.append(await failover(election, heartbeat))
+        report(
+            f"election {election * 1000:.0f} ms heartbeat {heartbeat * 1000:.0f} ms",
+            samples,
+        )
+    election, heartbeat, quiesce = QUIESCE
+    samples = [await failover(election, heartbeat, quiesce) for _ in range(RUNS)]
+    report(
+        f"idle, election {election * 1000:.0f} ms quiesce {quiesce * 1000:.0f} ms",
+        samples,
+    )
+    election, heartbeat = TIMEOUTS[0]
+    samples = [await transfer(election, heartbeat) for _ in range(RUNS)]
+    report(f"leadership transfer, election {election * 1000:.0f} ms", samples)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+"""Command throughput against client concurrency, with and without group commit.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_group_commit
+"""
+
+import asyncio
+from time import perf_counter
+from aiohttp import ClientSession, TCPConnector
+from server.raft_node import COMMAND_BATCH_SIZE
+from server.transport import peer_url
+from benchmarks.cluster import start_cluster, stop_cluster
+
+DURATION = 2.0  # seconds per measurement
+CONCURRENCY = [1, 4, 16, 64]
+
+
+async def client(session: ClientSession, url: str, deadline: float, name: str) -> int:
+    done = 0
+    while perf_counter() < deadline:
+        async with session.post(url, json={"command": f"{name}-{done}"}) as resp:
+            await resp.text()
+        done += 1
+    return done
+
+
+async def run(batch_size: int, concurrency: int) -> float:
+    nodes = await start_cluster(setup=lambda n: setattr(n, "batch_size", batch_size))
+    url = peer_url(nodes[0].node_id, "/")
+    async with ClientSession(connector=TCPConnector(limit=0)) as session:
+        deadline = perf_counter() + DURATION
+        done = await asyncio.gather(
+            *[client(session, url, deadline, f"c{i}") for i in range(concurrency)]
+        )
+    await stop_cluster(nodes)
+    return sum(done) / DURATION
+
+
+async def main() -> None:
+    print(
+        f"{'clients':>8} {'batch size 1':>16} {f'batch size {COMMAND_BATCH_SIZE}':>16}"
+    )
+    for concurrency in CONCURRENCY:
+        single = await run(1, concurrency)
+        batched = await run(COMMAND_BATCH_SIZE, concurrency)
+        print(f"{concurrency:>8} {single:>12.0f} op/s {batched:>12.0f} op/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+"""Memory per entry and slice cost of the log, a list of tuples against LogStore.
+
+A leader slices its log for every AppendEntries: a list copies the tail
+into a new list, LogStore hands out a view and the codec columns of it.
+
+Run from the repository root (needs about 2 GB of memory):
+
+    python -m benchmarks.bench_log_store
+"""
+
+import sys
+from time import perf_counter
+from typing import Callable, List, Tuple
+from server.log_store import LogStore
+
+ENTRIES = 10_000_000
+COMMAND = "set x {}"
+TAILS = (100, 10_000, 1_000_000)
+
+
+def list_size(log: List[Tuple[int, str]]) -> int:
+    # small ints are shared by the interpreter, the terms cost nothing extra
+    return sys.getsizeof(log) + sum(
+        sys.getsizeof(entry) + sys.getsizeof(entry[1]) for entry in log
+    )
+
+
+def store_size(log: LogStore) -> int:
+    return sum(
+        sys.getsizeof(column)
+        for column in (log, log.terms, log.lengths, log.text, log.offsets)
+    )
+
+
+def per_call(func: Callable[[], object], repeat: int = 10) -> float:
+    start = perf_counter()
+    for _ in range(repeat):
+        func()
+    return (perf_counter() - start) / repeat
+
+
+def main() -> None:
+    entries = [(1, COMMAND.format(i)) for i in range(ENTRIES)]
+    store = LogStore(entries)
+    commands = store.size(0, ENTRIES) / ENTRIES
+    print(f"{ENTRIES} entries, {commands:.1f} bytes of command each")
+    print(f"{'':>24} {'list':>12} {'LogStore':>12}")
+    print(
+        f"{'memory per entry':>24} {list_size(entries) / ENTRIES:>10.1f} B"
+        f" {store_size(store) / ENTRIES:>10.1f} B"
+    )
+    for tail in TAILS:
+        start = ENTRIES - tail
+        list_slice = per_call(lambda: entries[start:])
+        store_slice = per_call(lambda: store.view(start, ENTRIES).columns())
+        print(
+            f"{f'slice of {tail} entries':>24} {list_slice * 1e6:>9.1f} us"
+            f" {store_slice * 1e6:>9.1f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Multi-Raft scaling: 3 hosts running 1 to 1000 Raft groups each, in one process.
+
+For every number of groups: the time until every group has elected a leader
+and how the leaders are spread over the hosts, key-value write throughput
+with 64 concurrent clients sending each write to the host leading the key's
+group, and what the hosts do while idle (peer requests, heartbeats of
+groups and CPU time per second): with a heartbeat timer per group, with the
+heartbeats coalesced per pair of hosts, and coalesced with idle groups
+quiescing to a heartbeat every QUIESCE seconds.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_multiraft
+"""
+
+import asyncio
+import itertools
+import logging
+from time import perf_counter, process_time
+from typing import Any, List, Optional
+from aiohttp import ClientSession
+from server.host import Host
+from server.transport import peer_url
+
+logging.getLogger().setLevel(logging.ERROR)
+
+GROUPS = [1, 10, 100, 1000]
+HOSTS = [f"127.0.0.1:{9300 + i}" for i in range(3)]
+HEARTBEAT = 0.1
+ELECTION = 1.0
+CLIENTS = 64
+WRITES_FOR = 3.0  # seconds
+IDLE_FOR = 2.0  # seconds
+ELECT_WITHIN = 30.0  # seconds, give up on hosts that can't elect every leader
+QUIESCE = 5.0  # quiesce timeout, idle groups get a heartbeat every 0.5 s
+
+
+async def start_hosts(groups: int, coalesce: bool, quiesce: float = 0.0) -> List[Host]:
+    hosts = [
+        Host(
+            address,
+            [peer for peer in HOSTS if peer != address],
+            groups,
+            data_dir=None,
+            state_machine="kv",
+            coalesce_heartbeats=coalesce,
+        )
+        for address in HOSTS
+    ]
+    for host in hosts:
+        host.heartbeat_timeout = HEARTBEAT
+        for node in host.groups:
+            node.heartbeat_timeout = HEARTBEAT
+            node.election_timeout = ELECTION
+            node.quiesce_timeout = quiesce
+    for host in hosts:
+        await host.start(int(host.address.split(":")[1]))
+    return hosts
+
+
+def leader_of(hosts: List[Host], group: int) -> Any:
+    for host in hosts:
+        if host.groups[group].current_role == "LEADER":
+            return host
+    return None
+
+
+async def wait_for_leaders(hosts: List[Host], groups: int) -> Optional[float]:
+    start = perf_counter()
+    while any(leader_of(hosts, group) is None for group in range(groups)):
+        if perf_counter() - start > ELECT_WITHIN:
+            return None
+        await asyncio.sleep(0.01)
+    return perf_counter() - start
+
+
+async def write_throughput(hosts: List[Host]) -> float:
+    keys = itertools.count()
+    done = 0
+    deadline = perf_counter() + WRITES_FOR
+
+    async def client(session: ClientSession) -> None:
+        nonlocal done
+        while perf_counter() < deadline:
+            key = f"key{next(keys)}"
+            group = hosts[0].groups.index(hosts[0].group_of(key))
+            host = leader_of(hosts, group)
+            if host is None:
+                await asyncio.sleep(0.01)
+                continue
+            async with session.put(
+                peer_url(host.address, f"/kv/{key}"), json={"value": 1}
+            ) as resp:
+                if resp.status == 200:
+                    done += 1
+
+    async with ClientSession() as session:
+        start = perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(CLIENTS)))
+        return done / (perf_counter() - start)
+
+
+async def idle_load(hosts: List[Host]) -> str:
+    """Peer requests, group heartbeats and CPU time per second of idle hosts."""
+    requests = heartbeats = 0
+    for host in hosts:
+        post = host.transport.post
+
+        async def counted(
+            node: str, path: str, data: Any, *args: Any, post: Any = post
+        ) -> Any:
+            nonlocal requests, heartbeats
+            requests += 1
+            heartbeats += len(data) if path == "/heartbeats" else 1
+            return await post(node, path, data, *args)
+
+        host.transport.post = counted  # type: ignore
+    # let the groups settle into their idle heartbeats
+    await asyncio.sleep(max(HEARTBEAT, QUIESCE * HEARTBEAT / ELECTION))
+    requests = heartbeats = 0
+    cpu, start = process_time(), perf_counter()
+    await asyncio.sleep(IDLE_FOR)
+    elapsed = perf_counter() - start
+    return (
+        f"{requests / elapsed:>8.0f} {heartbeats / elapsed:>8.0f}"
+        f" {(process_time() - cpu) / elapsed * 100:>4.0f}%"
+    )
+
+
+async def run(groups: int) -> None:
+    hosts = await start_hosts(groups, coalesce=True)
+    elected = await wait_for_leaders(hosts, groups)
+    assert elected is not None, "no leaders with coalesced heartbeats"
+    spread = "/".join(
+        str(sum(node.current_role == "LEADER" for node in host.groups))
+        for host in hosts
+    )
+    writes = await write_throughput(hosts)
+    coalesced = await idle_load(hosts)
+    for host in hosts:
+        await host.stop()
+
+    hosts = await start_hosts(groups, coalesce=True, quiesce=QUIESCE)
+    await wait_for_leaders(hosts, groups)
+    quiescent = await idle_load(hosts)
+    for host in hosts:
+        await host.stop()
+
+    hosts = await start_hosts(groups, coalesce=False)
+    if await wait_for_leaders(hosts, groups) is None:
+        per_group = f"{'no leaders in ' + str(int(ELECT_WITHIN)) + ' s':>23}"
+    else:
+        per_group = await idle_load(hosts)
+    for host in hosts:
+        await host.stop()
+
+    print(
+        f"{groups:>6} {elected:>8.2f} s {spread:>12} {writes:>7.0f}/s"
+        f" {per_group} {coalesced} {quiescent}"
+    )
+
+
+async def main() -> None:
+    idle = f"{'requests':>8} {'groups':>8} {'CPU':>5}"
+    print(
+        f"{'':>6} {'':>10} {'':>12} {'':>9} {'idle, timer per group':>23}"
+        f" {'idle, coalesced':>23} {'idle, quiescent':>23}"
+    )
+    print(
+        f"{'groups':>6} {'elected in':>10} {'leaders/host':>12} {'writes':>9}"
+        f" {idle} {idle} {idle}"
+    )
+    for groups in GROUPS:
+        await run(groups)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
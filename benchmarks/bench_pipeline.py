@@ -0,0 +1,76 @@
+"""Replication throughput over a high-latency link against the in-flight window.
+
+Every follower delays each AppendEntries by LATENCY seconds, and the leader
+batches at most BATCH_SIZE commands per AppendEntries round.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_pipeline
+"""
+
+import asyncio
+from time import perf_counter
+from typing import Any, Awaitable, Callable
+from aiohttp import ClientSession, TCPConnector, web
+from server.raft_node import Node
+from server.transport import peer_url
+from benchmarks.cluster import start_cluster, stop_cluster
+
+LATENCY = 0.05
+BATCH_SIZE = 16
+CLIENTS = 128
+DURATION = 3.0
+WINDOWS = [1, 2, 4, 8]
+
+
+@web.middleware
+async def slow_link(
+    request: web.Request, handler: Callable[[web.Request], Awaitable[Any]]
+) -> Any:
+    if request.path == "/append_entries":
+        await asyncio.sleep(LATENCY)
+    return await handler(request)
+
+
+def setup(window: int) -> Callable[[Node], None]:
+    def apply(node: Node) -> None:
+        node.app.middlewares.append(slow_link)
+        node.batch_size = BATCH_SIZE
+        node.replication_window = window
+
+    return apply
+
+
+async def client(session: ClientSession, url: str, deadline: float, name: str) -> int:
+    done = 0
+    while perf_counter() < deadline:
+        async with session.post(url, json={"command": f"{name}-{done}"}) as resp:
+            done += "OK" in await resp.text()
+    return done
+
+
+async def run(window: int) -> float:
+    nodes = await start_cluster(setup=setup(window))
+    leader = nodes[0]
+    if window > 1:
+        leader.become_leader()
+        leader.acked_length[leader.node_id] = 0
+    url = peer_url(leader.node_id, "/")
+    async with ClientSession(connector=TCPConnector(limit=0)) as session:
+        deadline = perf_counter() + DURATION
+        done = await asyncio.gather(
+            *[client(session, url, deadline, f"c{i}") for i in range(CLIENTS)]
+        )
+    leader.current_role = "FOLLOWER"
+    await stop_cluster(nodes)
+    return sum(done) / DURATION
+
+
+async def main() -> None:
+    print(f"link latency {LATENCY * 1000:.0f} ms, {BATCH_SIZE} commands per batch")
+    for window in WINDOWS:
+        print(f"window {window:>2}: {await run(window):>8.0f} committed op/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
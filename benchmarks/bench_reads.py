@@ -0,0 +1,50 @@
+"""Latency of linearizable reads against writes on a 3-node cluster.
+
+A write appends to the log and waits for it to be replicated. A ReadIndex
+read costs one shared heartbeat round and never touches the log, a lease
+read is answered by the leader from local state with no round trip at all.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_reads
+"""
+
+import asyncio
+from time import perf_counter
+from typing import List
+from aiohttp import ClientSession
+from server.transport import peer_url
+from benchmarks.cluster import report, start_cluster, stop_cluster
+
+REQUESTS = 1000
+
+
+async def measure(
+    session: ClientSession, method: str, url: str, **kwargs
+) -> List[float]:
+    samples = []
+    for _ in range(REQUESTS):
+        start = perf_counter()
+        async with session.request(method, url, **kwargs) as resp:
+            await resp.read()
+        samples.append(perf_counter() - start)
+    return samples
+
+
+async def main() -> None:
+    for read_mode in ("read_index", "lease"):
+        nodes = await start_cluster(setup=lambda n: setattr(n, "read_mode", read_mode))
+        leader = nodes[0].node_id
+        async with ClientSession() as session:
+            writes = await measure(
+                session, "POST", peer_url(leader, "/"), json={"command": "msg"}
+            )
+            reads = await measure(session, "GET", peer_url(leader, "/read?limit=1"))
+        if read_mode == "read_index":
+            report("write (log append)", writes)
+        report(f"read ({read_mode})", reads)
+        await stop_cluster(nodes)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
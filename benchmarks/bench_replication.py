@@ -0,0 +1,42 @@
+"""Time to replicate a long log to the followers, JSON against the binary codec.
+
+The leader of a 3-node cluster starts with ENTRIES entries none of its
+followers has, and sends them in one AppendEntries round.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_replication
+"""
+
+import asyncio
+from time import perf_counter
+from benchmarks.cluster import start_cluster, stop_cluster
+
+ENTRIES = 100_000
+COMMAND_SIZE = 100
+
+
+async def run(binary: bool) -> None:
+    nodes = await start_cluster(setup=lambda n: setattr(n.transport, "binary", binary))
+    leader = nodes[0]
+    leader.log = [(1, f"{i:0{COMMAND_SIZE}d}") for i in range(ENTRIES)]
+    leader.acked_length[leader.node_id] = ENTRIES
+
+    start = perf_counter()
+    await leader.send_heartbeats()
+    elapsed = perf_counter() - start
+
+    assert all(node.log == leader.log for node in nodes)
+    assert leader.commit_length == ENTRIES
+    label = "binary codec" if binary else "JSON"
+    print(f"{ENTRIES} entries to 2 followers, {label:<12} {elapsed:>8.3f} s")
+    await stop_cluster(nodes)
+
+
+async def main() -> None:
+    await run(binary=False)
+    await run(binary=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+"""Restart time of a node against the size of its log on disk.
+
+A restarted node memory-maps its log segments and only reads the last one,
+to cut off a torn tail, before it can vote: that takes the same time for
+any log size. Reading every entry back, as the node does lazily when it
+needs them, grows with the log.
+
+Run from the repository root, with the logs written to directory (several GB):
+
+    python -m benchmarks.bench_startup [directory]
+"""
+
+import sys
+import tempfile
+from time import perf_counter
+from server.raft_node import Node
+from server.storage import DiskStorage
+
+SIZES = [1, 2, 4]  # GB
+COMMAND_SIZE = 1000
+BATCH = 10_000
+
+
+def write_log(data_dir: str, size: int) -> int:
+    storage = DiskStorage(data_dir)
+    storage.load()
+    command = "x" * COMMAND_SIZE
+    while storage.length * COMMAND_SIZE < size:
+        storage.append(storage.length, [(1, command)] * BATCH)
+    storage.close()
+    return storage.length
+
+
+def main() -> None:
+    directory = sys.argv[1] if len(sys.argv) > 1 else None
+    print(f"{'log':>6} {'entries':>10} {'ready to vote':>14} {'read every entry':>17}")
+    for gigabytes in SIZES:
+        with tempfile.TemporaryDirectory(dir=directory) as data_dir:
+            entries = write_log(data_dir, gigabytes * 1024**3)
+
+            start = perf_counter()
+            node = Node("node1", ["node2", "node3"], data_dir=data_dir)
+            node.term_at(node.log_length())  # what a vote request asks for
+            ready = perf_counter() - start
+
+            start = perf_counter()
+            for _ in node.log:
+                pass
+            read = perf_counter() - start
+            node.storage.close()
+
+            print(
+                f"{gigabytes:>4} GB {entries:>10} {ready * 1000:>11.1f} ms"
+                f" {read:>15.2f} s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Heartbeat and commit latency with and without pooled peer connections.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_transport
+"""
+
+import asyncio
+from time import perf_counter
+from aiohttp import ClientSession
+from server.transport import PeerTransport, peer_url
+from benchmarks.cluster import start_cluster, stop_cluster, report
+
+ROUNDS = 500
+
+
+async def run(pooled: bool) -> None:
+    nodes = await start_cluster(
+        setup=lambda n: setattr(n, "transport", PeerTransport(pooled))
+    )
+    leader = nodes[0]
+    label = "pooled" if pooled else "new session per RPC"
+
+    heartbeats = []
+    for _ in range(ROUNDS):
+        start = perf_counter()
+        await asyncio.gather(*[leader.replicate_log(node) for node in leader.nodes])
+        heartbeats.append(perf_counter() - start)
+    report(f"heartbeat round ({label})", heartbeats)
+
+    commits = []
+    async with ClientSession() as client:
+        for i in range(ROUNDS):
+            start = perf_counter()
+            async with client.post(
+                peer_url(leader.node_id, "/"), json={"command": f"msg{i}"}
+            ) as resp:
+                await resp.text()
+            commits.append(perf_counter() - start)
+    report(f"command commit ({label})", commits)
+
+    await stop_cluster(nodes)
+
+
+async def main() -> None:
+    await run(pooled=False)
+    await run(pooled=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
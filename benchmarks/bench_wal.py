@@ -0,0 +1,50 @@
+"""Durable appends per second to the write-ahead log, with batched fsync on and off.
+
+Every writer appends one entry at a time and waits until it is durable.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_wal [directory]
+"""
+
+import sys
+import asyncio
+import tempfile
+from time import perf_counter
+from server.storage import DiskStorage
+
+DURATION = 2.0
+WRITERS = [1, 16, 128]
+
+
+async def writer(storage: DiskStorage, deadline: float) -> int:
+    done = 0
+    while perf_counter() < deadline:
+        storage.append(storage.length, [(1, "x" * 100)])
+        await storage.sync()
+        done += 1
+    return done
+
+
+async def run(directory: str, batched: bool, writers: int) -> float:
+    with tempfile.TemporaryDirectory(dir=directory) as data_dir:
+        storage = DiskStorage(data_dir, batched=batched)
+        storage.load()
+        deadline = perf_counter() + DURATION
+        done = await asyncio.gather(
+            *[writer(storage, deadline) for _ in range(writers)]
+        )
+        storage.close()
+    return sum(done) / DURATION
+
+
+async def main(directory: str) -> None:
+    print(f"{'writers':>8} {'fsync per append':>20} {'batched fsync':>20}")
+    for writers in WRITERS:
+        single = await run(directory, False, writers)
+        batched = await run(directory, True, writers)
+        print(f"{writers:>8} {single:>14.0f} ops/s {batched:>14.0f} ops/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "."))
@@ -0,0 +1,86 @@
+"""YCSB-style load on the key-value state machine of a 3-node cluster.
+
+Workloads A (50% reads, 50% updates), B (95% reads) and C (reads only)
+over RECORDS keys picked with a zipfian distribution, as in YCSB.
+Reads are served by the leader from its store, updates are committed puts.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_ycsb
+"""
+
+import random
+import asyncio
+from itertools import accumulate
+from time import perf_counter
+from typing import Dict, List
+from aiohttp import ClientSession, TCPConnector
+from server.state_machine import KVStateMachine
+from server.transport import peer_url
+from benchmarks.cluster import report, start_cluster, stop_cluster
+
+DURATION = 3.0  # seconds per workload
+CLIENTS = 16
+RECORDS = 1000
+VALUE_SIZE = 100
+ZIPFIAN_CONSTANT = 0.99
+WORKLOADS = {"A": 0.5, "B": 0.95, "C": 1.0}  # share of reads
+
+
+async def client(
+    session: ClientSession,
+    base_url: str,
+    read_share: float,
+    deadline: float,
+    latencies: Dict[str, List[float]],
+) -> None:
+    keys = list(range(RECORDS))
+    weights = list(accumulate(1 / (i + 1) ** ZIPFIAN_CONSTANT for i in keys))
+    value = "x" * VALUE_SIZE
+    while perf_counter() < deadline:
+        key = f"user{random.choices(keys, cum_weights=weights)[0]}"
+        start = perf_counter()
+        if random.random() < read_share:
+            async with session.get(f"{base_url}/kv/{key}") as resp:
+                await resp.read()
+            latencies["read"].append(perf_counter() - start)
+        else:
+            async with session.put(
+                f"{base_url}/kv/{key}", json={"value": value}
+            ) as resp:
+                await resp.read()
+            latencies["update"].append(perf_counter() - start)
+
+
+async def main() -> None:
+    nodes = await start_cluster(
+        setup=lambda n: setattr(n, "state_machine", KVStateMachine())
+    )
+    base_url = peer_url(nodes[0].node_id, "")
+    async with ClientSession(connector=TCPConnector(limit=0)) as session:
+        # load phase
+        for i in range(RECORDS):
+            async with session.put(
+                f"{base_url}/kv/user{i}", json={"value": "x" * VALUE_SIZE}
+            ) as resp:
+                await resp.read()
+
+        for name, read_share in WORKLOADS.items():
+            latencies: Dict[str, List[float]] = {"read": [], "update": []}
+            deadline = perf_counter() + DURATION
+            await asyncio.gather(
+                *[
+                    client(session, base_url, read_share, deadline, latencies)
+                    for _ in range(CLIENTS)
+                ]
+            )
+            total = sum(len(samples) for samples in latencies.values())
+            print(f"workload {name}: {total / DURATION:.0f} op/s")
+            for kind, samples in latencies.items():
+                if samples:
+                    report(f"  {kind}", samples)
+    await stop_cluster(nodes)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,54 @@
+"""In-process Raft cluster on localhost, used by the benchmarks.
+
+Only the HTTP servers are started: the election and heartbeat loops are left
+out and the first node is promoted to LEADER directly, so every run measures
+the same steady state without waiting for an election.
+"""
+
+import logging
+import statistics
+from typing import Any, Callable, List
+from aiohttp import web
+from server.raft_node import Node
+
+logging.getLogger().setLevel(logging.ERROR)
+
+
+async def start_cluster(
+    size: int = 3, base_port: int = 9100, setup: Callable[[Node], Any] = lambda n: None
+) -> List[Node]:
+    names = [f"127.0.0.1:{base_port + i}" for i in range(size)]
+    nodes = [Node(name, [n for n in names if n != name]) for name in names]
+    for node in nodes:
+        setup(node)
+        node.runner = web.AppRunner(node.app, access_log=None)
+        await node.runner.setup()
+        await web.TCPSite(
+            node.runner, "127.0.0.1", int(node.node_id.split(":")[1])
+        ).start()
+
+    leader = nodes[0]
+    for node in nodes:
+        node.current_term = 1
+        node.current_leader = leader.node_id
+    leader.current_role = "LEADER"
+    for follower in leader.nodes:
+        leader.sent_length[follower] = 0
+        leader.acked_length[follower] = 0
+    leader.acked_length[leader.node_id] = 0
+    return nodes
+
+
+async def stop_cluster(nodes: List[Node]) -> None:
+    for node in nodes:
+        await node.stop()
+
+
+def report(name: str, samples: List[float]) -> None:
+    """Print median and p99 of latency samples given in seconds."""
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(
+        f"{name:<40} median {statistics.median(samples) * 1000:8.3f} ms"
+        f"   p99 {p99 * 1000:8.3f} ms   (n={len(samples)})"
+    )
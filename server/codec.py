@@ -0,0 +1,174 @@
+"""Binary encoding of the AppendEntries and RequestVote requests.
+
+Every message starts with a fixed header of little-endian integers, followed
+by the sender id. AppendEntries then carry their entries column by column:
+the terms as (term, count) runs (terms never decrease along the log, so a
+request mostly holds one run), the lengths of the commands in characters in
+the narrowest of 1, 2 or 4 bytes that fits them all, and all the commands as
+one UTF-8 string, so decoding them is a single decode() and slicing. Peers
+that don't understand it get the JSON encoding instead (see PeerTransport).
+"""
+
+import sys
+import struct
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Any, Dict, List, Sequence, Tuple
+
+CONTENT_TYPE = "application/x-raft"
+VERSION = 2
+
+# version, term, log_length, log_term, leader_commit, entry count, term run
+# count, bytes per command length, leader_id length
+APPEND = struct.Struct("<BQQQQIIBH")
+# typecode of the command lengths by their width in bytes
+LENGTHS = {1: "B", 2: "H", 4: "I"}
+# version, term, last_log_index, last_log_term, candidate_id length
+VOTE = struct.Struct("<BQQQH")
+
+# term runs, command lengths and commands of a run of entries, as bytes
+Column = bytes | memoryview
+Entries = Tuple[Column, Column, Column]
+
+
+def little_endian(column: array) -> Column:
+    """The column's bytes in little-endian byte order, a view of them where they are."""
+    if sys.byteorder != "little":
+        swapped = array(column.typecode, column)
+        swapped.byteswap()
+        return swapped.tobytes()
+    return memoryview(column).cast("B")
+
+
+def term_runs(terms: Sequence[int]) -> array:
+    """The terms as term, count, term, count, ..., they never decrease."""
+    runs = array("Q")
+    start = 0
+    while start < len(terms):
+        term = terms[start]
+        stop = bisect_right(terms, term, start)
+        runs.extend((term, stop - start))
+        start = stop
+    return runs
+
+
+def narrow(lengths: Sequence[int]) -> array:
+    """The command lengths in the narrowest typecode that holds them."""
+    longest = max(lengths, default=0)
+    typecode = "B" if longest < 1 << 8 else "H" if longest < 1 << 16 else "I"
+    return array(typecode, lengths)
+
+
+def encode_entries(entries: List[Tuple[int, str]]) -> Entries:
+    return (
+        little_endian(term_runs([term for term, _ in entries])),
+        little_endian(narrow([len(command) for _, command in entries])),
+        "".join(command for _, command in entries).encode(),
+    )
+
+
+def encode_append(request: Dict[str, Any], entries: Entries) -> bytes:
+    """Encode an AppendEntries request whose entries are already encoded."""
+    leader_id = request["leader_id"].encode()
+    count = len(request["entries"])
+    runs, lengths, _ = entries
+    header = APPEND.pack(
+        VERSION,
+        request["term"],
+        request["log_length"],
+        request["log_term"],
+        request["leader_commit"],
+        count,
+        len(runs) // 16,
+        len(lengths) // count if count else 1,
+        len(leader_id),
+    )
+    return b"".join((header, leader_id, *entries))
+
+
+def decode_column(typecode: str, data: memoryview) -> array:
+    column = array(typecode)
+    column.frombytes(data)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column
+
+
+def decode_append(data: bytes) -> Dict[str, Any]:
+    (
+        version,
+        term,
+        log_length,
+        log_term,
+        leader_commit,
+        count,
+        run_count,
+        width,
+        id_length,
+    ) = APPEND.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"Unknown codec version {version}")
+    if width not in LENGTHS:
+        raise ValueError(f"Unknown command length width {width}")
+    view = memoryview(data)
+    offset = APPEND.size + id_length
+    leader_id = str(view[APPEND.size : offset], "utf-8")
+    runs = decode_column("Q", view[offset : offset + 16 * run_count])
+    offset += 16 * run_count
+    lengths = decode_column(LENGTHS[width], view[offset : offset + width * count])
+    offset += width * count
+    if len(runs) != 2 * run_count or len(lengths) != count or sum(runs[1::2]) != count:
+        raise ValueError("Truncated entries")
+    text = str(view[offset:], "utf-8")
+    ends = list(accumulate(lengths))
+    if (ends[-1] if ends else 0) != len(text):
+        raise ValueError("Truncated commands")
+    starts = [0, *ends]
+    entries: List[Tuple[int, str]] = []
+    first = 0
+    for run_term, run in zip(runs[::2], runs[1::2]):
+        last = first + run
+        entries += [
+            (run_term, text[start:end])
+            for start, end in zip(starts[first:last], ends[first:last])
+        ]
+        first = last
+    return dict(
+        term=term,
+        leader_id=leader_id,
+        log_length=log_length,
+        log_term=log_term,
+        entries=entries,
+        leader_commit=leader_commit,
+    )
+
+
+def encode_vote(request: Dict[str, Any]) -> bytes:
+    candidate_id = request["candidate_id"].encode()
+    header = VOTE.pack(
+        VERSION,
+        request["term"],
+        request["last_log_index"],
+        request["last_log_term"],
+        len(candidate_id),
+    )
+    # a trailing flag byte only on leadership transfer
+    flags = b"\x01" if request.get("leadership_transfer") else b""
+    return header + candidate_id + flags
+
+
+def decode_vote(data: bytes) -> Dict[str, Any]:
+    version, term, last_log_index, last_log_term, id_length = VOTE.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"Unknown codec version {version}")
+    end = VOTE.size + id_length
+    request = dict(
+        term=term,
+        candidate_id=data[VOTE.size : end].decode(),
+        last_log_index=last_log_index,
+        last_log_term=last_log_term,
+    )
+    if data[end : end + 1] == b"\x01":
+        request["leadership_transfer"] = True
+    return request
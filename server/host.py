@@ -0,0 +1,330 @@
+"""Multi-Raft: many independent Raft groups multiplexed in one process.
+
+A Host runs one Node per group on a single HTTP server and event loop. The
+node of group g on the host at address a is "a/groups/g" and its application
+is mounted at /groups/g, so the RPCs of every group reach the same port, and
+all groups share one PeerTransport, with one connection pool per peer host.
+
+Keys are sharded across the groups by hash, /kv/<key> on a host goes to the
+group that owns the key. The preferred leader of each group is spread
+round-robin over the hosts: it stands for election first, and a host that
+leads a group preferring another host hands it over once that node is up to
+date. Instead of a heartbeat timer per group, the host sends the heartbeats
+of all the groups it leads in one request per peer host. Followers that have
+their leader's whole log get only its term and commit length, and idle groups
+are left out of most of these requests (see QUIESCE_TIMEOUT).
+"""
+
+import os
+import zlib
+import asyncio
+import logging
+from time import monotonic
+from typing import Dict, List, Optional, Set, Tuple, TypedDict, Union
+from aiohttp import web
+
+try:
+    from .raft_node import (
+        DATA_DIR,
+        HEARTBEAT_TIMEOUT,
+        MAX_REQUEST_SIZE,
+        STATE_MACHINE,
+        Node,
+        RequestAppend,
+        RequestHeartbeat,
+        ResponseAppend,
+        ResponseHeartbeat,
+    )
+    from .state_machine import STATE_MACHINES
+    from .transport import CONNECTIONS_PER_PEER, PeerTransport, peer_host
+except ImportError:  # started as a script inside the container
+    from raft_node import (
+        DATA_DIR,
+        HEARTBEAT_TIMEOUT,
+        MAX_REQUEST_SIZE,
+        STATE_MACHINE,
+        Node,
+        RequestAppend,
+        RequestHeartbeat,
+        ResponseAppend,
+        ResponseHeartbeat,
+    )
+    from state_machine import STATE_MACHINES
+    from transport import CONNECTIONS_PER_PEER, PeerTransport, peer_host
+
+# number of Raft groups per host, 0 runs a single Node without a Host
+GROUPS = int(os.getenv("GROUPS", 0))
+# a leader that is not the preferred one of its group checks every
+# BALANCE_INTERVAL seconds whether it can hand the group over
+BALANCE_INTERVAL = float(os.getenv("BALANCE_INTERVAL", 10 * HEARTBEAT_TIMEOUT))
+# at most MAX_CAMPAIGNS groups of a host run an election at the same time, so
+# that when many groups time out together their votes still arrive in time
+MAX_CAMPAIGNS = int(os.getenv("MAX_CAMPAIGNS", 16))
+
+logger = logging.getLogger(__name__)
+
+
+class GroupAppend(RequestAppend):
+    group: int
+
+
+class GroupHeartbeat(RequestHeartbeat):
+    group: int
+
+
+GroupRequest = Union[GroupAppend, GroupHeartbeat]
+
+
+class GroupError(TypedDict):
+    """Answer to a heartbeat for a group the host doesn't run."""
+
+    error: str
+
+
+GroupResponse = Union[ResponseAppend, ResponseHeartbeat, GroupError]
+
+
+def group_node(address: str, group: int) -> str:
+    return f"{address}/groups/{group}"
+
+
+class Host:
+    def __init__(
+        self,
+        address: str,
+        peers: List[str],
+        groups: int,
+        data_dir: Optional[str] = DATA_DIR,
+        state_machine: str = STATE_MACHINE,
+        coalesce_heartbeats: bool = True,
+    ):
+        self.address: str = address  # host name or host:port, like a node id
+        self.peers: List[str] = peers
+        self.hosts: List[str] = sorted([address] + peers)
+        self.transport = PeerTransport(
+            connections_per_peer=max(CONNECTIONS_PER_PEER, groups)
+        )
+        self.heartbeat_timeout: float = HEARTBEAT_TIMEOUT
+        self.balance_interval: float = BALANCE_INTERVAL
+        self.coalesce_heartbeats: bool = coalesce_heartbeats
+        self.heartbeat_handle: Optional[asyncio.TimerHandle] = None
+        self.heartbeats_in_flight: Set[str] = set()  # peer hosts
+        self.balance_task: Optional[asyncio.Task[None]] = None
+        self.runner: Optional[web.AppRunner] = None
+        self.campaign_slots = asyncio.Semaphore(MAX_CAMPAIGNS)
+
+        self.app = web.Application(client_max_size=MAX_REQUEST_SIZE)
+        self.app.add_routes(
+            [
+                web.get("/", self.handle_root),
+                web.post("/heartbeats", self.handle_heartbeats),
+                web.get("/kv/{key}", self.handle_kv),
+                web.put("/kv/{key}", self.handle_kv),
+                web.delete("/kv/{key}", self.handle_kv),
+                web.post("/kv/{key}/cas", self.handle_kv),
+            ]
+        )
+        self.groups: List[Node] = []
+        for group in range(groups):
+            node = Node(
+                group_node(address, group),
+                [group_node(peer, group) for peer in peers],
+                data_dir=(
+                    os.path.join(data_dir, "groups", str(group)) if data_dir else None
+                ),
+                state_machine=STATE_MACHINES[state_machine](),
+            )
+            node.transport = self.transport
+            node.owns_transport = False
+            node.host_heartbeats = coalesce_heartbeats
+            node.campaign_slots = self.campaign_slots
+            self.groups.append(node)
+            self.app.add_subapp(f"/groups/{group}", node.app)
+
+    def preferred_host(self, group: int) -> str:
+        return self.hosts[group % len(self.hosts)]
+
+    def group_of(self, key: str) -> Node:
+        """The group that owns key."""
+        return self.groups[zlib.crc32(key.encode()) % len(self.groups)]
+
+    async def start(self, port: int = 8080) -> None:
+        """Start serving all groups, their preferred leaders stand first."""
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, port=port).start()
+        for group, node in enumerate(self.groups):
+            node.timers_running = True
+            if node.current_role == "LEADER":
+                node.schedule_heartbeat()
+            elif self.preferred_host(group) == self.address:
+                node.reset_election_timer(node.min_election_timeout() / 2)
+            else:
+                node.reset_election_timer()
+        logger.warning(f"Host {self.address} started {len(self.groups)} groups")
+        if self.coalesce_heartbeats:
+            self.schedule_heartbeat()
+        self.balance_task = asyncio.create_task(self.balance_loop())
+
+    async def stop(self) -> None:
+        if self.heartbeat_handle is not None:
+            self.heartbeat_handle.cancel()
+            self.heartbeat_handle = None
+        if self.balance_task is not None:
+            self.balance_task.cancel()
+            self.balance_task = None
+        for node in self.groups:
+            node.timers_running = False
+            node.cancel_timers()
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+        await self.transport.close()
+        for node in self.groups:
+            node.storage.close()
+
+    def schedule_heartbeat(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.heartbeat_handle = loop.call_at(
+            loop.time() + self.heartbeat_timeout, self.on_heartbeat
+        )
+
+    def on_heartbeat(self) -> None:
+        """Send the heartbeats of every group we lead, one request per peer host.
+
+        Followers that are missing entries, or have a request in flight, are
+        left to the replication of their group as with a heartbeat timer per
+        group. Quiescent followers are only sent a heartbeat when it is due.
+        """
+        self.schedule_heartbeat()
+        now = monotonic()
+        batches: Dict[str, List[Tuple[Node, str, GroupRequest]]] = {}
+        for group, node in enumerate(self.groups):
+            if node.current_role != "LEADER":
+                continue
+            if node.replication_window > 1:
+                asyncio.create_task(node.send_heartbeats())
+                continue
+            for follower in node.nodes:
+                task = node.heartbeat_tasks.get(follower)
+                if task is not None and not task.done():
+                    continue
+                sent_length = node.sent_length[follower]
+                request_data: GroupRequest
+                if node.caught_up(follower):
+                    if node.heartbeat_due_at(follower) > now:
+                        continue
+                    node.heartbeat_sent_at[follower] = now
+                    request_data = GroupHeartbeat(
+                        group=group, **node.heartbeat_request()
+                    )
+                elif node.log_base <= sent_length == node.log_length():
+                    # e.g. a new leader, its followers haven't matched its log yet
+                    request_data = GroupAppend(
+                        group=group, **node.append_request(sent_length)
+                    )
+                else:
+                    node.heartbeat_tasks[follower] = asyncio.create_task(
+                        node.replicate_log(follower)
+                    )
+                    continue
+                batches.setdefault(peer_host(follower), []).append(
+                    (node, follower, request_data)
+                )
+        for host, batch in batches.items():
+            if host not in self.heartbeats_in_flight:
+                asyncio.create_task(self.send_heartbeats(host, batch))
+
+    async def send_heartbeats(
+        self, host: str, batch: List[Tuple[Node, str, GroupRequest]]
+    ) -> None:
+        self.heartbeats_in_flight.add(host)
+        sent_at = monotonic()
+        try:
+            responses: List[GroupResponse] = await self.transport.post(
+                host,
+                "/heartbeats",
+                [request_data for _, _, request_data in batch],
+                self.heartbeat_timeout,
+            )
+        except Exception:
+            logger.warning(f"FAILED heartbeats of {len(batch)} groups to '{host}'")
+            return
+        finally:
+            self.heartbeats_in_flight.discard(host)
+        for (node, follower, request_data), data in zip(batch, responses):
+            if "error" in data:
+                logger.warning(f"'{follower}' refused the heartbeat: {data['error']}")
+                continue
+            if "entries" in request_data:
+                ok = node.process_append_response(
+                    follower, request_data, data, sent_at  # type: ignore
+                )
+            else:
+                ok = node.process_heartbeat_response(
+                    follower, request_data, data, sent_at  # type: ignore
+                )
+            if not ok:
+                # the logs don't match, the group's replication backtracks
+                node.heartbeat_tasks[follower] = asyncio.create_task(
+                    node.replicate_log(follower)
+                )
+
+    async def handle_heartbeats(self, request: web.Request) -> web.Response:
+        """Handle the heartbeats of many groups from one host."""
+        requests: List[GroupRequest] = await request.json()
+        responses = await asyncio.gather(*map(self.process_heartbeat, requests))
+        return web.json_response(responses)
+
+    async def process_heartbeat(self, data: GroupRequest) -> GroupResponse:
+        group = data.pop("group")  # type: ignore
+        if type(group) is not int or not 0 <= group < len(self.groups):
+            return GroupError(error=f"No group {group!r}")
+        node = self.groups[group]
+        if "entries" in data:
+            return await node.process_append_entries(data)  # type: ignore
+        return await node.process_heartbeat(data)  # type: ignore
+
+    async def balance_loop(self) -> None:
+        """Hand groups over to their preferred leaders, one at a time.
+
+        Groups with a transfer in progress, e.g. one asked for by a client,
+        are left alone, and a failed transfer is retried on the next round.
+        """
+        while True:
+            await asyncio.sleep(self.balance_interval)
+            for group, node in enumerate(self.groups):
+                preferred = group_node(self.preferred_host(group), group)
+                if (
+                    node.current_role == "LEADER"
+                    and not node.transfer_target
+                    and preferred in node.voters
+                    and node.acked_length[preferred] >= node.log_length()
+                ):
+                    try:
+                        await node.transfer_leadership(preferred)
+                    except Exception:
+                        logger.exception(
+                            f"FAILED to hand group {group} over to '{preferred}'"
+                        )
+
+    async def handle_kv(self, request: web.Request) -> web.Response:
+        """Key-value requests go to the group that owns the key."""
+        node = self.group_of(request.match_info["key"])
+        if request.method == "GET":
+            return await node.handle_kv_get(request)
+        if request.method == "PUT":
+            return await node.handle_kv_put(request)
+        if request.method == "DELETE":
+            return await node.handle_kv_delete(request)
+        return await node.handle_kv_cas(request)
+
+    async def handle_root(self, request: web.Request) -> web.Response:
+        leaders = sum(node.current_role == "LEADER" for node in self.groups)
+        return web.Response(
+            text=(
+                f"Host   : {self.address}\n"
+                f"Groups : {len(self.groups)}\n"
+                f"Leader of {leaders} groups\n"
+            )
+        )
@@ -0,0 +1,310 @@
+"""Compact in-memory log: the entries live in a few flat arrays instead of tuples.
+
+A list of (term, command) tuples costs over 100 bytes per entry in object
+headers alone. LogStore keeps the terms in an array, the commands as one
+UTF-8 arena and an index of where each of them starts, about 20 bytes per
+entry on top of the command bytes. The commands of a run of entries are
+already in the layout of the binary codec, so requests to the followers are
+built from a memoryview of them without copying commands.
+
+After a restart the entries already on disk are not loaded: the store reads
+them from the memory-mapped log segments when they are needed.
+"""
+
+from array import array
+from bisect import bisect_right
+from itertools import accumulate, islice
+from typing import Iterable, Iterator, List, Protocol, Sequence, Tuple, overload
+
+try:
+    from .codec import Entries, encode_entries, little_endian, narrow, term_runs
+except ImportError:  # started as a script inside the container
+    from codec import Entries, encode_entries, little_endian, narrow, term_runs
+
+Entry = Tuple[int, str]
+
+
+class EntrySource(Protocol):
+    """Entries kept outside of the store's arrays, e.g. a memory-mapped log segment."""
+
+    def __len__(self) -> int: ...
+
+    def term(self, index: int) -> int: ...
+
+    def command(self, index: int) -> str: ...
+
+    def size_of(self, start: int, stop: int) -> int: ...
+
+
+class ColdLog:
+    """The entries of a sequence of sources, read from them on demand."""
+
+    def __init__(self, sources: Iterable[EntrySource]) -> None:
+        self.sources = [source for source in sources if len(source)]
+        # index of the first entry of every source, and the end
+        self.starts = array(
+            "Q", accumulate((len(source) for source in self.sources), initial=0)
+        )
+        self.skip = 0  # entries dropped from the front
+        self.end = self.starts[-1]  # entries after it have been truncated
+
+    def __len__(self) -> int:
+        return self.end - self.skip
+
+    def locate(self, index: int) -> Tuple[EntrySource, int]:
+        position = self.skip + index
+        i = bisect_right(self.starts, position) - 1
+        return self.sources[i], position - self.starts[i]
+
+    def term(self, index: int) -> int:
+        source, position = self.locate(index)
+        return source.term(position)
+
+    def command(self, index: int) -> str:
+        source, position = self.locate(index)
+        return source.command(position)
+
+    def size(self, start: int, stop: int) -> int:
+        size = 0
+        while start < stop:
+            source, position = self.locate(start)
+            count = min(stop - start, len(source) - position)
+            size += source.size_of(position, position + count)
+            start += count
+        return size
+
+    def drop(self, count: int) -> None:
+        self.skip += min(count, len(self))
+
+    def truncate(self, length: int) -> None:
+        self.end = min(self.end, self.skip + length)
+
+
+class LogStore(Sequence[Entry]):
+    """Log entries (term, command) in a list-like container backed by arrays.
+
+    It supports what a Raft log needs: appending at the end, dropping a
+    prefix (compaction) and a suffix (a follower's conflicting entries).
+    The log may start with cold entries, e.g. those of a restarted node that
+    are still in its memory-mapped segments: they are only read when used,
+    and entries appended later go to the arrays.
+    """
+
+    def __init__(
+        self, entries: Iterable[Entry] = (), cold: Iterable[EntrySource] = ()
+    ) -> None:
+        self.cold = ColdLog(cold)
+        self.terms = array("q")
+        self.lengths = array("I")  # length of every command in characters
+        self.text = bytearray()  # the commands in UTF-8, one after the other
+        self.offsets = array("Q", [0])  # offset of every command in text, and the end
+        self.dropped = 0  # entries removed from the front since the store was made
+        self.version = 0  # bumped when entries are removed from the end
+        self.extend(entries)
+
+    def __len__(self) -> int:
+        return len(self.cold) + len(self.terms)
+
+    @overload
+    def __getitem__(self, index: int) -> Entry: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Entry]: ...
+
+    def __getitem__(self, index: int | slice) -> Entry | List[Entry]:
+        if isinstance(index, slice):
+            return [self.entry(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("log index out of range")
+        return self.entry(index)
+
+    def entry(self, index: int) -> Entry:
+        return self.term(index), self.command(index)
+
+    def term(self, index: int) -> int:
+        cold = len(self.cold)
+        if index < cold:
+            return self.cold.term(index)
+        return self.terms[index - cold]
+
+    def command(self, index: int) -> str:
+        cold = len(self.cold)
+        if index < cold:
+            return self.cold.command(index)
+        index -= cold
+        return self.text[self.offsets[index] : self.offsets[index + 1]].decode()
+
+    def __iter__(self) -> Iterator[Entry]:
+        for index in range(len(self.cold)):
+            yield self.cold.term(index), self.cold.command(index)
+        text = self.text.decode()
+        ends = accumulate(self.lengths)
+        start = 0
+        for term, end in zip(self.terms, ends):
+            yield term, text[start:end]
+            start = end
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return len(self) == len(other) and all(
+                a == tuple(b) for a, b in zip(self, other)
+            )
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def append(self, entry: Entry) -> None:
+        term, command = entry
+        self.terms.append(term)
+        self.lengths.append(len(command))
+        self.text += command.encode()
+        self.offsets.append(len(self.text))
+
+    def extend(self, entries: Iterable[Entry]) -> None:
+        entries = list(entries)
+        if not entries:
+            return
+        commands = [command for _, command in entries]
+        joined = "".join(commands)
+        data = joined.encode()
+        lengths = array("I", map(len, commands))
+        if len(data) == len(joined):
+            # ASCII, the byte length of every command is its length
+            sizes: Iterable[int] = lengths
+        else:
+            sizes = (len(command.encode()) for command in commands)
+        self.terms.extend(term for term, _ in entries)
+        self.lengths.extend(lengths)
+        self.offsets.extend(islice(accumulate(sizes, initial=len(self.text)), 1, None))
+        self.text += data
+
+    def __delitem__(self, index: slice) -> None:
+        """Delete a prefix (del log[:n]) or a suffix (del log[n:]) of the log."""
+        start, stop, step = index.indices(len(self))
+        if step != 1:
+            raise ValueError("only a prefix or a suffix of the log can be deleted")
+        if stop >= len(self):
+            self.truncate(start)
+        elif start == 0:
+            self.drop(stop)
+        elif start < stop:
+            raise ValueError("only a prefix or a suffix of the log can be deleted")
+
+    def truncate(self, length: int) -> None:
+        """Keep only the first length entries."""
+        if length >= len(self):
+            return
+        cold = len(self.cold)
+        self.cold.truncate(length)
+        length = max(0, length - cold)
+        del self.terms[length:]
+        del self.lengths[length:]
+        del self.text[self.offsets[length] :]
+        del self.offsets[length + 1 :]
+        self.version += 1
+
+    def drop(self, count: int) -> None:
+        """Remove the first count entries."""
+        count = min(count, len(self))
+        cold = min(count, len(self.cold))
+        self.cold.drop(cold)
+        self.dropped += cold
+        count -= cold
+        if count == 0:
+            return
+        cut = self.offsets[count]
+        del self.terms[:count]
+        del self.lengths[:count]
+        del self.text[:cut]
+        self.offsets = array("Q", (offset - cut for offset in self.offsets[count:]))
+        self.dropped += count
+
+    def size(self, start: int, stop: int) -> int:
+        """Bytes of the commands of the entries in [start, stop)."""
+        cold = len(self.cold)
+        size = self.cold.size(min(start, cold), min(stop, cold))
+        start, stop = max(start - cold, 0), max(stop - cold, 0)
+        return size + self.offsets[stop] - self.offsets[start]
+
+    def view(self, start: int, stop: int) -> "LogSlice":
+        return LogSlice(self, start, stop)
+
+    def columns(self, start: int, stop: int) -> Entries:
+        """Entries [start, stop) in the binary codec, the commands as a view of text.
+
+        The store can't grow or shrink while the view is alive, release it
+        (encode it into a request) before changing it. Cold entries are
+        encoded into new columns instead.
+        """
+        cold = len(self.cold)
+        if start < cold:
+            return encode_entries(self[start:stop])
+        start, stop = start - cold, stop - cold
+        return (
+            little_endian(term_runs(memoryview(self.terms)[start:stop])),
+            little_endian(narrow(memoryview(self.lengths)[start:stop])),
+            memoryview(self.text)[self.offsets[start] : self.offsets[stop]],
+        )
+
+
+class LogSlice(Sequence[Entry]):
+    """Entries [start, stop) of a LogStore, read from it when used instead of copied.
+
+    It keeps pointing at the same entries when a prefix of the store is
+    dropped. Reading it fails if they have been dropped, or if the end of the
+    store has been truncated since: they may have been replaced.
+    """
+
+    def __init__(self, store: LogStore, start: int, stop: int) -> None:
+        self.store = store
+        self.first = store.dropped + start
+        self.count = max(0, stop - start)
+        self.version = store.version
+
+    def range(self) -> Tuple[int, int]:
+        """Position of the entries in the store now."""
+        start = self.first - self.store.dropped
+        if self.store.version != self.version or start < 0:
+            raise LookupError("the entries are no longer in the log")
+        return start, start + self.count
+
+    def __len__(self) -> int:
+        return self.count
+
+    @overload
+    def __getitem__(self, index: int) -> Entry: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Entry]: ...
+
+    def __getitem__(self, index: int | slice) -> Entry | List[Entry]:
+        start, stop = self.range()
+        if isinstance(index, slice):
+            return [
+                self.store.entry(start + i) for i in range(*index.indices(self.count))
+            ]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("log index out of range")
+        return self.store.entry(start + index)
+
+    def __iter__(self) -> Iterator[Entry]:
+        start, stop = self.range()
+        return (self.store.entry(i) for i in range(start, stop))
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return len(self) == len(other) and all(
+                a == tuple(b) for a, b in zip(self, other)
+            )
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def columns(self) -> Entries:
+        return self.store.columns(*self.range())
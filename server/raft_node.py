@@ -1,10 +1,58 @@
 import os
+import json
+import heapq
+import struct
+import base64
 import random
 import logging
 import asyncio
-from time import time
-from typing import TypedDict, List, Tuple, Dict, Set, Optional
-from aiohttp import web, ClientSession, ClientTimeout
+from time import monotonic, time
+from bisect import bisect_left, bisect_right
+from typing import (
+    TypedDict,
+    NotRequired,
+    Any,
+    Callable,
+    Iterable,
+    Mapping,
+    Sequence,
+    List,
+    Tuple,
+    Dict,
+    Set,
+    Optional,
+    NamedTuple,
+)
+from aiohttp import web
+
+try:
+    from . import codec
+    from .log_store import LogSlice, LogStore
+    from .state_machine import (
+        SESSION_EXPIRED,
+        SESSION_PREFIX,
+        STATE_MACHINES,
+        KVStateMachine,
+        Sessions,
+        StateMachine,
+        session_command,
+    )
+    from .storage import Snapshot, Storage, DiskStorage
+    from .transport import PeerTransport, peer_url
+except ImportError:  # started as a script inside the container
+    import codec
+    from log_store import LogSlice, LogStore
+    from state_machine import (
+        SESSION_EXPIRED,
+        SESSION_PREFIX,
+        STATE_MACHINES,
+        KVStateMachine,
+        Sessions,
+        StateMachine,
+        session_command,
+    )
+    from storage import Snapshot, Storage, DiskStorage
+    from transport import PeerTransport, peer_url
 
 
 class RequestVote(TypedDict):
@@ -12,6 +60,8 @@ class RequestVote(TypedDict):
     candidate_id: str
     last_log_index: int
     last_log_term: int
+    # set by a candidate the leader handed over to: voters don't stick to it
+    leadership_transfer: NotRequired[bool]
 
 
 class ResponseVote(TypedDict):
@@ -20,12 +70,22 @@ class ResponseVote(TypedDict):
     vote_granted: bool
 
 
+class RequestTimeoutNow(TypedDict):
+    term: int
+    leader_id: str
+
+
+class ResponseTimeoutNow(TypedDict):
+    term: int
+    success: bool  # the follower started an election
+
+
 class RequestAppend(TypedDict):
     term: int
     leader_id: str
     log_length: int
     log_term: int
-    entries: List[Tuple[int, str]]
+    entries: Sequence[Tuple[int, str]]  # a LogSlice of the leader's log when sent
     leader_commit: int
 
 
@@ -33,10 +93,172 @@ class ResponseAppend(TypedDict):
     term: int
     ack: int
     success: bool
+    # Set when the entries are rejected because the logs don't match:
+    # the term of the follower's entry at log_length (0 if its log is too
+    # short) and the length of the follower's log before the first entry of
+    # that term (its whole log length if it is too short).
+    conflict_term: NotRequired[int]
+    conflict_index: NotRequired[int]
+
+
+class Outcome(NamedTuple):
+    """What became of a command submitted to the leader."""
+
+    committed: bool
+    result: Any  # what applying it returned
+    index: int  # log index it was committed at, 0 if it wasn't
+    term: int
+
+
+class RequestHeartbeat(TypedDict):
+    """Heartbeat to a follower that has the leader's whole log: no log position
+    or entries, only what keeps the follower's term and commit length current."""
+
+    term: int
+    leader_id: str
+    leader_commit: int
+
+
+class ResponseHeartbeat(TypedDict):
+    term: int
+    # False if the follower doesn't know its log matches the leader's, the
+    # leader falls back to AppendEntries
+    success: bool
+
+
+class ResponseReadIndex(TypedDict):
+    term: int
+    read_index: int  # -1 if the node could not confirm it is the leader
+
+
+class RequestSnapshot(TypedDict):
+    term: int
+    leader_id: str
+    # the snapshot replaces the first last_index entries of the log
+    last_index: int
+    last_term: int
+    offset: int  # position of this chunk in the snapshot
+    data: str  # base64 encoded chunk
+    done: bool  # last chunk
+    config: NotRequired[Dict[str, List[str]]]  # cluster configuration at last_index
+
+
+class ResponseSnapshot(TypedDict):
+    term: int
+    offset: int  # bytes of the snapshot received so far, 0 if the chunk was refused
 
 
 HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", 1.0))
+# A follower starts an election after a random timeout between T and 2T. T is
+# ELECTION_TIMEOUT until the node has heard heartbeats from a leader, then it
+# adapts to the gaps between them: a heartbeat period plus the longest gap it
+# expects (their average plus four deviations), at most ELECTION_TIMEOUT.
 ELECTION_TIMEOUT = float(os.getenv("ELECTION_TIMEOUT", 5.0))
+# PreVote: before it bumps its term a node asks the others whether they would
+# vote for it, and they refuse while they still hear from a leader, so a node
+# back from a partition doesn't depose a healthy leader. PRE_VOTE=0 turns it off.
+PRE_VOTE = os.getenv("PRE_VOTE", "1") == "1"
+# Quiescence: a follower that has acked and committed the leader's whole log
+# gets heartbeats QUIESCE_TIMEOUT * HEARTBEAT_TIMEOUT / ELECTION_TIMEOUT
+# seconds apart, and detects the failure of the leader of such an idle group
+# after a random timeout between QUIESCE_TIMEOUT and 2 * QUIESCE_TIMEOUT.
+# 0 turns it off.
+QUIESCE_TIMEOUT = float(os.getenv("QUIESCE_TIMEOUT", 2 * ELECTION_TIMEOUT))
+# Group commit: at most COMMAND_BATCH_SIZE commands per replication round, and
+# a round waits up to COMMAND_BATCH_LINGER seconds for a batch to fill up
+COMMAND_BATCH_SIZE = int(os.getenv("COMMAND_BATCH_SIZE", 256))
+COMMAND_BATCH_LINGER = float(os.getenv("COMMAND_BATCH_LINGER", 0.0))
+# a client command that is not committed within COMMAND_TIMEOUT seconds fails
+COMMAND_TIMEOUT = float(os.getenv("COMMAND_TIMEOUT", ELECTION_TIMEOUT))
+# Pipelined replication: up to REPLICATION_WINDOW AppendEntries requests and
+# REPLICATION_WINDOW_BYTES bytes of entries in flight per follower.
+# A window of 1 keeps the classic one-round-at-a-time replication.
+REPLICATION_WINDOW = int(os.getenv("REPLICATION_WINDOW", 1))
+REPLICATION_WINDOW_BYTES = int(os.getenv("REPLICATION_WINDOW_BYTES", 4 * 1024 * 1024))
+# An AppendEntries request carries at most APPEND_MAX_ENTRIES entries and is
+# cut after the entry that reaches APPEND_MAX_BYTES bytes (0 for no limit), so
+# a follower far behind catches up in bounded chunks. Requests with entries,
+# and snapshot chunks, time out after CATCHUP_TIMEOUT instead of HEARTBEAT_TIMEOUT.
+APPEND_MAX_ENTRIES = int(os.getenv("APPEND_MAX_ENTRIES", 10_000))
+APPEND_MAX_BYTES = int(os.getenv("APPEND_MAX_BYTES", 1024 * 1024))
+CATCHUP_TIMEOUT = float(os.getenv("CATCHUP_TIMEOUT", ELECTION_TIMEOUT))
+# largest request body a node accepts
+MAX_REQUEST_SIZE = int(os.getenv("MAX_REQUEST_SIZE", 64 * 1024 * 1024))
+# Snapshot the state machine and drop the log prefix it covers once
+# SNAPSHOT_ENTRIES entries or SNAPSHOT_BYTES bytes of commands have been
+# applied since the last snapshot (0 disables a trigger). Followers behind the
+# snapshot receive it in chunks of SNAPSHOT_CHUNK_SIZE bytes.
+SNAPSHOT_ENTRIES = int(os.getenv("SNAPSHOT_ENTRIES", 1_000_000))
+SNAPSHOT_BYTES = int(os.getenv("SNAPSHOT_BYTES", 64 * 1024 * 1024))
+SNAPSHOT_CHUNK_SIZE = int(os.getenv("SNAPSHOT_CHUNK_SIZE", 1024 * 1024))
+# Reads: "read_index" confirms leadership with a heartbeat round per batch of
+# reads, "lease" serves them locally while a majority acked AppendEntries sent
+# less than ELECTION_TIMEOUT - LEASE_DRIFT seconds ago. Lease reads assume the
+# clocks of the nodes run at nearly the same rate, LEASE_DRIFT is the margin.
+READ_MODE = os.getenv("READ_MODE", "read_index")
+LEASE_DRIFT = float(os.getenv("LEASE_DRIFT", ELECTION_TIMEOUT / 10))
+# log entry a leader commits when it has to, it is not applied to the state machine
+NOOP = ""
+# Log entries that change the cluster members, one node at a time, e.g.
+# {"raft": {"members": ["raft-node-1", "raft-node-2"], "learners": ["raft-node-3"]}}.
+# Learners get the log but don't vote or count towards a majority. A
+# configuration is in effect once its entry is in the log, committed or not.
+# Like NOOP they are not applied to the state machine, and clients can't
+# send commands like them.
+CONFIG_PREFIX = '{"raft": '
+# a learner is promoted to a voting member only within LEARNER_MAX_LAG entries
+# of the leader's log, so that it doesn't hold back commits while catching up
+LEARNER_MAX_LAG = int(os.getenv("LEARNER_MAX_LAG", APPEND_MAX_ENTRIES))
+# what committed commands build: "log" keeps every command, "kv" is a key-value store
+STATE_MACHINE = os.getenv("STATE_MACHINE", "log")
+# term, vote, log and snapshot are kept in DATA_DIR, without it they are lost on restart
+DATA_DIR = os.getenv("DATA_DIR")
+
+
+# {"members": [...], "learners": [...]}
+Config = Dict[str, List[str]]
+
+
+def config_command(members: List[str], learners: Sequence[str] = ()) -> str:
+    config: Config = {"members": members}
+    if learners:
+        config["learners"] = list(learners)
+    return json.dumps({"raft": config})
+
+
+def parse_config(command: str) -> Optional[Config]:
+    """Configuration set by a configuration entry, None for any other command."""
+    if not command.startswith(CONFIG_PREFIX):
+        return None
+    config = json.loads(command)["raft"]
+    return {"members": config["members"], "learners": config.get("learners", [])}
+
+
+def client_session(request_data: Mapping[str, Any]) -> Optional[Tuple[str, int]]:
+    """Client id and sequence number a command is sent with, None without them."""
+    if "client_id" not in request_data:
+        return None
+    client_id, seq = request_data["client_id"], request_data.get("seq")
+    if not isinstance(client_id, str) or type(seq) is not int or seq < 1:
+        raise web.HTTPBadRequest(
+            text="ERROR: client_id must be a string and seq a number from 1 on"
+        )
+    return client_id, seq
+
+
+def entries_size(log: LogStore, start: int, stop: int) -> int:
+    """Approximate size of the log entries in [start, stop) on the wire."""
+    return log.size(start, stop) + 16 * (stop - start)
+
+
+async def read_request(request: web.Request, decode: Callable[[bytes], Any]) -> Any:
+    """Body of an RPC request, in the binary codec or in JSON."""
+    if request.content_type != codec.CONTENT_TYPE:
+        return await request.json()
+    try:
+        return decode(await request.read())
+    except (ValueError, struct.error) as error:
+        raise web.HTTPBadRequest(text=f"ERROR: Bad request {error}")
 
 
 logging.basicConfig(
@@ -48,134 +270,506 @@ logger = logging.getLogger(__name__)
 
 
 class Node:
-    def __init__(self, node_id: str, nodes: List[str]):
+    def __init__(
+        self,
+        node_id: str,
+        nodes: List[str],
+        data_dir: Optional[str] = DATA_DIR,
+        state_machine: Optional[StateMachine] = None,
+        joining: bool = False,
+    ):
         # Node state
         self.node_id: str = node_id
-        self.nodes: List[str] = nodes
-        self.majority: int = (len(nodes) + 2) // 2
-        self.current_role: str = "FOLLOWER"  # FOLLOWER, CANDIDATE, LEADER
-        self.node_last_activity_time: float = time()
-        self.state_machine: str = "_"
+        self.nodes: List[str] = nodes  # the other members and learners
+        self.voters: List[str] = nodes  # the other members
+        self.majority: int = (len(nodes) + 1) // 2 + 1  # of the members
+        self._current_role: str = "FOLLOWER"  # FOLLOWER, CANDIDATE, LEADER
+        # Deadline timers on the event loop's monotonic clock, armed once the
+        # node is started: followers and candidates wait for the election
+        # timer, leaders send AppendEntries on the heartbeat timer.
+        self.timers_running: bool = False
+        self.election_timeout: float = ELECTION_TIMEOUT
+        self.heartbeat_timeout: float = HEARTBEAT_TIMEOUT
+        self.election_deadline: float = 0.0
+        self.election_handle: Optional[asyncio.TimerHandle] = None
+        self.heartbeat_handle: Optional[asyncio.TimerHandle] = None
+        self.heartbeat_tasks: Dict[str, asyncio.Task[bool]] = {}
+        # replicate_log started for a batch of commands, one per follower
+        self.replication_tasks: Dict[str, asyncio.Task[bool]] = {}
+        self.host_heartbeats: bool = False  # a Host sends them for all its groups
+        # a Host shares these between its groups to bound concurrent elections
+        self.campaign_slots: Optional[asyncio.Semaphore] = None
+        self.campaign_queued: bool = False
+        # smoothed gap between AppendEntries from the leader and its deviation
+        self.heartbeat_gap: float = 0.0
+        self.heartbeat_gap_var: float = 0.0
+        self.quiesce_timeout: float = QUIESCE_TIMEOUT
+        # the leader told us that every entry of its log we have is committed
+        self.quiescent: bool = False
+        # (term, length of our log known to match the leader of that term)
+        self.matched: Tuple[int, int] = (0, 0)
+        self.pre_vote: bool = PRE_VOTE
+        # follower we hand leadership over to, we take no commands meanwhile
+        self.transfer_target: str = ""
+        self.state_machine: StateMachine = (
+            state_machine
+            if state_machine is not None
+            else STATE_MACHINES[STATE_MACHINE]()
+        )
+        # last command of each client, part of the state machine's state
+        self.sessions = Sessions()
         self.command_lock = asyncio.Semaphore(1)  # Add semaphore for commands
+        # each command is answered with its Outcome
+        self.pending_commands: List[Tuple[str, asyncio.Future[Outcome]]] = []
+        self.apply_results: Dict[int, Any] = {}  # index -> result, for the clients
+        # ReadIndex: reads waiting for the next leadership confirmation round
+        self.read_waiters: List[asyncio.Future[bool]] = []
+        self.read_task: Optional[asyncio.Task[None]] = None
+        self.noop_task: Optional[asyncio.Task[Outcome]] = None
+        # follower reads waiting for the next read index from the leader,
+        # and for the entries up to it to be applied: (index, id, future)
+        self.index_waiters: List[asyncio.Future[Optional[int]]] = []
+        self.index_task: Optional[asyncio.Task[None]] = None
+        self.apply_waiters: List[Tuple[int, int, asyncio.Future[None]]] = []
+        self.read_mode: str = READ_MODE
+        self.lease_drift: float = LEASE_DRIFT
+        # monotonic time of the last AppendEntries. A node that restarts may
+        # have acked a lease its leader still holds, with read leases it counts
+        # its start as a heartbeat and won't vote for anyone else until it ends.
+        self.leader_heard_at: float = monotonic() if self.read_mode == "lease" else 0.0
+        self.batch_task: Optional[asyncio.Task[None]] = None
+        self.batch_size: int = COMMAND_BATCH_SIZE
+        self.batch_linger: float = COMMAND_BATCH_LINGER
+        # leader entries waiting to be committed, a heap of (index, id, term, future)
+        self.commit_waiters: List[Tuple[int, int, int, asyncio.Future[bool]]] = []
+        self.transport = PeerTransport()  # keep-alive connections to the peers
+        # a Host shares its transport between its groups, and closes it itself
+        self.owns_transport: bool = True
+        self.runner: Optional[web.AppRunner] = None
 
         # Persistent data on all nodes:
-        self.current_term: int = 0
-        self.voted_for: Optional[str] = None
-        self.log: List[Tuple[int, str]] = []  # Each log entry: (term, command)
+        self.storage: Storage = DiskStorage(data_dir) if data_dir else Storage()
+        term, voted_for, first, log = self.storage.load()
+        self._current_term: int = term
+        self._voted_for: Optional[str] = voted_for
+        self.log = log  # Each log entry: (term, command), kept in a LogStore
+        # self.log holds the entries from index log_base on, the ones before
+        # are compacted into the snapshot
+        self.log_base: int = first
+        self.snapshot_term: int = 0  # term of the entry at log_base
 
         # Volatile state on all nodes:
         self.commit_length: int = 0
         self.current_leader: str = ""
         self.votes_received: Set[str] = set()
+        self.snapshot: Optional[Snapshot] = None
+        self.snapshot_entries: int = SNAPSHOT_ENTRIES
+        self.snapshot_bytes: int = SNAPSHOT_BYTES
+        self.snapshot_chunk_size: int = SNAPSHOT_CHUNK_SIZE
+        self.applied_bytes: int = 0  # bytes of commands applied since the snapshot
+        self.incoming_snapshot = bytearray()  # chunks received from the leader
+        snapshot = self.storage.load_snapshot()
+        if snapshot is not None:
+            self.restore_snapshot(snapshot)
 
         # Volatile state on leaders
         self.sent_length: Dict[str, int] = {}
         self.acked_length: Dict[str, int] = {}
+        self.replication_window: int = REPLICATION_WINDOW
+        self.replication_window_bytes: int = REPLICATION_WINDOW_BYTES
+        self.append_max_entries: int = APPEND_MAX_ENTRIES
+        self.append_max_bytes: int = APPEND_MAX_BYTES
+        self.catchup_timeout: float = CATCHUP_TIMEOUT
+        self.replication_events: Dict[str, asyncio.Event] = {}
+        self.heartbeat_due: Set[str] = set()
+        self.snapshot_transfers: Set[str] = set()
+        # follower -> monotonic send time of the latest request it acked in our term
+        self.lease_acks: Dict[str, float] = {}
+        # requests sent before then don't renew the lease, we sent TimeoutNow
+        self.lease_revoked_at: float = 0.0
+        # follower -> commit length it is known to have in our term
+        self.commit_acked: Dict[str, int] = {}
+        # follower -> monotonic time of the last heartbeat we sent it
+        self.heartbeat_sent_at: Dict[str, float] = {}
+
+        # Cluster configurations: (log length after the entry that set it,
+        # config), the last one is in effect. nodes, voters and majority follow
+        # it. A joining node has none until the leader replicates one to it.
+        configs = self.storage.load_configs()
+        # a crash may have stored a configuration whose entry didn't reach the log
+        while (
+            configs
+            and configs[-1][0] > self.log_base
+            and (
+                configs[-1][0] > self.log_length()
+                or parse_config(self.log.command(configs[-1][0] - 1 - self.log_base))
+                != configs[-1][1]
+            )
+        ):
+            configs.pop()
+        self.configs: List[Tuple[int, Config]] = configs or [
+            (0, {"members": [] if joining else [node_id] + nodes, "learners": []})
+        ]
+        self.learner_max_lag: int = LEARNER_MAX_LAG
+        self.apply_config()
 
         # Web application setup
-        self.app = web.Application()
+        self.app = web.Application(client_max_size=MAX_REQUEST_SIZE)
         self.app.add_routes(
             [
                 web.get("/", self.handle_root),
+                web.get("/state_machine", self.handle_state_machine),
+                web.get("/read", self.handle_read),
+                web.post("/read_index", self.handle_read_index),
+                web.get("/kv/{key}", self.handle_kv_get),
+                web.put("/kv/{key}", self.handle_kv_put),
+                web.delete("/kv/{key}", self.handle_kv_delete),
+                web.post("/kv/{key}/cas", self.handle_kv_cas),
                 web.post("/", self.handle_command),
+                web.post("/pre_vote", self.handle_pre_vote),
+                web.post("/transfer_leadership", self.handle_transfer_leadership),
+                web.post("/timeout_now", self.handle_timeout_now),
+                web.post("/membership", self.handle_membership),
                 web.post("/request_vote", self.handle_request_vote),
                 web.post("/append_entries", self.handle_append_entries),
+                web.post("/heartbeat", self.handle_heartbeat),
+                web.post("/install_snapshot", self.handle_install_snapshot),
             ]
         )
 
-    async def start(self):
+    @property
+    def current_role(self) -> str:
+        return self._current_role
+
+    @current_role.setter
+    def current_role(self, role: str) -> None:
+        previous, self._current_role = self._current_role, role
+        if previous == "LEADER" and role != "LEADER":
+            # the next leader may overwrite our entries that aren't committed
+            self.fail_commit_waiters(self.commit_length)
+        if not self.timers_running or role == previous:
+            return
+        if role == "LEADER":
+            self.cancel_timers()
+            self.schedule_heartbeat()
+        elif previous == "LEADER":
+            self.cancel_timers()
+            self.reset_election_timer()
+
+    @property
+    def current_term(self) -> int:
+        return self._current_term
+
+    @current_term.setter
+    def current_term(self, term: int) -> None:
+        self._current_term = term
+        self.storage.save_state(term, self._voted_for)
+
+    @property
+    def voted_for(self) -> Optional[str]:
+        return self._voted_for
+
+    @voted_for.setter
+    def voted_for(self, node_id: Optional[str]) -> None:
+        self._voted_for = node_id
+        self.storage.save_state(self._current_term, node_id)
+
+    def step_down(self, term: int) -> None:
+        """Take on a newer term seen from a peer, as a follower."""
+        self.current_term = term
+        self.current_role = "FOLLOWER"
+        self.voted_for = None
+        logger.warning(f"I am FOLLOWER for term {self.current_term}")
+
+    @property
+    def log(self) -> LogStore:
+        return self._log
+
+    @log.setter
+    def log(self, entries: Iterable[Tuple[int, str]]) -> None:
+        self._log = entries if isinstance(entries, LogStore) else LogStore(entries)
+
+    def log_length(self) -> int:
+        """Length of the log, including the prefix compacted into the snapshot."""
+        return self.log_base + len(self.log)
+
+    def term_at(self, length: int) -> int:
+        """Term of the last entry of the log prefix of the given length."""
+        if length == self.log_base:
+            return self.snapshot_term
+        return self.log.term(length - 1 - self.log_base)
+
+    async def start(self, port: int = 8080):
         """Start the Raft node."""
         logger.warning(f"I start as {self.current_role} for term {self.current_term}")
         logger.warning(f"My neighbor nodes {self.nodes}")
-        asyncio.create_task(self.election_timer())
-        asyncio.create_task(self.generate_heartbeats())
-        runner = web.AppRunner(self.app)
-        await runner.setup()
-        site = web.TCPSite(runner)
+        await self.transport.open(self.nodes)
+        self.timers_running = True
+        if self.current_role == "LEADER":
+            self.schedule_heartbeat()
+        else:
+            self.reset_election_timer()
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, port=port)
         await site.start()
 
-    async def election_timer(self):
-        """Check election timeout and start election if needed."""
-        while True:
-            if self.current_role == "FOLLOWER":
-                if (time() - self.node_last_activity_time) > ELECTION_TIMEOUT:
-                    self.current_role = "CANDIDATE"
-                    logger.warning("I am CANDIDATE")
-                    await self.election()
-            await asyncio.sleep(HEARTBEAT_TIMEOUT)
-
-    async def election(self) -> None:
-        """Start an election and request votes from other nodes."""
-        while True:
-            if self.current_role == "CANDIDATE":
-                self.current_term += 1
-                self.voted_for = self.node_id
-                self.votes_received = set([self.node_id])
-
-                request_data = RequestVote(
-                    term=self.current_term,
-                    candidate_id=self.node_id,
-                    last_log_index=len(self.log),
-                    last_log_term=self.log[-1][0] if self.log else 0,
-                )
+    async def stop(self):
+        """Stop serving requests and close the connections to the peers."""
+        self.timers_running = False
+        self.cancel_timers()
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+        if self.owns_transport:
+            await self.transport.close()
+        self.storage.close()
 
-                logger.warning(
-                    f"I started election for term {self.current_term} and voted for myself"
+    def min_election_timeout(self) -> float:
+        """Shortest election timeout, adapted to the gaps between heartbeats."""
+        if self.quiescent:
+            return self.quiesce_timeout
+        if not self.heartbeat_gap:
+            return self.election_timeout
+        gap = self.heartbeat_gap + 4 * self.heartbeat_gap_var
+        return min(
+            self.election_timeout,
+            self.heartbeat_timeout + max(self.heartbeat_timeout, gap),
+        )
+
+    def observe_heartbeat_gap(self, gap: float) -> None:
+        # smoothed like a TCP round-trip time (RFC 6298)
+        if not self.heartbeat_gap:
+            self.heartbeat_gap, self.heartbeat_gap_var = gap, gap / 2
+            return
+        self.heartbeat_gap_var += (
+            abs(gap - self.heartbeat_gap) - self.heartbeat_gap_var
+        ) / 4
+        self.heartbeat_gap += (gap - self.heartbeat_gap) / 8
+
+    def reset_election_timer(self, timeout: Optional[float] = None) -> None:
+        """Start an election timeout seconds from now (a random time between the
+        minimum election timeout and twice that by default) unless the timer is
+        reset again before, e.g. by a request from the leader."""
+        if not self.timers_running or self.current_role == "LEADER":
+            return
+        if self.election_handle is not None:
+            self.election_handle.cancel()
+        loop = asyncio.get_running_loop()
+        if timeout is None:
+            shortest = self.min_election_timeout()
+            timeout = random.uniform(shortest, 2 * shortest)
+        self.election_deadline = loop.time() + timeout
+        self.election_handle = loop.call_at(
+            self.election_deadline, self.on_election_timeout
+        )
+
+    def on_election_timeout(self) -> None:
+        self.election_handle = None
+        self.quiescent = False  # the leader is gone, retry at the usual pace
+        if (
+            self.current_role == "LEADER"
+            or self.node_id not in self.configs[-1][1]["members"]
+        ):
+            return  # only members of the cluster elect a leader, not learners
+        # a round that wins no majority is retried after a random timeout
+        self.reset_election_timer()
+        asyncio.create_task(self.campaign())
+
+    async def campaign(self) -> None:
+        """Become a candidate and run an election, if a majority would vote for us."""
+        if self.campaign_slots is None:
+            return await self.run_campaign()
+        if self.campaign_queued:
+            return  # the campaign of an earlier timeout is still waiting
+        self.campaign_queued, heard_at = True, self.leader_heard_at
+        try:
+            async with self.campaign_slots:
+                self.campaign_queued = False
+                if self.leader_heard_at == heard_at:  # no leader turned up meanwhile
+                    await self.run_campaign()
+        finally:
+            self.campaign_queued = False
+
+    async def run_campaign(self) -> None:
+        if self.pre_vote and not await self.ask_pre_votes():
+            return
+        if self.current_role == "LEADER":
+            return
+        self.current_role = "CANDIDATE"
+        logger.warning("I am CANDIDATE")
+        await self.election()
+
+    async def ask_pre_votes(self) -> bool:
+        """PreVote: ask the other nodes whether they would vote for us in the
+        next term, without changing anybody's term or vote."""
+        term, heard_at = self.current_term, self.leader_heard_at
+        request_data = RequestVote(
+            term=term + 1,
+            candidate_id=self.node_id,
+            last_log_index=self.log_length(),
+            last_log_term=self.term_at(self.log_length()),
+        )
+        granted = set([self.node_id])
+        for resp in asyncio.as_completed(
+            [
+                self.post_request_vote(node, request_data, "/pre_vote")
+                for node in self.voters
+            ]
+        ):
+            data = await resp
+            if self.current_term != term or self.leader_heard_at != heard_at:
+                return False  # a leader showed up meanwhile
+            if data["term"] > self.current_term:
+                self.step_down(data["term"])
+                return False
+            if data["vote_granted"]:
+                granted.add(data["node_id"])
+                if len(granted) >= self.majority:
+                    return True
+        logger.warning(f"PreVote for term {term + 1} failed")
+        return False
+
+    def schedule_heartbeat(self) -> None:
+        if self.host_heartbeats:
+            return
+        loop = asyncio.get_running_loop()
+        self.heartbeat_handle = loop.call_at(
+            loop.time() + self.heartbeat_timeout, self.on_heartbeat
+        )
+
+    def on_heartbeat(self) -> None:
+        """Send AppendEntries to every follower that has no heartbeat in flight,
+        or only a heartbeat if it has our whole log."""
+        self.heartbeat_handle = None
+        if self.current_role != "LEADER":
+            return
+        self.schedule_heartbeat()
+        logger.info("Sent heartbeat")
+        if self.replication_window > 1:
+            asyncio.create_task(self.send_heartbeats())
+            return
+        now = monotonic()
+        for node in self.nodes:
+            task = self.heartbeat_tasks.get(node)
+            if task is not None and not task.done():
+                continue
+            if not self.caught_up(node):
+                self.heartbeat_tasks[node] = asyncio.create_task(
+                    self.replicate_log(node)
                 )
-                for resp in asyncio.as_completed(
-                    [self.post_request_vote(node, request_data) for node in self.nodes]
-                ):
-                    data = await resp
-
-                    if (
-                        self.current_role == "CANDIDATE"
-                        and data["term"] == self.current_term
-                        and data["vote_granted"]
-                    ):
-                        self.votes_received.add(data["node_id"])
-                        if len(self.votes_received) >= self.majority:
-                            self.current_role = "LEADER"
-                            self.current_leader = self.node_id
-                            self.node_last_activity_time = time()
-
-                            for node in self.nodes:
-                                self.sent_length[node] = len(self.log)
-                                self.acked_length[node] = 0
-
-                            for resp in asyncio.as_completed(
-                                [self.replicate_log(node) for node in self.nodes]
-                            ):
-                                await resp
-
-                            logger.warning(f"I am LEADER for term {self.current_term}")
-                            return
-
-                    elif data["term"] > self.current_term:
-                        self.current_term = data["term"]
-                        self.current_role = "FOLLOWER"
-                        self.voted_for = None
-                        logger.warning(f"I am FOLLOWER for term {self.current_term}")
-                        self.node_last_activity_time = time()
-                        return
-
-                await asyncio.sleep(
-                    random.uniform(ELECTION_TIMEOUT, ELECTION_TIMEOUT * 2)
+            elif self.heartbeat_due_at(node) <= now:
+                self.heartbeat_sent_at[node] = now
+                self.heartbeat_tasks[node] = asyncio.create_task(
+                    self.send_heartbeat(node)
                 )
-            else:
+
+    def caught_up(self, follower_id: str) -> bool:
+        """The follower acked our whole log in our term, it only needs heartbeats."""
+        return (
+            follower_id in self.commit_acked
+            and self.acked_length[follower_id] == self.log_length()
+        )
+
+    def heartbeat_due_at(self, follower_id: str) -> float:
+        """Monotonic time of the next heartbeat to a follower that has our whole log.
+
+        A follower that also has our whole log committed is quiescent: it
+        waits QUIESCE_TIMEOUT for a heartbeat and gets one that much less
+        often, the ticks of the heartbeat timer in between skip it.
+        """
+        if (
+            not self.quiesce_timeout
+            or self.commit_acked.get(follower_id, 0) < self.log_length()
+        ):
+            return 0.0
+        interval = self.quiesce_timeout * self.heartbeat_timeout / self.election_timeout
+        # the timer ticks every heartbeat_timeout, send on the tick nearest interval
+        return (
+            self.heartbeat_sent_at.get(follower_id, 0.0)
+            + interval
+            - self.heartbeat_timeout / 2
+        )
+
+    def cancel_timers(self) -> None:
+        for handle in (self.election_handle, self.heartbeat_handle):
+            if handle is not None:
+                handle.cancel()
+        self.election_handle = self.heartbeat_handle = None
+
+    async def election(self, leadership_transfer: bool = False) -> None:
+        """Run one round of an election: request votes from the other nodes."""
+        if self.current_role != "CANDIDATE":
+            return
+        self.current_term += 1
+        self.voted_for = self.node_id
+        self.votes_received = set([self.node_id])
+
+        request_data = RequestVote(
+            term=self.current_term,
+            candidate_id=self.node_id,
+            last_log_index=self.log_length(),
+            last_log_term=self.term_at(self.log_length()),
+        )
+        if leadership_transfer:
+            request_data["leadership_transfer"] = True
+
+        await self.storage.sync()
+        logger.warning(
+            f"I started election for term {self.current_term} and voted for myself"
+        )
+        for resp in asyncio.as_completed(
+            [self.post_request_vote(node, request_data) for node in self.voters]
+        ):
+            data = await resp
+
+            if (
+                self.current_role == "CANDIDATE"
+                and data["term"] == self.current_term
+                and data["vote_granted"]
+            ):
+                self.votes_received.add(data["node_id"])
+                if len(self.votes_received) >= self.majority:
+                    self.become_leader()
+                    await self.send_heartbeats()
+                    logger.warning(f"I am LEADER for term {self.current_term}")
+                    return
+
+            elif data["term"] > self.current_term:
+                self.step_down(data["term"])
+                self.reset_election_timer()
                 return
 
+    def become_leader(self) -> None:
+        self.current_role = "LEADER"
+        self.current_leader = self.node_id
+
+        self.sent_length, self.acked_length = {}, {}
+        for node in self.nodes:
+            self.sent_length[node] = self.log_length()
+            self.acked_length[node] = 0
+        self.acked_length[self.node_id] = self.log_length()
+        self.lease_acks, self.commit_acked, self.heartbeat_sent_at = {}, {}, {}
+
+        if self.replication_window > 1:
+            for node in self.nodes:
+                self.replication_events[node] = asyncio.Event()
+                asyncio.create_task(self.replication_loop(node, self.current_term))
+
     async def post_request_vote(
-        self, node: str, request_data: RequestVote
+        self, node: str, request_data: RequestVote, path: str = "/request_vote"
     ) -> ResponseVote:
-        url = f"http://{node}:8080/request_vote"
+        url = peer_url(node, path)
         logging.warning(f"RequestVote with term {request_data['term']} to '{url}'")
         try:
-            async with ClientSession() as session:
-                async with session.post(
-                    url, json=request_data, timeout=ClientTimeout(HEARTBEAT_TIMEOUT)
-                ) as resp:
-                    data: ResponseVote = await resp.json()
-                    return data
+            data: ResponseVote = await self.transport.post(
+                node,
+                path,
+                request_data,
+                self.heartbeat_timeout,
+                lambda: codec.encode_vote(request_data),
+            )
+            return data
         except Exception:
             logging.warning(
                 f"FAILED RequestVote with term {request_data['term']} to '{url}'"
@@ -186,29 +780,69 @@ class Node:
                 vote_granted=False,
             )
 
+    def candidate_log_ok(self, data: RequestVote) -> bool:
+        """Is the candidate's log at least as up-to-date as ours?"""
+        log_term = self.term_at(self.log_length())
+        return (data["last_log_term"] > log_term) or (
+            data["last_log_term"] == log_term
+            and data["last_log_index"] >= self.log_length()
+        )
+
+    async def handle_pre_vote(self, request: web.Request) -> web.Response:
+        """Handle PreVote RPC: tell whether we would vote for the candidate in
+        the term it asks for, our term, vote and timer stay as they are."""
+        data: RequestVote = await read_request(request, codec.decode_vote)
+        # we still hear from a leader, or are one
+        heard = monotonic() - self.leader_heard_at
+        leader_alive = (
+            self.current_role == "LEADER"
+            or heard < self.min_election_timeout()
+            or (self.read_mode == "lease" and heard < ELECTION_TIMEOUT)
+        )
+        vote_granted = (
+            data["term"] > self.current_term
+            and not leader_alive
+            and self.candidate_log_ok(data)
+        )
+        return web.json_response(
+            ResponseVote(
+                node_id=self.node_id if vote_granted else "",
+                term=self.current_term,
+                vote_granted=vote_granted,
+            )
+        )
+
     async def handle_request_vote(self, request: web.Request) -> web.Response:
         """Handle RequestVote RPC."""
-        data: RequestVote = await request.json()
-        self.node_last_activity_time = time()
+        data: RequestVote = await read_request(request, codec.decode_vote)
         vote_granted = False
 
-        log_term = self.log[len(self.log) - 1][0] if self.log else 0
-
-        log_ok = (data["last_log_term"] > log_term) or (
-            data["last_log_term"] == log_term
-            and data["last_log_index"] >= len(self.log)
+        # With read leases the leader counts on its followers not to elect
+        # anyone else while they keep hearing from it (leader stickiness)
+        leader_ok = (
+            self.read_mode != "lease"
+            or monotonic() - self.leader_heard_at >= ELECTION_TIMEOUT
+            or data.get("leadership_transfer", False)
         )
-        term_ok = (data["term"] > log_term) or (
-            data["last_log_term"] == log_term
-            and self.voted_for in (data["candidate_id"], None)
-        )
-        if log_ok and term_ok:
+        if data["term"] > self.current_term and leader_ok:
             self.current_term = data["term"]
+            self.current_role = "FOLLOWER"
+            self.voted_for = None
+
+        if (
+            data["term"] == self.current_term
+            and self.candidate_log_ok(data)
+            and self.voted_for in (data["candidate_id"], None)
+        ):
             self.current_role = "FOLLOWER"
             self.voted_for = data["candidate_id"]
             vote_granted = True
+            # only a granted vote postpones our own candidacy, so that
+            # candidates that timed out together don't stay in lockstep
+            self.reset_election_timer()
             logger.warning(f"I am FOLLOWER for term {self.current_term}")
 
+        await self.storage.sync()
         return web.json_response(
             ResponseVote(
                 node_id=self.node_id if vote_granted else "",
@@ -217,46 +851,278 @@ class Node:
             )
         )
 
-    async def generate_heartbeats(self):
-        while True:
-            if self.current_role == "LEADER":
-                if (time() - self.node_last_activity_time) > HEARTBEAT_TIMEOUT:
-                    logger.info("Sent heartbeat")
-                    self.node_last_activity_time = time()
-                    for resp in asyncio.as_completed(
-                        [self.replicate_log(node) for node in self.nodes]
-                    ):
-                        await resp
-                else:
-                    await asyncio.sleep(
-                        self.node_last_activity_time + HEARTBEAT_TIMEOUT - time()
-                    )
+    async def handle_transfer_leadership(self, request: web.Request) -> web.Response:
+        """Hand leadership over before the leader is restarted, e.g.
+        POST /transfer_leadership {"target": "raft-node-2"}. Without a target
+        the follower that acked the most entries takes over."""
+        request_data = await request.json() if request.body_exists else {}
+
+        if self.current_role != "LEADER":
+            text = "ERROR: I am not a LEADER, cannot transfer leadership"
+        elif self.transfer_target:
+            text = f"ERROR: Leadership transfer to '{self.transfer_target}' in progress"
+        else:
+            target: str = request_data.get("target") or max(
+                self.voters, key=lambda node: self.acked_length[node], default=""
+            )
+            if target not in self.voters:
+                text = f"ERROR: Unknown node '{target}'"
+            elif await self.transfer_leadership(target):
+                text = f"OK: Leadership transferred to '{target}'"
             else:
-                await asyncio.sleep(HEARTBEAT_TIMEOUT)
+                text = f"ERROR: Leadership transfer to '{target}' failed"
+        return web.Response(text=text)
+
+    async def transfer_leadership(self, target: str) -> bool:
+        """Stop taking commands, bring target up to date and send it TimeoutNow,
+        so that it starts an election right away. Give up after an election
+        timeout, as the target may be down, and take commands again."""
+        self.transfer_target = target
+        term = self.current_term
+        deadline = monotonic() + self.election_timeout
+        try:
+            while self.acked_length[target] < self.log_length():
+                if self.current_term != term or monotonic() >= deadline:
+                    return False
+                if self.replication_window > 1:
+                    # its replication loop sends the rest
+                    self.replication_events[target].set()
+                    await asyncio.sleep(self.heartbeat_timeout / 10)
+                elif not await self.replicate_log(target):
+                    await asyncio.sleep(self.heartbeat_timeout / 10)
+
+            logger.warning(f"Hand leadership over to '{target}'")
+            # the target may be elected without waiting for our lease, so
+            # reads go through ReadIndex until a new lease is acked
+            self.lease_acks = {}
+            self.lease_revoked_at = monotonic()
+            try:
+                data: ResponseTimeoutNow = await self.transport.post(
+                    target,
+                    "/timeout_now",
+                    RequestTimeoutNow(term=term, leader_id=self.node_id),
+                    self.heartbeat_timeout,
+                )
+            except Exception:
+                return False
+            if not data["success"]:
+                return False
+            # the target's RequestVote for the next term makes us step down
+            while self.current_term == term and monotonic() < deadline:
+                await asyncio.sleep(self.heartbeat_timeout / 10)
+            return self.current_role != "LEADER"
+        finally:
+            self.transfer_target = ""
+
+    async def handle_timeout_now(self, request: web.Request) -> web.Response:
+        """Handle TimeoutNow RPC: the leader hands over to us, start an
+        election without waiting for the election timeout or a PreVote.
+        Only the leader we follow in its term can make us disrupt it."""
+        data: RequestTimeoutNow = await request.json()
+        success = (
+            data["term"] == self.current_term
+            and data["leader_id"] == self.current_leader
+            and self.current_role == "FOLLOWER"
+            and self.node_id in self.configs[-1][1]["members"]
+        )
+        if success:
+            self.current_role = "CANDIDATE"
+            logger.warning("I am CANDIDATE, the leader hands over")
+            self.reset_election_timer()
+            asyncio.create_task(self.election(leadership_transfer=True))
+        return web.json_response(
+            ResponseTimeoutNow(term=self.current_term, success=success)
+        )
+
+    def apply_config(self) -> None:
+        """Put the last configuration in effect, adding and removing followers."""
+        members, learners = (
+            self.configs[-1][1]["members"],
+            self.configs[-1][1]["learners"],
+        )
+        nodes = [node for node in members + learners if node != self.node_id]
+        added = [node for node in nodes if node not in self.nodes]
+        removed = [node for node in self.nodes if node not in nodes]
+        self.nodes = nodes
+        self.voters = [node for node in members if node != self.node_id]
+        self.majority = len(members) // 2 + 1
+        if self.current_role != "LEADER":
+            return
+        for node in added:
+            self.sent_length[node] = self.log_length()
+            self.acked_length[node] = 0
+            if self.replication_window > 1:
+                self.replication_events[node] = asyncio.Event()
+                asyncio.create_task(self.replication_loop(node, self.current_term))
+        for node in removed:
+            self.sent_length.pop(node, None)
+            self.acked_length.pop(node, None)
+            self.lease_acks.pop(node, None)
+            self.commit_acked.pop(node, None)
+            self.heartbeat_sent_at.pop(node, None)
+            self.heartbeat_due.discard(node)
+            if node in self.replication_events:
+                self.replication_events.pop(node).set()  # its loop ends
+        self.advance_commit()  # the majority may be smaller now
+
+    def track_configs(self, length: int, entries: Sequence[Tuple[int, str]]) -> None:
+        """Take on the configurations among entries about to be appended after
+        the first length entries of the log, before they are stored."""
+        found = [
+            (length + i, config)
+            for i, (_, command) in enumerate(entries, 1)
+            if (config := parse_config(command)) is not None
+        ]
+        if found:
+            self.configs.extend(found)
+            self.storage.save_configs(self.configs)
+            self.apply_config()
+
+    def drop_configs(self, length: int) -> None:
+        """Forget the configurations of entries truncated after the first length."""
+        if self.configs[-1][0] > length:
+            while len(self.configs) > 1 and self.configs[-1][0] > length:
+                self.configs.pop()
+            self.storage.save_configs(self.configs)
+            self.apply_config()
+
+    def compact_configs(self, log_base: int) -> None:
+        """Keep the configuration of the snapshot at log_base and the ones after."""
+        first = max(
+            i for i, (length, _) in enumerate(self.configs) if length <= log_base
+        )
+        self.configs = self.configs[first:]
+        self.storage.save_configs(self.configs)
+        self.apply_config()
+
+    def restore_configs(self, log_base: int, config: Config) -> None:
+        """Take the configuration of a snapshot installed at log_base, and keep
+        the ones of the log entries after it."""
+        self.configs = [(log_base, config)] + [
+            config
+            for config in self.configs
+            if log_base < config[0] <= self.log_length()
+        ]
+        self.storage.save_configs(self.configs)
+        self.apply_config()
+
+    def config_at(self, length: int) -> Config:
+        """Configuration in effect with the first length entries of the log."""
+        return [config for end, config in self.configs if end <= length][-1]
+
+    async def handle_membership(self, request: web.Request) -> web.Response:
+        """Change one node, e.g. POST /membership {"add": "raft-node-4"}, with
+        "add_learner", "promote" (a learner to member) or "remove" instead of
+        "add". Answers once the change is committed."""
+        request_data = await request.json()
+        add, remove = request_data.get("add"), request_data.get("remove")
+        add_learner, promote = request_data.get("add_learner"), request_data.get(
+            "promote"
+        )
+        members, learners = (
+            self.configs[-1][1]["members"],
+            self.configs[-1][1]["learners"],
+        )
+
+        if self.current_role != "LEADER":
+            return web.Response(text="ERROR: I am not a LEADER, cannot change members")
+        if (
+            self.transfer_target
+            or self.configs[-1][0] > self.commit_length
+            or self.term_at(self.commit_length) != self.current_term
+        ):
+            # one change at a time, and only once an entry of our term is
+            # committed, so that no two majorities can decide on their own
+            return web.Response(text="ERROR: Membership change in progress, retry")
+        new_members, new_learners = members, learners
+        if add and add not in members + learners:
+            new_members = members + [add]
+        elif add_learner and add_learner not in members + learners:
+            new_learners = learners + [add_learner]
+        elif promote and promote in learners:
+            lag = self.log_length() - self.acked_length[promote]
+            if lag > self.learner_max_lag:
+                return web.Response(
+                    text=f"ERROR: '{promote}' is {lag} entries behind, retry later"
+                )
+            new_members = members + [promote]
+            new_learners = [node for node in learners if node != promote]
+        elif remove == self.node_id:
+            return web.Response(
+                text="ERROR: Transfer leadership before removing the LEADER"
+            )
+        elif remove and remove in members + learners:
+            new_members = [node for node in members if node != remove]
+            new_learners = [node for node in learners if node != remove]
+        else:
+            return web.Response(text="ERROR: No membership change")
+
+        if await self.change_config(new_members, new_learners):
+            if remove and self.owns_transport:
+                await self.transport.close(remove)
+            text = f"OK: Members {new_members}"
+            if new_learners:
+                text += f", learners {new_learners}"
+        else:
+            text = "ERROR: Not enough quorum to commit the membership change"
+        return web.Response(text=text)
+
+    async def change_config(self, members: List[str], learners: List[str]) -> bool:
+        """Append a configuration entry, in effect right away, and wait until
+        a majority of the new members has it."""
+        async with self.command_lock:
+            if self.current_role != "LEADER":
+                return False
+            entries = [(self.current_term, config_command(members, learners))]
+            self.track_configs(self.log_length(), entries)
+            self.storage.append(self.log_length(), entries)
+            self.log.extend(entries)
+            committed = self.commit_waiter(self.log_length())
+            logger.warning(f"Change members to {members}, learners {learners}")
+        asyncio.create_task(self.sync_own_log())
+        if self.replication_window > 1:
+            for node in self.nodes:
+                self.replication_events[node].set()
+        else:
+            for node in self.nodes:
+                asyncio.create_task(self.replicate_log(node))
+        try:
+            return await asyncio.wait_for(committed, COMMAND_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.drop_commit_waiter(committed)
+            return False
+
+    async def send_heartbeats(self) -> None:
+        """Send AppendEntries to every follower, directly or through its replication loop."""
+        if self.replication_window > 1:
+            now = monotonic()
+            for node in self.nodes:
+                if self.heartbeat_due_at(node) <= now:
+                    self.heartbeat_due.add(node)
+                    self.replication_events[node].set()
+            return
+        for resp in asyncio.as_completed(
+            [self.replicate_log(node) for node in self.nodes]
+        ):
+            await resp
 
     async def handle_append_entries(self, request: web.Request) -> web.Response:
-        data: RequestAppend = await request.json()
-        self.node_last_activity_time = time()
+        data: RequestAppend = await read_request(request, codec.decode_append)
+        return web.json_response(await self.process_append_entries(data))
 
-        if data["term"] > self.current_term:
-            # If the term in the request is greater than the current term,
-            # update the current term and role, and reset voted_for.
-            self.current_term = data["term"]
-            self.voted_for = None
-            self.current_role = "FOLLOWER"
-            self.current_leader = data["leader_id"]
-            logger.warning(f"I am FOLLOWER for term {self.current_term}")
+    async def process_append_entries(self, data: RequestAppend) -> ResponseAppend:
+        """Handle AppendEntries RPC, also when it comes in a Host's batch of heartbeats."""
+        self.follow_leader(data["term"], data["leader_id"])
 
-        if data["term"] == self.current_term and self.current_role == "CANDIDATE":
-            # If the term is equal to the current term and the role is CANDIDATE,
-            # convert to FOLLOWER and set the current leader.
-            self.current_role = "FOLLOWER"
-            self.current_leader = data["leader_id"]
-            logger.warning(f"I am FOLLOWER for term {self.current_term}")
+        if data["log_length"] < self.log_base:
+            # the first entries are already part of our snapshot
+            data["entries"] = data["entries"][self.log_base - data["log_length"] :]
+            data["log_length"] = self.log_base
+            data["log_term"] = self.snapshot_term
 
-        log_term = self.log[data["log_length"] - 1][0] if data["log_length"] > 0 else 0
-        log_ok = (len(self.log) >= data["log_length"]) and (
-            data["log_length"] == 0 or log_term == data["log_term"]
+        log_ok = (self.log_length() >= data["log_length"]) and (
+            data["log_length"] == 0
+            or self.term_at(data["log_length"]) == data["log_term"]
         )
 
         if data["term"] == self.current_term and log_ok:
@@ -264,127 +1130,1032 @@ class Node:
                 data["log_length"], data["leader_commit"], data["entries"]
             )
             ack = data["log_length"] + len(data["entries"])
-            return web.json_response(
-                ResponseAppend(
-                    term=self.current_term,
-                    ack=ack,
-                    success=True,
-                )
+            matched_term, matched = self.matched
+            if matched_term != self.current_term:
+                matched = 0
+            # the leader's log only grows in its term, it still matches up to both
+            self.matched = (self.current_term, max(matched, ack))
+            self.quiesce(data["leader_commit"], data["entries"])
+            response = ResponseAppend(
+                term=self.current_term,
+                ack=ack,
+                success=True,
             )
         else:
-            bad = ResponseAppend(term=self.current_term, ack=0, success=False)
-            return web.json_response(bad)
+            response = ResponseAppend(term=self.current_term, ack=0, success=False)
+            if data["term"] == self.current_term:
+                response["conflict_term"], response["conflict_index"] = self.conflict(
+                    data["log_length"]
+                )
+        self.reset_election_timer()
+        # the new entries and term must survive a restart before we ack them
+        await self.storage.sync()
+        return response
+
+    async def handle_heartbeat(self, request: web.Request) -> web.Response:
+        data: RequestHeartbeat = await request.json()
+        return web.json_response(await self.process_heartbeat(data))
+
+    async def process_heartbeat(self, data: RequestHeartbeat) -> ResponseHeartbeat:
+        """Handle a heartbeat, also when it comes in a Host's batch of heartbeats.
+
+        The leader's commit length only applies to the part of our log known
+        to match its log, from an AppendEntries it sent in its term.
+        """
+        if data["term"] < self.current_term:
+            return ResponseHeartbeat(term=self.current_term, success=False)
+        term = self.current_term
+        self.follow_leader(data["term"], data["leader_id"])
+        matched_term, matched = self.matched
+        success = matched_term == self.current_term
+        if success:
+            self.quiesce(data["leader_commit"])
+            commit_length = min(data["leader_commit"], matched)
+            if commit_length > self.commit_length:
+                self.commit(commit_length)
+        self.reset_election_timer()
+        if self.current_term != term:
+            await self.storage.sync()  # the new term must survive a restart
+        return ResponseHeartbeat(term=self.current_term, success=success)
+
+    def quiesce(self, leader_commit: int, entries: Sequence[Any] = ()) -> None:
+        """Wait QUIESCE_TIMEOUT for the leader once it has committed all of
+        our log that matches its log: it sends us heartbeats less often then."""
+        self.quiescent = (
+            bool(self.quiesce_timeout)
+            and not entries
+            and leader_commit >= self.matched[1]
+        )
+
+    def follow_leader(self, term: int, leader_id: str) -> None:
+        """Recognize the sender of an AppendEntries or InstallSnapshot as leader."""
+        if term >= self.current_term:
+            now = monotonic()
+            if (
+                term == self.current_term
+                and leader_id == self.current_leader
+                and not self.quiescent  # a longer gap on purpose
+            ):
+                self.observe_heartbeat_gap(now - self.leader_heard_at)
+            self.leader_heard_at = now
+            self.current_leader = leader_id
+        if term > self.current_term:
+            self.step_down(term)
+            self.current_leader = leader_id
+
+        if term == self.current_term and self.current_role == "CANDIDATE":
+            # If the term is equal to the current term and the role is CANDIDATE,
+            # convert to FOLLOWER and set the current leader.
+            self.current_role = "FOLLOWER"
+            self.current_leader = leader_id
+            logger.warning(f"I am FOLLOWER for term {self.current_term}")
+
+    def conflict(self, log_length: int) -> Tuple[int, int]:
+        """Conflict hint for a rejected AppendEntries with prefix log_length."""
+        if self.log_length() < log_length:
+            return 0, self.log_length()
+        term = self.term_at(log_length)
+        # terms never decrease along the log
+        index = bisect_left(range(log_length - self.log_base), term, key=self.log.term)
+        return term, self.log_base + index
 
     def append_entries(
         self, log_length: int, leader_commit: int, entries: list[tuple[int, str]]
     ) -> None:
         """This function checks if the log length is valid, appends new entries, and updates the commit index."""
-        if len(entries) > 0 and len(self.log) > log_length:
-            if self.log[log_length][0] != entries[0][0]:
-                self.log = self.log[:log_length]
-        if log_length + len(entries) > len(self.log):
-            for entry in entries:
-                self.log.append((entry[0], entry[1]))
-        if leader_commit > self.commit_length:
-            for i in range(self.commit_length, leader_commit):
-                self.state_machine += self.log[i][1] + "_"
-            self.commit_length = leader_commit
+        if len(entries) > 0 and self.log_length() > log_length:
+            if self.term_at(log_length + 1) != entries[0][0]:
+                self.log.truncate(log_length - self.log_base)
+                self.storage.truncate(log_length)
+                self.drop_configs(log_length)
+                self.fail_commit_waiters(log_length)
+        if log_length + len(entries) > self.log_length():
+            new_entries = [
+                (entry[0], entry[1])
+                for entry in entries[self.log_length() - log_length :]
+            ]
+            self.track_configs(self.log_length(), new_entries)
+            self.storage.append(self.log_length(), new_entries)
+            self.log.extend(new_entries)
+        # entries after the ones just matched may still be from an old leader
+        commit_length = min(leader_commit, log_length + len(entries))
+        if commit_length > self.commit_length:
+            self.commit(commit_length)
+
+    def commit(self, length: int) -> None:
+        """Apply log entries up to length to the state machine and wake their waiters."""
+        for i in range(self.commit_length, length):
+            command = self.log.command(i - self.log_base)
+            if command == NOOP or command.startswith(CONFIG_PREFIX):
+                continue
+            if command.startswith(SESSION_PREFIX):
+                result = self.sessions.apply(
+                    i + 1, self.log.term(i - self.log_base), command, self.state_machine
+                )
+            else:
+                result = self.state_machine.apply(i + 1, command)
+            if i + 1 in self.apply_results:
+                self.apply_results[i + 1] = result
+            self.applied_bytes += len(command) + 1
+        self.commit_length = length
+        self.wake_commit_waiters()
+
+        if (
+            self.snapshot_entries
+            and self.commit_length - self.log_base >= self.snapshot_entries
+        ) or (self.snapshot_bytes and self.applied_bytes >= self.snapshot_bytes):
+            self.take_snapshot()
+
+    def wake_commit_waiters(self) -> None:
+        while self.apply_waiters and self.apply_waiters[0][0] <= self.commit_length:
+            _, _, waiter = heapq.heappop(self.apply_waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+        while self.commit_waiters and self.commit_waiters[0][0] <= self.commit_length:
+            index, _, term, future = heapq.heappop(self.commit_waiters)
+            if not future.done():
+                # another leader may have committed a different entry at index
+                future.set_result(
+                    index >= self.log_base and self.term_at(index) == term
+                )
+
+    def commit_waiter(self, index: int) -> asyncio.Future[bool]:
+        """Future resolved once the entry now at index is known to be committed or lost."""
+        future: asyncio.Future[bool] = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self.commit_waiters, (index, id(future), self.term_at(index), future)
+        )
+        return future
+
+    def fail_commit_waiters(self, length: int) -> None:
+        """Resolve the waiters of entries after length as lost, e.g. when they are
+        truncated or we stop leading."""
+        keep = []
+        for waiter in self.commit_waiters:
+            if waiter[0] <= length:
+                keep.append(waiter)
+            elif not waiter[3].done():
+                waiter[3].set_result(False)
+        heapq.heapify(keep)
+        self.commit_waiters = keep
+
+    def drop_commit_waiter(self, future: asyncio.Future[bool]) -> None:
+        """Forget a waiter nobody waits for any more."""
+        self.commit_waiters = [w for w in self.commit_waiters if w[3] is not future]
+        heapq.heapify(self.commit_waiters)
+
+    def take_snapshot(self) -> None:
+        """Snapshot the state machine at commit_length and drop the log prefix it covers."""
+        snapshot = Snapshot(
+            self.commit_length,
+            self.term_at(self.commit_length),
+            self.sessions.snapshot(self.state_machine.snapshot()),
+        )
+        self.storage.save_snapshot(snapshot)
+        del self.log[: snapshot.last_index - self.log_base]
+        self.storage.compact(snapshot.last_index)
+        self.log_base, self.snapshot_term = snapshot.last_index, snapshot.last_term
+        self.snapshot = snapshot
+        self.applied_bytes = 0
+        self.compact_configs(snapshot.last_index)
+        logger.info(f"Snapshot at {snapshot.last_index}")
+
+    def restore_snapshot(self, snapshot: Snapshot) -> None:
+        """Replace the state machine and the log prefix it covers with a snapshot."""
+        if self.log_base <= snapshot.last_index <= self.log_length() and (
+            snapshot.last_index == self.log_base
+            or self.term_at(snapshot.last_index) == snapshot.last_term
+        ):
+            # keep the entries that follow the snapshot
+            del self.log[: snapshot.last_index - self.log_base]
+            self.storage.compact(snapshot.last_index)
+        else:
+            self.log = LogStore()
+            self.storage.reset(snapshot.last_index)
+            self.fail_commit_waiters(snapshot.last_index)
+        self.log_base, self.snapshot_term = snapshot.last_index, snapshot.last_term
+        self.snapshot = snapshot
+        self.state_machine.restore(self.sessions.restore(snapshot.data))
+        self.commit_length = snapshot.last_index
+        self.applied_bytes = 0
+        self.wake_commit_waiters()
+
+    async def handle_install_snapshot(self, request: web.Request) -> web.Response:
+        """Handle one chunk of InstallSnapshot RPC, the chunks arrive in order."""
+        data: RequestSnapshot = await request.json()
+        self.reset_election_timer()
+        self.follow_leader(data["term"], data["leader_id"])
+
+        offset = 0
+        if data["term"] == self.current_term:
+            if data["offset"] == 0:
+                self.incoming_snapshot = bytearray()
+            if data["offset"] == len(self.incoming_snapshot):
+                self.incoming_snapshot += base64.b64decode(data["data"])
+                offset = len(self.incoming_snapshot)
+                if data["done"]:
+                    snapshot = Snapshot(
+                        data["last_index"],
+                        data["last_term"],
+                        bytes(self.incoming_snapshot),
+                    )
+                    self.incoming_snapshot = bytearray()
+                    if snapshot.last_index > self.commit_length:
+                        self.storage.save_snapshot(snapshot)
+                        self.restore_snapshot(snapshot)
+                        if "config" in data:
+                            self.restore_configs(snapshot.last_index, data["config"])
+                        logger.warning(f"Installed snapshot at {snapshot.last_index}")
+
+        await self.storage.sync()
+        return web.json_response(
+            ResponseSnapshot(term=self.current_term, offset=offset)
+        )
 
     async def handle_command(self, request: web.Request) -> web.Response:
-        async with self.command_lock:  # Ensure only one command processes at a time
-            request_data = await request.json()
-
-            if self.current_role == "LEADER":
-                command: str = request_data.get("command", "")
-                if command:
-                    self.log.append((self.current_term, command))
-                    self.acked_length[self.node_id] = len(self.log)
-
-                    logger.warning(f"Send commands '{command}'")
-
-                    # Create replication tasks for all nodes
-                    replication_tasks = [
-                        self.replicate_log(node) for node in self.nodes
-                    ]
-
-                    quorum: int = 1  # Start with 1 for the leader itself
-                    # Wait for all replications to complete
-                    for resp in asyncio.as_completed(replication_tasks):
-                        data: bool = await resp
-                        quorum += int(data)
-                    if quorum >= self.majority:
-                        text = f"OK: Command '{command}' added to log"
-                    else:
-                        text = "ERROR: Not enough quorum to commit the command"
+        request_data = await request.json()
+
+        if self.current_role == "LEADER":
+            command: str = request_data.get("command", "")
+            session = client_session(request_data)
+            if command.startswith(CONFIG_PREFIX):
+                text = "ERROR: Reserved command, use /membership"
+            elif command.startswith(SESSION_PREFIX):
+                text = "ERROR: Reserved command, send client_id and seq instead"
+            elif self.transfer_target:
+                text = (
+                    "ERROR: Leadership transfer in progress, retry with the new LEADER"
+                )
+            elif command:
+                outcome = await self.submit_command(command, session)
+                if outcome.result is SESSION_EXPIRED:
+                    text = (
+                        "ERROR: Session expired, the outcome of the command is"
+                        " unknown, start a new session"
+                    )
+                elif outcome.committed:
+                    text = f"OK: Command '{command}' added to log"
+                    if outcome.index:
+                        text += (
+                            f", committed at index {outcome.index}"
+                            f" in term {outcome.term}"
+                        )
                 else:
-                    text = "ERROR: No command"
+                    text = "ERROR: Not enough quorum to commit the command"
             else:
-                text = "ERROR: I am not a LEADER, cannot process command"
-            return web.Response(text=text)
+                text = "ERROR: No command"
+        else:
+            text = "ERROR: I am not a LEADER, cannot process command"
+        return web.Response(text=text)
 
-    async def replicate_log(self, follower_id: str) -> bool:
-        """Replicate log entries to a follower node."""
-        sent_length = self.sent_length[follower_id]
-        request_data = RequestAppend(
+    async def submit_command(
+        self, command: str, session: Optional[Tuple[str, int]] = None
+    ) -> Outcome:
+        """Queue a command for the next batch and wait until that batch is committed.
+
+        A command sent within a client session that was already applied is
+        answered from the session table instead, with the index and term it
+        was committed at. One the table can't tell about gets SESSION_EXPIRED.
+        """
+        if session is not None:
+            client_id, seq = session
+            applied = self.sessions.applied(client_id, seq)
+            if applied is not None:
+                return Outcome(True, *applied)
+            command = session_command(command, client_id, seq, time())
+        future: asyncio.Future[Outcome] = asyncio.get_running_loop().create_future()
+        self.pending_commands.append((command, future))
+        if self.batch_task is None or self.batch_task.done():
+            self.batch_task = asyncio.create_task(self.flush_commands())
+        try:
+            return await asyncio.wait_for(future, COMMAND_TIMEOUT)
+        except asyncio.TimeoutError:
+            return Outcome(False, None, 0, 0)
+
+    async def flush_commands(self) -> None:
+        """Append queued commands to the log and replicate them, one batch per round.
+
+        Commands that arrive while a round is in flight are queued and go out
+        together in the next round, so throughput grows with client concurrency
+        instead of being capped at one command per round trip. A round ends
+        once a majority has the batch, the slowest followers get it meanwhile.
+        """
+        async with self.command_lock:  # Ensure only one batch processes at a time
+            while self.pending_commands:
+                if self.batch_linger and len(self.pending_commands) < self.batch_size:
+                    await asyncio.sleep(self.batch_linger)
+                batch = self.pending_commands[: self.batch_size]
+                del self.pending_commands[: self.batch_size]
+
+                first = self.log_length() + 1  # index of the first command
+                term = self.current_term
+                if self.current_role != "LEADER" or self.transfer_target:
+                    self.resolve_batch(batch, first, term, False)
+                    continue
+                for index in range(first, first + len(batch)):
+                    self.apply_results[index] = None
+                self.storage.append(self.log_length(), [(term, c) for c, _ in batch])
+                for command, _ in batch:
+                    self.log.append((term, command))
+                committed = self.commit_waiter(self.log_length())
+
+                commands = "', '".join(command for command, _ in batch)
+                logger.warning(f"Send commands '{commands}'")
+
+                if self.replication_window > 1:
+                    # don't wait for this batch, the replication loops
+                    # pipeline it behind the batches already in flight
+                    committed.add_done_callback(
+                        lambda committed, batch=batch, first=first, term=term: (
+                            self.resolve_batch(batch, first, term, committed.result())
+                        )
+                    )
+                    for node in self.nodes:
+                        self.replication_events[node].set()
+                    asyncio.create_task(self.sync_own_log())
+                    continue
+
+                # Write to our own disk while sending to the followers
+                own_sync = asyncio.create_task(self.sync_own_log())
+
+                for node in self.nodes:
+                    self.replicate_batch(node, committed)
+                await own_sync
+
+                # wait until the batch is committed, losing leadership or the
+                # entries fails it; followers that answered without acking it
+                # may still ack it in a later round
+                await asyncio.wait([committed], timeout=COMMAND_TIMEOUT)
+                if not committed.done():
+                    self.drop_commit_waiter(committed)
+                self.resolve_batch(
+                    batch, first, term, committed.done() and committed.result()
+                )
+
+    def replicate_batch(
+        self, follower_id: str, committed: asyncio.Future[bool]
+    ) -> None:
+        """Send a batch waiting to be committed to a follower, one batch in
+        flight per follower: a follower still busy with an earlier one gets
+        it as soon as it is done."""
+        if committed.done():
+            return
+        task = self.replication_tasks.get(follower_id)
+        if task is None or task.done():
+            task = asyncio.create_task(self.replicate_log(follower_id))
+            self.replication_tasks[follower_id] = task
+        else:
+            task.add_done_callback(
+                lambda _: self.replicate_batch(follower_id, committed)
+            )
+
+    def resolve_batch(
+        self,
+        batch: List[Tuple[str, asyncio.Future[Outcome]]],
+        first: int,
+        term: int,
+        committed: bool,
+    ) -> None:
+        """Answer the commands of a batch, stored from index first on in term."""
+        for index, (_, future) in enumerate(batch, first):
+            result = self.apply_results.pop(index, None)
+            if not future.done():  # the client may have gone away
+                future.set_result(
+                    Outcome(True, result, index, term)
+                    if committed
+                    else Outcome(False, None, 0, 0)
+                )
+
+    async def read_index(self) -> Optional[int]:
+        """ReadIndex: the commit length a linearizable read has to observe.
+
+        A follower gets it from the leader and waits until it has applied the
+        entries up to it, so reads can be served by every node. Return None
+        if there is no leader that could confirm it.
+        """
+        if self.current_role == "LEADER":
+            return await self.leader_read_index()
+        index = await self.ask_read_index()
+        if index is None or not await self.wait_applied(index):
+            return None
+        return index
+
+    async def leader_read_index(self) -> Optional[int]:
+        if self.current_role != "LEADER":
+            return None
+        if self.term_at(self.commit_length) != self.current_term:
+            # until an entry of our term is committed we may not know about
+            # every entry an earlier leader committed, commit a no-op first
+            if self.noop_task is None or self.noop_task.done():
+                self.noop_task = asyncio.create_task(self.submit_command(NOOP))
+            if not (await asyncio.shield(self.noop_task)).committed:
+                return None
+        index = self.commit_length
+        if self.read_mode == "lease" and self.lease_valid():
+            return index
+        if not await self.confirm_leadership():
+            return None
+        # the leader applies entries as it commits them
+        return index
+
+    async def handle_read_index(self, request: web.Request) -> web.Response:
+        """Give a follower the read index for the reads it is serving."""
+        index = await self.leader_read_index()
+        return web.json_response(
+            ResponseReadIndex(
+                term=self.current_term, read_index=-1 if index is None else index
+            )
+        )
+
+    async def ask_read_index(self) -> Optional[int]:
+        """Read index from the leader, from a request sent after this call.
+
+        Every read waiting at the same time shares the same request.
+        """
+        future: asyncio.Future[Optional[int]] = (
+            asyncio.get_running_loop().create_future()
+        )
+        self.index_waiters.append(future)
+        if self.index_task is None or self.index_task.done():
+            self.index_task = asyncio.create_task(self.ask_read_index_rounds())
+        return await future
+
+    async def ask_read_index_rounds(self) -> None:
+        while self.index_waiters:
+            waiters, self.index_waiters = self.index_waiters, []
+            index: Optional[int] = None
+            if self.current_leader and self.current_leader != self.node_id:
+                try:
+                    data: ResponseReadIndex = await self.transport.post(
+                        self.current_leader, "/read_index", {}, COMMAND_TIMEOUT
+                    )
+                    if data["read_index"] >= 0:
+                        index = data["read_index"]
+                except Exception:
+                    logger.info(f"FAILED ReadIndex from '{self.current_leader}'")
+            for future in waiters:
+                if not future.done():
+                    future.set_result(index)
+
+    async def wait_applied(self, index: int) -> bool:
+        """Wait until the entries up to index are applied, False on timeout."""
+        if self.commit_length >= index:
+            return True
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.apply_waiters, (index, id(future), future))
+        try:
+            await asyncio.wait_for(future, COMMAND_TIMEOUT)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def lease_valid(self) -> bool:
+        """Whether no other node can have become leader, without asking anyone.
+
+        Followers don't vote for ELECTION_TIMEOUT after they last heard from
+        us, so we stay the only leader until then, counted from the send time
+        of the requests a majority acked.
+        """
+        if self.current_role != "LEADER" or self.transfer_target:
+            # the node we hand over to doesn't wait for our lease to expire
+            return False
+        acks = sorted((self.lease_acks.get(n, 0.0) for n in self.voters), reverse=True)
+        needed = self.majority - 1  # we count for ourselves
+        start = acks[needed - 1] if needed else monotonic()
+        return monotonic() < start + ELECTION_TIMEOUT - self.lease_drift
+
+    def renew_lease(self, follower_id: str, sent_at: float) -> None:
+        if sent_at <= self.lease_revoked_at:
+            return
+        self.lease_acks[follower_id] = max(
+            self.lease_acks.get(follower_id, 0.0), sent_at
+        )
+
+    async def confirm_leadership(self) -> bool:
+        """Wait for a heartbeat round started after this call to reach a majority.
+
+        Every read waiting at the same time shares the same round.
+        """
+        future: asyncio.Future[bool] = asyncio.get_running_loop().create_future()
+        self.read_waiters.append(future)
+        if self.read_task is None or self.read_task.done():
+            self.read_task = asyncio.create_task(self.confirm_rounds())
+        return await future
+
+    async def confirm_rounds(self) -> None:
+        while self.read_waiters:
+            waiters, self.read_waiters = self.read_waiters, []
+            confirmed = await self.confirm_round()
+            for future in waiters:
+                if not future.done():
+                    future.set_result(confirmed)
+
+    async def confirm_round(self) -> bool:
+        """Send one empty AppendEntries to every follower and count who still follows us."""
+        term = self.current_term
+        confirmed = 1  # ourselves
+        if confirmed >= self.majority:
+            return self.current_role == "LEADER"
+        sent_at = monotonic()
+
+        async def confirm(node: str, request_data: RequestAppend) -> ResponseAppend:
+            data = await self.post_append_entries(node, request_data)
+            if data["term"] == term:
+                self.renew_lease(node, sent_at)
+            return data
+
+        requests = []
+        for node in self.voters:
+            length = min(max(self.sent_length[node], self.log_base), self.log_length())
+            request_data = RequestAppend(
+                leader_id=self.node_id,
+                term=term,
+                log_length=length,
+                log_term=self.term_at(length),
+                leader_commit=self.commit_length,
+                entries=[],
+            )
+            requests.append(confirm(node, request_data))
+        for resp in asyncio.as_completed(requests):
+            try:
+                data: ResponseAppend = await resp
+            except Exception:
+                continue
+            if data["term"] > self.current_term:
+                self.step_down(data["term"])
+                return False
+            # even a rejection in our term shows the follower has no newer leader
+            if data["term"] == term:
+                confirmed += 1
+                if confirmed >= self.majority:
+                    break
+        return (
+            confirmed >= self.majority
+            and self.current_role == "LEADER"
+            and self.current_term == term
+        )
+
+    async def handle_read(self, request: web.Request) -> web.Response:
+        """Linearizable read of the state machine, with the /state_machine query."""
+        if await self.read_index() is None:
+            return self.no_read_index()
+        try:
+            data = self.state_machine.read(request.query)
+        except KeyError as error:
+            raise web.HTTPNotFound(text=f"ERROR: Not found {error}")
+        except ValueError as error:
+            raise web.HTTPBadRequest(text=f"ERROR: Bad query {error}")
+        return web.json_response(data)
+
+    def not_leader(self) -> web.Response:
+        return web.json_response(
+            {"error": "not leader", "leader": self.current_leader}, status=421
+        )
+
+    def no_read_index(self) -> web.Response:
+        return web.json_response(
+            {"error": "no read index", "leader": self.current_leader}, status=503
+        )
+
+    async def handle_kv_get(self, request: web.Request) -> web.Response:
+        """Linearizable read of one key."""
+        if not isinstance(self.state_machine, KVStateMachine):
+            raise web.HTTPNotFound(text="ERROR: No key-value store")
+        if await self.read_index() is None:
+            return self.no_read_index()
+        key = request.match_info["key"]
+        if key not in self.state_machine.data:
+            raise web.HTTPNotFound(text=f"ERROR: No key '{key}'")
+        return web.json_response({"key": key, "value": self.state_machine.data[key]})
+
+    async def handle_kv_put(self, request: web.Request) -> web.Response:
+        request_data = await request.json()
+        if "value" not in request_data:
+            raise web.HTTPBadRequest(text="ERROR: No value")
+        return await self.kv_command(
+            {
+                "op": "put",
+                "key": request.match_info["key"],
+                "value": request_data["value"],
+            },
+            client_session(request_data),
+        )
+
+    async def handle_kv_delete(self, request: web.Request) -> web.Response:
+        request_data = await request.json() if request.can_read_body else {}
+        return await self.kv_command(
+            {"op": "delete", "key": request.match_info["key"]},
+            client_session(request_data),
+        )
+
+    async def handle_kv_cas(self, request: web.Request) -> web.Response:
+        """Set the key to value if it holds expected, null expects it absent."""
+        request_data = await request.json()
+        if "value" not in request_data:
+            raise web.HTTPBadRequest(text="ERROR: No value")
+        return await self.kv_command(
+            {
+                "op": "cas",
+                "key": request.match_info["key"],
+                "expected": request_data.get("expected"),
+                "value": request_data["value"],
+            },
+            client_session(request_data),
+        )
+
+    async def kv_command(
+        self, command: Dict[str, Any], session: Optional[Tuple[str, int]] = None
+    ) -> web.Response:
+        """Commit a key-value command and answer with the result of applying it."""
+        if not isinstance(self.state_machine, KVStateMachine):
+            raise web.HTTPNotFound(text="ERROR: No key-value store")
+        if self.current_role != "LEADER":
+            return self.not_leader()
+        if self.transfer_target:
+            return web.json_response({"error": "leadership transfer"}, status=503)
+        outcome = await self.submit_command(json.dumps(command), session)
+        if outcome.result is SESSION_EXPIRED:
+            return web.json_response({"error": "session expired"}, status=400)
+        if not outcome.committed:
+            return web.json_response({"error": "not committed"}, status=503)
+        return web.json_response(outcome.result)
+
+    def append_request(self, sent_length: int, max_bytes: int = 0) -> RequestAppend:
+        """AppendEntries request for the log suffix starting at sent_length.
+
+        The suffix holds at most append_max_entries entries, and is cut after
+        the first entry that reaches max_bytes or append_max_bytes.
+        """
+        start, stop = sent_length - self.log_base, len(self.log)
+        if self.append_max_entries:
+            stop = min(stop, start + self.append_max_entries)
+        max_bytes = min(filter(None, (max_bytes, self.append_max_bytes)), default=0)
+        if max_bytes:
+            ends = range(start + 1, stop + 1)
+            cut = bisect_left(
+                ends, max_bytes, key=lambda end: entries_size(self.log, start, end)
+            )
+            stop = min(stop, start + 1 + cut)
+        return RequestAppend(
             leader_id=self.node_id,
             term=self.current_term,
             log_length=sent_length,
-            log_term=self.log[sent_length - 1][0] if sent_length > 0 else 0,
+            log_term=self.term_at(sent_length),
+            leader_commit=self.commit_length,
+            entries=self.log.view(start, stop),
+        )
+
+    def process_append_response(
+        self,
+        follower_id: str,
+        request_data: RequestAppend,
+        data: ResponseAppend,
+        sent_at: float = 0.0,
+    ) -> bool:
+        """Update the replication state from a follower's reply to a request sent at sent_at.
+
+        Return False if the follower rejected the entries because its log does
+        not match ours at request_data["log_length"].
+        """
+        if follower_id not in self.acked_length:
+            return True  # removed from the cluster while the request was in flight
+        if data["term"] == self.current_term and self.current_role == "LEADER":
+            self.renew_lease(follower_id, sent_at)
+            if data["success"]:
+                if data["ack"] >= self.acked_length[follower_id]:
+                    # Update sent and acked lengths
+                    self.sent_length[follower_id] = max(
+                        self.sent_length[follower_id], data["ack"]
+                    )
+                    self.acked_length[follower_id] = data["ack"]
+                    self.advance_commit()
+                self.ack_commit(
+                    follower_id, min(request_data["leader_commit"], data["ack"])
+                )
+            else:
+                self.sent_length[follower_id] = min(
+                    self.sent_length[follower_id],
+                    self.backtrack(request_data["log_length"], data),
+                )
+                return False
+        elif data["term"] > self.current_term:
+            # If the term in the response is greater, update current term and role
+            self.step_down(data["term"])
+        return True
+
+    def ack_commit(self, follower_id: str, commit_length: int) -> None:
+        self.commit_acked[follower_id] = max(
+            self.commit_acked.get(follower_id, 0), commit_length
+        )
+
+    def heartbeat_request(self) -> RequestHeartbeat:
+        return RequestHeartbeat(
+            term=self.current_term,
+            leader_id=self.node_id,
             leader_commit=self.commit_length,
-            entries=self.log[sent_length:],
         )
 
-        url = f"http://{follower_id}:8080/append_entries"
+    async def post_heartbeat(
+        self, follower_id: str, request_data: RequestHeartbeat
+    ) -> ResponseHeartbeat:
+        data: ResponseHeartbeat = await self.transport.post(
+            follower_id, "/heartbeat", request_data, self.heartbeat_timeout
+        )
+        return data
+
+    async def send_heartbeat(self, follower_id: str) -> bool:
+        """Send a heartbeat to a follower that has our whole log.
+
+        If the follower can't take it, it gets AppendEntries instead.
+        """
+        request_data = self.heartbeat_request()
+        sent_at = monotonic()
+        try:
+            data = await self.post_heartbeat(follower_id, request_data)
+        except Exception:
+            return False
+        if not self.process_heartbeat_response(
+            follower_id, request_data, data, sent_at
+        ):
+            return await self.replicate_log(follower_id)
+        return True
+
+    def process_heartbeat_response(
+        self,
+        follower_id: str,
+        request_data: RequestHeartbeat,
+        data: ResponseHeartbeat,
+        sent_at: float = 0.0,
+    ) -> bool:
+        """Update the replication state from a follower's reply to a heartbeat.
+
+        Return False if the follower needs AppendEntries to match our log.
+        """
+        if follower_id not in self.acked_length:
+            return True  # removed from the cluster while the request was in flight
+        if data["term"] == self.current_term and self.current_role == "LEADER":
+            self.renew_lease(follower_id, sent_at)
+            if not data["success"]:
+                # it restarted, or missed our AppendEntries: match our logs again
+                self.sent_length[follower_id] = self.log_length()
+                self.acked_length[follower_id] = 0
+                self.commit_acked.pop(follower_id, None)
+                return False
+            self.ack_commit(
+                follower_id,
+                min(request_data["leader_commit"], self.acked_length[follower_id]),
+            )
+        elif data["term"] > self.current_term:
+            self.step_down(data["term"])
+        return True
+
+    def backtrack(self, log_length: int, data: ResponseAppend) -> int:
+        """Length of the log prefix to try next after a rejected log_length."""
+        if "conflict_index" not in data:
+            # follower without conflict hints, step back one entry
+            return max(0, log_length - 1)
+        index = data["conflict_index"]
+        if data["conflict_term"]:
+            # if we have entries of the conflicting term, the logs may match
+            # up to our last one of them, otherwise skip the whole term
+            last = self.log_base + bisect_right(
+                range(max(0, log_length - self.log_base)),
+                data["conflict_term"],
+                key=self.log.term,
+            )
+            if last > self.log_base and self.term_at(last) == data["conflict_term"]:
+                index = last
+        return max(0, min(index, log_length - 1))
+
+    async def replicate_log(self, follower_id: str) -> bool:
+        """Replicate log entries to a follower node.
+
+        A follower that is behind catches up chunk by chunk, each chunk is
+        acked before the next one is sent, until it has the log we had when
+        we started or we stop leading.
+        """
+        term, target = self.current_term, self.log_length()
+        while True:
+            if follower_id not in self.nodes:
+                return False  # removed from the cluster
+            if self.sent_length[follower_id] < self.log_base:
+                # the follower needs entries we have compacted away
+                if not await self.send_snapshot(follower_id):
+                    return False
+                continue
+            request_data = self.append_request(self.sent_length[follower_id])
+            sent_at = monotonic()
+            try:
+                data = await self.post_append_entries(follower_id, request_data)
+            except Exception:
+                return False
+            if not self.process_append_response(
+                follower_id, request_data, data, sent_at
+            ):
+                if request_data["log_length"] == 0:
+                    return True
+                # Retry replication from where the follower's log may match
+                continue
+            if (
+                self.current_role != "LEADER"
+                or self.current_term != term
+                or data["term"] != term
+                or self.acked_length[follower_id] >= target
+            ):
+                return True
+            logger.info(
+                f"Catching up '{follower_id}': "
+                f"{self.acked_length[follower_id]} of {target} entries"
+            )
+
+    async def replication_loop(self, follower_id: str, term: int) -> None:
+        """Pipelined replication to one follower for as long as we lead in term.
+
+        New entries are sent as soon as they are appended, without waiting for
+        the acks of the requests already in flight, as long as the follower has
+        fewer than replication_window requests and replication_window_bytes
+        bytes of entries outstanding. sent_length is advanced optimistically and
+        moved back by process_append_response when the follower rejects.
+        """
+        event = self.replication_events[follower_id]
+        in_flight: Dict[asyncio.Task[bool], int] = {}  # request -> bytes
+
+        def done(task: asyncio.Task[bool]) -> None:
+            in_flight.pop(task, None)
+            if not task.cancelled() and task.result():
+                event.set()  # otherwise wait for the next heartbeat to retry
+
+        while (
+            self.current_role == "LEADER"
+            and self.current_term == term
+            and follower_id in self.nodes
+        ):
+            try:
+                await asyncio.wait_for(event.wait(), self.heartbeat_timeout)
+            except asyncio.TimeoutError:
+                continue
+            event.clear()
+            while (
+                self.current_role == "LEADER"
+                and self.current_term == term
+                and follower_id in self.nodes
+                and len(in_flight) < self.replication_window
+            ):
+                sent_length = self.sent_length[follower_id]
+                budget = self.replication_window_bytes - sum(in_flight.values())
+                if sent_length < self.log_base:
+                    # the follower needs entries we have compacted away
+                    if in_flight or not await self.send_snapshot(follower_id):
+                        break
+                    continue
+                if sent_length < self.log_length() and (budget > 0 or not in_flight):
+                    request_data = self.append_request(sent_length, max(budget, 1))
+                elif follower_id in self.heartbeat_due and not in_flight:
+                    request_data = self.append_request(sent_length)
+                else:
+                    break
+                self.heartbeat_due.discard(follower_id)
+                self.sent_length[follower_id] = sent_length + len(
+                    request_data["entries"]
+                )
+                task = asyncio.create_task(
+                    self.send_append_entries(follower_id, request_data)
+                )
+                start = sent_length - self.log_base
+                in_flight[task] = entries_size(
+                    self.log, start, start + len(request_data["entries"])
+                )
+                task.add_done_callback(done)
+
+        for task in in_flight:
+            task.cancel()
+
+    async def post_append_entries(
+        self, follower_id: str, request_data: RequestAppend
+    ) -> ResponseAppend:
+        """Send an AppendEntries request, in the binary codec if the follower takes it.
+
+        Requests with entries may carry a full chunk of them, up to the last
+        one of a catch-up, and get catchup_timeout to deliver it.
+        """
+        timeout = self.heartbeat_timeout
+        if request_data["entries"]:
+            timeout = self.catchup_timeout
+
+        def encode() -> bytes:
+            entries = request_data["entries"]
+            if isinstance(entries, LogSlice):
+                # views of our log, this fails if the entries have left it since
+                return codec.encode_append(request_data, entries.columns())
+            return codec.encode_append(request_data, codec.encode_entries(entries))
+
+        data: ResponseAppend = await self.transport.post(
+            follower_id, "/append_entries", request_data, timeout, encode
+        )
+        return data
+
+    async def send_append_entries(
+        self, follower_id: str, request_data: RequestAppend
+    ) -> bool:
+        """Send one pipelined AppendEntries request and process the reply.
+
+        Return False if the follower could not be reached.
+        """
+        sent_at = monotonic()
         try:
-            async with ClientSession() as session:
-                async with session.post(
-                    url, json=request_data, timeout=ClientTimeout(HEARTBEAT_TIMEOUT)
-                ) as resp:
-                    data: ResponseAppend = await resp.json()
-
-                    # Process the response from the follower
-                    if (
-                        data["term"] == self.current_term
-                        and self.current_role == "LEADER"
-                    ):
-                        if (
-                            data["success"]
-                            and data["ack"] >= self.acked_length[follower_id]
-                        ):
-                            # Update sent and acked lengths
-                            self.sent_length[follower_id] = data["ack"]
-                            self.acked_length[follower_id] = data["ack"]
-
-                            ready = {
-                                r
-                                for r in range(1, len(self.log) + 1)
-                                if self.acks(r) >= self.majority
-                            }
-                            if (
-                                ready
-                                and max(ready) > self.commit_length
-                                and self.log[max(ready) - 1][0] == self.current_term
-                            ):
-                                for i in range(self.commit_length, max(ready)):
-                                    self.state_machine += self.log[i][1] + "_"
-                                self.commit_length = max(ready)
-
-                        elif self.sent_length[follower_id] > 0:
-                            # Decrease sent length and retry replication
-                            self.sent_length[follower_id] -= 1
-                            await self.replicate_log(follower_id)
-                    elif data["term"] > self.current_term:
-                        # If the term in the response is greater, update current term and role
-                        self.current_term = data["term"]
-                        self.current_role = "FOLLOWER"
-                        self.voted_for = None
-                        logger.warning(f"I am FOLLOWER for term {self.current_term}")
+            data = await self.post_append_entries(follower_id, request_data)
         except Exception:
+            # the entries are lost in transit, send them again
+            self.sent_length[follower_id] = min(
+                self.sent_length[follower_id], request_data["log_length"]
+            )
             return False
+        self.process_append_response(follower_id, request_data, data, sent_at)
         return True
 
-    def acks(self, length: int) -> int:
-        return len({k for k, v in self.acked_length.items() if v >= length})
+    async def send_snapshot(self, follower_id: str) -> bool:
+        """Stream our snapshot to a follower, one chunk per InstallSnapshot request.
+
+        Return False if the transfer did not complete, it is retried from the
+        first chunk on the next round.
+        """
+        if self.snapshot is None or follower_id in self.snapshot_transfers:
+            return False
+        snapshot, term = self.snapshot, self.current_term
+        self.snapshot_transfers.add(follower_id)
+        try:
+            offset = 0
+            while True:
+                chunk = snapshot.data[offset : offset + self.snapshot_chunk_size]
+                request_data = RequestSnapshot(
+                    term=term,
+                    leader_id=self.node_id,
+                    last_index=snapshot.last_index,
+                    last_term=snapshot.last_term,
+                    offset=offset,
+                    data=base64.b64encode(chunk).decode(),
+                    done=offset + len(chunk) >= len(snapshot.data),
+                    config=self.config_at(snapshot.last_index),
+                )
+                try:
+                    data: ResponseSnapshot = await self.transport.post(
+                        follower_id,
+                        "/install_snapshot",
+                        request_data,
+                        self.catchup_timeout,
+                    )
+                except Exception:
+                    return False
+                if data["term"] > self.current_term:
+                    self.step_down(data["term"])
+                    return False
+                offset += len(chunk)
+                if (
+                    self.current_role != "LEADER"
+                    or self.current_term != term
+                    or data["offset"] != offset
+                ):
+                    return False
+                if request_data["done"]:
+                    break
+        finally:
+            self.snapshot_transfers.discard(follower_id)
+
+        if follower_id not in self.nodes:
+            return False  # removed from the cluster meanwhile
+        self.sent_length[follower_id] = max(
+            self.sent_length[follower_id], snapshot.last_index
+        )
+        self.acked_length[follower_id] = max(
+            self.acked_length[follower_id], snapshot.last_index
+        )
+        return True
+
+    async def sync_own_log(self) -> None:
+        """Count the leader's own entries towards the quorum once they are durable."""
+        length = self.log_length()
+        await self.storage.sync()
+        if self.current_role == "LEADER" and length > self.acked_length[self.node_id]:
+            self.acked_length[self.node_id] = length
+            self.advance_commit()
+
+    def advance_commit(self) -> None:
+        # only entries of the current term are committed by counting
+        ready = self.quorum_length()
+        if ready > self.commit_length and self.term_at(ready) == self.current_term:
+            self.commit(ready)
+
+    def quorum_length(self) -> int:
+        """Length of the longest log prefix acknowledged by a majority of the nodes.
+
+        That is the majority-th largest acked length, so the cost depends on the
+        cluster size only, not on the length of the log.
+        """
+        acked = sorted(
+            (self.acked_length.get(node, 0) for node in [self.node_id] + self.voters),
+            reverse=True,
+        )
+        return acked[self.majority - 1] if len(acked) >= self.majority else 0
 
     async def handle_root(self, request: web.Request) -> web.Response:
         # returns node status
@@ -393,11 +2164,22 @@ class Node:
                 f"Node  : {self.node_id}\n"
                 f"Role  : {self.current_role}\n"
                 f"Term  : {self.current_term}\n"
-                f"Log   : {self.log}\n"
+                f"Log   : {self.log_length()} entries\n"
+                f"Log Base      : {self.log_base}\n"
+                f"Members       : {self.configs[-1][1]['members']}\n"
+                f"Learners      : {self.configs[-1][1]['learners']}\n"
                 # "-\n"
                 f"Sent Length   : {self.sent_length}\n"
                 f"Acked Length  : {self.acked_length}\n"
                 f"Commit Length : {self.commit_length}\n"
-                f"State Machine : {self.state_machine}\n"
+                f"State Machine : {len(self.state_machine)} commands\n"
             )
         )
+
+    async def handle_state_machine(self, request: web.Request) -> web.Response:
+        """Read the applied state, e.g. GET /state_machine?offset=0&limit=100."""
+        try:
+            data = self.state_machine.read(request.query)
+        except (KeyError, ValueError) as error:
+            raise web.HTTPBadRequest(text=f"ERROR: Bad query {error}")
+        return web.json_response(data)
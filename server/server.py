@@ -2,6 +2,7 @@ import os
 import socket
 import asyncio
 from raft_node import Node
+from host import GROUPS, Host
 
 # import logging
 
@@ -35,10 +36,19 @@ async def main():
     if node_name in servers:
         servers.remove(node_name)
 
-    node = Node(node_name, servers)
+    if GROUPS:
+        # Multi-Raft: GROUPS independent Raft groups on every server
+        node = Host(node_name, servers, GROUPS)
+    else:
+        # a node added to a running cluster (POST /membership on the leader)
+        # is started with JOIN=1 and waits for the leader to send it the members
+        node = Node(node_name, servers, joining=os.getenv("JOIN") == "1")
     await node.start()
-    while True:
-        await asyncio.sleep(3600)  # keep running
+    try:
+        while True:
+            await asyncio.sleep(3600)  # keep running
+    finally:
+        await node.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,268 @@
+import os
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+# commands per chunk of LogStateMachine, and the largest page a read returns
+CHUNK_SIZE = int(os.getenv("STATE_MACHINE_CHUNK_SIZE", 4096))
+PAGE_SIZE = int(os.getenv("STATE_MACHINE_PAGE_SIZE", 1000))
+# client sessions idle for SESSION_TIMEOUT seconds of leader time are dropped,
+# and at most SESSION_MAX_CLIENTS are kept, the least recently used go first
+SESSION_TIMEOUT = float(os.getenv("SESSION_TIMEOUT", 3600))
+SESSION_MAX_CLIENTS = int(os.getenv("SESSION_MAX_CLIENTS", 10_000))
+# Log entries of commands sent within a client session, e.g.
+# {"session": ["client-1", 7, 1712000000.0], "command": "msg1"}: client id,
+# sequence number and the leader's clock when it appended the entry.
+SESSION_PREFIX = '{"session": '
+# A snapshot taken once sessions are used starts with this line and one with
+# the table. No JSON starts with a NUL byte, so it can't be mistaken for the
+# snapshot of a state machine.
+SESSIONS_HEADER = b"\x00sessions\n"
+
+MISSING = object()
+# what a command within a session gets when the table can't tell whether it
+# was applied: its session expired or was evicted, or the client sent later
+# commands since and only the last result is kept
+SESSION_EXPIRED = object()
+
+
+class StateMachine(ABC):
+    """What a node builds from its committed log entries.
+
+    apply() is called once for every committed entry, in log order, on every
+    node, so implementations must be deterministic. A subclass that misses a
+    method can't be instantiated.
+    """
+
+    @abstractmethod
+    def apply(self, index: int, command: str) -> Any:
+        """Apply the command of the log entry at index (counting from 1)."""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Size of the state, e.g. the number of commands or keys."""
+
+    @abstractmethod
+    def read(self, query: Mapping[str, str]) -> Any:
+        """Answer a read from the GET /state_machine query parameters, as JSON."""
+
+    @abstractmethod
+    def snapshot(self) -> bytes:
+        """Serialize the whole state."""
+
+    @abstractmethod
+    def restore(self, data: bytes) -> None:
+        """Replace the state with one serialized by snapshot()."""
+
+
+class LogStateMachine(StateMachine):
+    """Keeps every applied command, in order.
+
+    The commands are stored in chunks of CHUNK_SIZE, so applying one never
+    copies the ones before it, and reads return pages of them by position.
+    str() gives the classic "_msg1_msg2_" view of the whole state.
+    """
+
+    def __init__(self, commands: Iterable[str] = ()):
+        self.chunks: List[List[str]] = []
+        self.length = 0
+        for command in commands:
+            self.append(command)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __str__(self) -> str:
+        return "_" + "".join(
+            command + "_" for chunk in self.chunks for command in chunk
+        )
+
+    def append(self, command: str) -> None:
+        if not self.chunks or len(self.chunks[-1]) >= CHUNK_SIZE:
+            self.chunks.append([])
+        self.chunks[-1].append(command)
+        self.length += 1
+
+    def apply(self, index: int, command: str) -> None:
+        self.append(command)
+
+    def commands(self, offset: int, limit: int) -> List[str]:
+        """Up to limit commands, starting with the one at position offset."""
+        page: List[str] = []
+        offset = max(offset, 0)
+        end = min(offset + limit, self.length)
+        while offset < end:
+            chunk = self.chunks[offset // CHUNK_SIZE]
+            start = offset % CHUNK_SIZE
+            page.extend(chunk[start : start + end - offset])
+            offset += len(chunk) - start
+        return page
+
+    def read(self, query: Mapping[str, str]) -> Any:
+        offset = int(query.get("offset", 0))
+        limit = min(int(query.get("limit", PAGE_SIZE)), PAGE_SIZE)
+        return {
+            "offset": offset,
+            "commands": self.commands(offset, limit),
+            "total": self.length,
+        }
+
+    def snapshot(self) -> bytes:
+        return json.dumps(
+            [command for chunk in self.chunks for command in chunk]
+        ).encode()
+
+    def restore(self, data: bytes) -> None:
+        self.chunks = []
+        self.length = 0
+        for command in json.loads(data):
+            self.append(command)
+
+
+class KVStateMachine(StateMachine):
+    """Key-value store updated by JSON commands:
+
+    {"op": "put", "key": k, "value": v}
+    {"op": "delete", "key": k}
+    {"op": "cas", "key": k, "expected": old, "value": new}, expected null
+    means the key must be absent
+
+    Only the live keys are kept, so memory does not grow with the history.
+    Any other command is ignored the same way on every node.
+    """
+
+    def __init__(self) -> None:
+        self.data: Dict[str, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def apply(self, index: int, command: str) -> Any:
+        try:
+            op = json.loads(command)
+            kind, key = op["op"], op["key"]
+        except (ValueError, TypeError, KeyError):
+            return None
+        if not isinstance(key, str):
+            return None
+        if kind == "put":
+            self.data[key] = op.get("value")
+            return {"ok": True}
+        if kind == "delete":
+            return {"ok": self.data.pop(key, MISSING) is not MISSING}
+        if kind == "cas":
+            current = self.data.get(key)
+            if current != op.get("expected"):
+                return {"ok": False, "value": current}
+            self.data[key] = op.get("value")
+            return {"ok": True}
+        return None
+
+    def read(self, query: Mapping[str, str]) -> Any:
+        key = query["key"]
+        return {"key": key, "value": self.data[key]}
+
+    def snapshot(self) -> bytes:
+        return json.dumps(self.data).encode()
+
+    def restore(self, data: bytes) -> None:
+        self.data = json.loads(data)
+
+
+def session_command(command: str, client_id: str, seq: int, now: float) -> str:
+    return json.dumps({"session": [client_id, seq, now], "command": command})
+
+
+class Sessions:
+    """Last sequence number each client had applied, and what applying it returned.
+
+    A client numbers its commands 1, 2, 3, ... and retries one until it is
+    answered, so a command numbered at most the last applied one is a
+    duplicate: it is not applied again and its retries get the cached result.
+    A client without a session may only start one with command 1, a later
+    command may be a retry of one applied before its session was dropped,
+    so it is refused with SESSION_EXPIRED and the client starts a new session.
+    The table is changed only by applying session entries, and expires
+    sessions by the time the leader wrote into them, so every node evicts
+    the same sessions at the same entry.
+    """
+
+    def __init__(
+        self, timeout: float = SESSION_TIMEOUT, max_clients: int = SESSION_MAX_CLIENTS
+    ):
+        self.timeout = timeout
+        self.max_clients = max_clients
+        # client id -> [sequence number, result, last used, index, term] of the
+        # last command applied, least recently used first
+        self.clients: Dict[str, List[Any]] = {}
+        self.now = 0.0  # latest leader time applied
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def applied(self, client_id: str, seq: int) -> Optional[Tuple[Any, int, int]]:
+        """Result, log index and term of the client's command seq if it was
+        applied, None if it may be applied now."""
+        session = self.clients.get(client_id)
+        if session is None:
+            return None if seq == 1 else (SESSION_EXPIRED, 0, 0)
+        if seq > session[0]:
+            return None
+        if seq < session[0]:
+            return SESSION_EXPIRED, 0, 0  # only the last result is kept
+        return session[1], session[3], session[4]
+
+    def apply(
+        self, index: int, term: int, command: str, state_machine: StateMachine
+    ) -> Any:
+        """Apply the command of a session entry at index, unless it is a duplicate
+        or its session expired."""
+        entry = json.loads(command)
+        client_id, seq, now = entry["session"]
+        self.expire(now)
+        applied = self.applied(client_id, seq)
+        if applied is not None and applied[0] is SESSION_EXPIRED:
+            return SESSION_EXPIRED
+        if applied is not None:
+            result = applied[0]
+            session = self.clients.pop(client_id)
+            session[2] = self.now
+        else:
+            result = state_machine.apply(index, entry["command"])
+            self.clients.pop(client_id, None)
+            session = [seq, result, self.now, index, term]
+        # the most recently used go last
+        self.clients[client_id] = session
+        while len(self.clients) > self.max_clients:
+            del self.clients[next(iter(self.clients))]
+        return result
+
+    def expire(self, now: float) -> None:
+        # leader clocks may differ, time never goes back within the table
+        self.now = max(self.now, now)
+        for client_id, (_, _, used, _, _) in list(self.clients.items()):
+            if used >= self.now - self.timeout:
+                break
+            del self.clients[client_id]
+
+    def snapshot(self, state: bytes) -> bytes:
+        """The state machine's snapshot, after the table once it is used."""
+        if not self.now:  # no sessions yet
+            return state
+        table = {"clients": self.clients, "now": self.now}
+        return SESSIONS_HEADER + json.dumps(table).encode() + b"\n" + state
+
+    def restore(self, data: bytes) -> bytes:
+        """Restore the table from a snapshot and return the state machine's part."""
+        self.clients, self.now = {}, 0.0
+        if data.startswith(SESSIONS_HEADER):
+            head, _, data = data[len(SESSIONS_HEADER) :].partition(b"\n")
+            table = json.loads(head)
+            self.clients, self.now = table["clients"], table["now"]
+        return data
+
+
+STATE_MACHINES: Dict[str, Callable[[], StateMachine]] = {
+    "log": LogStateMachine,
+    "kv": KVStateMachine,
+}
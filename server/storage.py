@@ -0,0 +1,430 @@
+import os
+import json
+import mmap
+import zlib
+import struct
+import asyncio
+import logging
+from array import array
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+try:
+    from .log_store import LogStore
+except ImportError:  # started as a script inside the container
+    from log_store import LogStore
+
+SEGMENT_SIZE = int(os.getenv("SEGMENT_SIZE", 64 * 1024 * 1024))
+
+# Every log entry is one record: payload length, crc32, term, then the
+# command encoded as UTF-8. The crc covers the term and the command.
+RECORD = struct.Struct("<IIQ")
+# The snapshot file: last index, last term and crc32 of the data, then the data.
+SNAPSHOT_HEADER = struct.Struct("<QQI")
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot(NamedTuple):
+    """State machine after applying the first last_index entries of the log."""
+
+    last_index: int
+    last_term: int  # term of the entry at last_index
+    data: bytes
+
+
+class Storage:
+    """Persistent state of a node: current term, vote, log and snapshot.
+
+    This base class keeps nothing, a restarted node starts from scratch.
+    """
+
+    def load(self) -> Tuple[int, Optional[str], int, Sequence[Tuple[int, str]]]:
+        """Return the stored current term, vote, index of the first stored entry and log."""
+        return 0, None, 0, []
+
+    def load_snapshot(self) -> Optional[Snapshot]:
+        return None
+
+    def save_snapshot(self, snapshot: Snapshot) -> None:
+        """Durably store a snapshot, replacing the previous one."""
+
+    def load_configs(self) -> List[Tuple[int, Dict[str, List[str]]]]:
+        """Return the stored cluster configurations, see save_configs."""
+        return []
+
+    def save_configs(self, configs: List[Tuple[int, Dict[str, List[str]]]]) -> None:
+        """Durably store the cluster configurations: (log length after the
+        entry that set it, members and learners), the last one is in effect."""
+
+    def compact(self, log_base: int) -> None:
+        """Drop stored entries before log_base, they are covered by the snapshot."""
+
+    def reset(self, log_base: int) -> None:
+        """Drop the whole log, the next entry stored is the one at index log_base."""
+
+    def save_state(self, current_term: int, voted_for: Optional[str]) -> None:
+        pass
+
+    def append(self, log_length: int, entries: List[Tuple[int, str]]) -> None:
+        """Store entries after the first log_length entries of the log."""
+
+    def truncate(self, log_length: int) -> None:
+        """Drop every entry after the first log_length entries."""
+
+    async def sync(self) -> None:
+        """Wait until every change made so far is durable."""
+
+    def close(self) -> None:
+        pass
+
+
+def encode_entry(term: int, command: str) -> bytes:
+    payload = command.encode()
+    crc = zlib.crc32(payload, zlib.crc32(term.to_bytes(8, "little")))
+    return RECORD.pack(len(payload), crc, term) + payload
+
+
+class Segment:
+    """One file of the write-ahead log, holding the entries from index first on.
+
+    The records are read through a memory map, and the index of where each
+    of them starts is only built when one of them is first needed.
+    """
+
+    def __init__(self, path: str, first: int):
+        self.path = path
+        self.first = first
+        self.count = 0  # number of records
+        self.offsets = array("Q")  # file offset of every record, once indexed
+        self.terms = array("q")  # term of every record, once indexed
+        self.indexed = True
+        self.size = 0
+        self.file = open(path, "ab", buffering=0)
+        self.map: Optional[mmap.mmap] = None
+
+    @staticmethod
+    def name(first: int) -> str:
+        return f"{first:020d}.wal"
+
+    def __len__(self) -> int:
+        return self.count
+
+    def open_sealed(self, count: int) -> None:
+        """Open a segment that is followed by another one: it holds count
+        complete records, they are indexed when they are first read."""
+        self.count = count
+        self.size = os.path.getsize(self.path)
+        self.indexed = False
+
+    def validate(self) -> None:
+        """Check the records of the last segment, cutting off a torn or corrupt tail."""
+        self.size = os.path.getsize(self.path)
+        end = self.scan(check=True)
+        if end < self.size:
+            logger.warning(f"Drop {self.size - end} bytes of torn log in {self.path}")
+            self.unmap()
+            self.file.truncate(end)
+            self.size = end
+        self.count = len(self.offsets)
+
+    def mapped(self) -> bytes | mmap.mmap:
+        if self.map is None:
+            if self.size == 0:
+                return b""
+            with open(self.path, "rb") as file:
+                self.map = mmap.mmap(file.fileno(), self.size, access=mmap.ACCESS_READ)
+        return self.map
+
+    def unmap(self) -> None:
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def scan(self, check: bool) -> int:
+        """Index the records, return where the last complete one ends.
+
+        With check the crc of every record is verified, otherwise only the
+        headers are read.
+        """
+        data = self.mapped()
+        self.offsets, self.terms = array("Q"), array("q")
+        offset = 0
+        while offset + RECORD.size <= len(data):
+            length, crc, term = RECORD.unpack_from(data, offset)
+            end = offset + RECORD.size + length
+            if end > len(data):
+                break
+            if check:
+                payload = data[offset + RECORD.size : end]
+                if zlib.crc32(payload, zlib.crc32(term.to_bytes(8, "little"))) != crc:
+                    break
+            self.offsets.append(offset)
+            self.terms.append(term)
+            offset = end
+        self.indexed = True
+        return offset
+
+    def index(self) -> None:
+        if not self.indexed:
+            self.scan(check=False)
+            if len(self.offsets) != self.count:
+                raise ValueError(f"Corrupt log segment {self.path}")
+
+    def term(self, index: int) -> int:
+        self.index()
+        return self.terms[index]
+
+    def command(self, index: int) -> str:
+        self.index()
+        offset = self.offsets[index]
+        length, _, _ = RECORD.unpack_from(self.mapped(), offset)
+        start = offset + RECORD.size
+        return self.mapped()[start : start + length].decode()
+
+    def size_of(self, start: int, stop: int) -> int:
+        """Bytes of the commands of the records in [start, stop)."""
+        self.index()
+        end = self.offsets[stop] if stop < len(self.offsets) else self.size
+        return end - self.offsets[start] - RECORD.size * (stop - start)
+
+    def append(self, data: bytes, offsets: List[int], terms: List[int]) -> None:
+        self.index()
+        self.offsets.extend(self.size + offset for offset in offsets)
+        self.terms.extend(terms)
+        self.count += len(offsets)
+        self.file.write(data)
+        self.size += len(data)
+
+    def truncate(self, count: int) -> None:
+        """Keep only the first count records."""
+        self.index()
+        if count < len(self.offsets):
+            self.size = self.offsets[count]
+            del self.offsets[count:]
+            del self.terms[count:]
+            self.count = count
+            self.file.truncate(self.size)
+
+    def close(self) -> None:
+        self.unmap()
+        self.file.close()
+
+
+class DiskStorage(Storage):
+    """Segmented write-ahead log and term/vote file in a data directory.
+
+    Writes go to the files right away, but fsync is batched: sync() waits for
+    a flush that covers every change made before it, and all callers in the
+    same event-loop tick (e.g. a whole group-commit batch) share one flush.
+    With batched=False every change is fsynced before the call returns.
+    """
+
+    def __init__(self, data_dir: str, batched: bool = True):
+        self.data_dir = data_dir
+        self.batched = batched
+        self.segments: List[Segment] = []
+        self.length = 0  # index after the last entry of the log
+        self.state: Tuple[int, Optional[str]] = (0, None)
+        self.state_dirty = False
+        self.dirty: Set[Segment] = set()
+        self.directory_dirty = False
+        self.written = 0  # number of changes made
+        self.synced = 0  # number of changes known to be durable
+        self.flushing: Optional[asyncio.Task[None]] = None
+        os.makedirs(data_dir, exist_ok=True)
+
+    @property
+    def state_path(self) -> str:
+        return os.path.join(self.data_dir, "state.json")
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.data_dir, "snapshot.bin")
+
+    @property
+    def configs_path(self) -> str:
+        return os.path.join(self.data_dir, "configs.json")
+
+    def load(self) -> Tuple[int, Optional[str], int, Sequence[Tuple[int, str]]]:
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as file:
+                data = json.load(file)
+            self.state = (data["current_term"], data["voted_for"])
+
+        # A segment is only created once the previous one is durable, so all
+        # but the last are complete and their names tell how many entries
+        # they hold. Only the last one is read, to cut off a torn tail.
+        names = sorted(n for n in os.listdir(self.data_dir) if n.endswith(".wal"))
+        firsts = [int(name.split(".")[0]) for name in names]
+        for name, first, next_first in zip(names, firsts, firsts[1:] + [None]):
+            segment = Segment(os.path.join(self.data_dir, name), first)
+            if next_first is None:
+                segment.validate()
+            else:
+                segment.open_sealed(next_first - first)
+            self.segments.append(segment)
+        first = firsts[0] if firsts else 0
+        self.length = first + sum(len(segment) for segment in self.segments)
+        return self.state[0], self.state[1], first, LogStore(cold=self.segments)
+
+    def load_snapshot(self) -> Optional[Snapshot]:
+        if not os.path.exists(self.snapshot_path):
+            return None
+        with open(self.snapshot_path, "rb") as file:
+            data = file.read()
+        last_index, last_term, crc = SNAPSHOT_HEADER.unpack_from(data)
+        data = data[SNAPSHOT_HEADER.size :]
+        if zlib.crc32(data) != crc:
+            raise ValueError(f"Corrupt snapshot {self.snapshot_path}")
+        return Snapshot(last_index, last_term, data)
+
+    def save_snapshot(self, snapshot: Snapshot) -> None:
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "wb") as file:
+            file.write(
+                SNAPSHOT_HEADER.pack(
+                    snapshot.last_index, snapshot.last_term, zlib.crc32(snapshot.data)
+                )
+            )
+            file.write(snapshot.data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, self.snapshot_path)
+        self.fsync_directory()
+
+    def load_configs(self) -> List[Tuple[int, Dict[str, List[str]]]]:
+        if not os.path.exists(self.configs_path):
+            return []
+        with open(self.configs_path) as file:
+            return [(length, members) for length, members in json.load(file)]
+
+    def save_configs(self, configs: List[Tuple[int, Dict[str, List[str]]]]) -> None:
+        # written before the entries that change them, configurations are rare
+        tmp = self.configs_path + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump(configs, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, self.configs_path)
+        self.fsync_directory()
+
+    def compact(self, log_base: int) -> None:
+        # only whole segments are removed, load() skips the rest
+        while len(self.segments) > 1 and self.segments[1].first <= log_base:
+            self.remove(self.segments.pop(0))
+
+    def reset(self, log_base: int) -> None:
+        while self.segments:
+            self.remove(self.segments.pop())
+        self.length = log_base
+        self.changed()
+
+    def remove(self, segment: Segment) -> None:
+        segment.close()
+        os.remove(segment.path)
+        self.dirty.discard(segment)
+        self.directory_dirty = True
+
+    def save_state(self, current_term: int, voted_for: Optional[str]) -> None:
+        if (current_term, voted_for) != self.state:
+            self.state = (current_term, voted_for)
+            self.state_dirty = True
+            self.changed()
+
+    def append(self, log_length: int, entries: List[Tuple[int, str]]) -> None:
+        if log_length < self.length:
+            self.truncate(log_length)
+        if not entries:
+            return
+        if not self.segments or self.segments[-1].size >= SEGMENT_SIZE:
+            if self.segments:
+                # load() trusts every segment but the last to be complete
+                os.fsync(self.segments[-1].file.fileno())
+            path = os.path.join(self.data_dir, Segment.name(self.length))
+            self.segments.append(Segment(path, self.length))
+            self.directory_dirty = True
+        data = bytearray()
+        offsets: List[int] = []
+        for term, command in entries:
+            offsets.append(len(data))
+            data += encode_entry(term, command)
+        self.segments[-1].append(bytes(data), offsets, [term for term, _ in entries])
+        self.dirty.add(self.segments[-1])
+        self.length += len(entries)
+        self.changed()
+
+    def truncate(self, log_length: int) -> None:
+        if log_length >= self.length:
+            return
+        while self.segments and self.segments[-1].first >= log_length:
+            self.remove(self.segments.pop())
+        if self.segments:
+            segment = self.segments[-1]
+            segment.truncate(log_length - segment.first)
+            self.dirty.add(segment)
+        self.length = log_length
+        self.changed()
+
+    def changed(self) -> None:
+        self.written += 1
+        if not self.batched:
+            self.flush_files()
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:  # no event loop, nobody to batch with
+            self.flush_files()
+            return
+        if self.flushing is None:
+            self.flushing = loop.create_task(self.flush())
+
+    async def sync(self) -> None:
+        target = self.written
+        while self.synced < target:
+            if self.flushing is None:
+                self.flushing = asyncio.create_task(self.flush())
+            await asyncio.shield(self.flushing)
+
+    async def flush(self) -> None:
+        """Make everything written before this flush durable with one fsync per file."""
+        try:
+            await asyncio.sleep(0)  # take in the writes of the rest of this tick
+            await asyncio.get_running_loop().run_in_executor(None, self.flush_files)
+        finally:
+            self.flushing = None
+
+    def flush_files(self) -> None:
+        target = self.written
+        dirty, self.dirty = self.dirty, set()
+        for segment in dirty:
+            try:
+                os.fsync(segment.file.fileno())
+            except (OSError, ValueError):
+                pass  # the segment was truncated away in the meantime
+        if self.state_dirty:
+            self.state_dirty = False
+            tmp = self.state_path + ".tmp"
+            with open(tmp, "w") as file:
+                json.dump(
+                    {"current_term": self.state[0], "voted_for": self.state[1]}, file
+                )
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp, self.state_path)
+            self.directory_dirty = True
+        if self.directory_dirty:
+            self.directory_dirty = False
+            self.fsync_directory()
+        self.synced = max(self.synced, target)
+
+    def fsync_directory(self) -> None:
+        fd = os.open(self.data_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self) -> None:
+        self.flush_files()
+        for segment in self.segments:
+            segment.close()
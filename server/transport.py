@@ -0,0 +1,164 @@
+import os
+import json
+import logging
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional
+from aiohttp import (
+    ClientConnectionError,
+    ClientResponseError,
+    ClientSession,
+    ClientTimeout,
+    TCPConnector,
+)
+
+try:
+    from .codec import CONTENT_TYPE
+except ImportError:  # started as a script inside the container
+    from codec import CONTENT_TYPE
+
+DEFAULT_PORT = 8080
+KEEPALIVE_TIMEOUT = 60.0  # seconds an idle connection to a peer is kept open
+CONNECTIONS_PER_PEER = 8
+# send AppendEntries and RequestVote in the binary codec to peers that take it
+BINARY_CODEC = os.getenv("BINARY_CODEC", "1") != "0"
+# a peer that answered a binary request with an error status gets JSON for
+# BINARY_RETRY_INTERVAL seconds, then the binary codec is tried again
+BINARY_RETRY_INTERVAL = float(os.getenv("BINARY_RETRY_INTERVAL", 60.0))
+
+BINARY_HEADERS = {"Content-Type": CONTENT_TYPE}
+
+logger = logging.getLogger(__name__)
+
+
+def json_dumps(data: Any) -> str:
+    """JSON of a request, its sequences may be views of the log rather than lists."""
+    return json.dumps(data, default=list)
+
+
+def peer_host(node: str) -> str:
+    """Host name or host:port of a node, e.g. of a Raft group on a Host."""
+    return node.split("/", 1)[0]
+
+
+def peer_url(node: str, path: str) -> str:
+    """Build the URL of an RPC endpoint; node is a host name or host:port,
+    followed by the path prefix of its group on a Host, e.g. "raft-node-1/groups/7"."""
+    host, prefix = peer_host(node), node[len(peer_host(node)) :]
+    if ":" in host:
+        return f"http://{host}{prefix}{path}"
+    return f"http://{host}:{DEFAULT_PORT}{prefix}{path}"
+
+
+class PeerTransport:
+    """Long-lived keep-alive HTTP connections to the other nodes of the cluster.
+
+    Every peer host gets its own ClientSession (and connection pool), so a
+    broken connection to one node never disturbs the others; the Raft groups
+    on the same Host share it. A session that fails with a connection error
+    is dropped and transparently reopened on the next request to that peer.
+
+    Requests that have a binary encoding are sent in it, unless the peer
+    answered one with an error status: that request is sent again in JSON,
+    and so are the peer's requests for the next binary_retry_interval seconds
+    or until its connection is reset. The peer may not take the codec, or
+    only have failed once, e.g. with a 500 while it was busy.
+    """
+
+    def __init__(
+        self,
+        pooled: bool = True,
+        binary: bool = BINARY_CODEC,
+        connections_per_peer: int = CONNECTIONS_PER_PEER,
+    ):
+        self.pooled = pooled
+        self.binary = binary
+        self.binary_retry_interval = BINARY_RETRY_INTERVAL
+        self.connections_per_peer = connections_per_peer
+        self.sessions: Dict[str, ClientSession] = {}
+        # peers that refused a binary request -> when to try the codec again
+        self.json_peers: Dict[str, float] = {}
+
+    def session(self, node: str) -> ClientSession:
+        node = peer_host(node)
+        session = self.sessions.get(node)
+        if session is None or session.closed:
+            session = ClientSession(
+                json_serialize=json_dumps,
+                connector=TCPConnector(
+                    limit_per_host=self.connections_per_peer,
+                    keepalive_timeout=KEEPALIVE_TIMEOUT,
+                ),
+            )
+            self.sessions[node] = session
+        return session
+
+    async def open(self, nodes: List[str]) -> None:
+        """Create the sessions for all peers up front."""
+        if self.pooled:
+            for node in nodes:
+                self.session(node)
+
+    async def close(self, node: Optional[str] = None) -> None:
+        """Close the session of one peer, or of all peers."""
+        nodes = [peer_host(node)] if node is not None else list(self.sessions)
+        for name in nodes:
+            self.json_peers.pop(name, None)
+            session = self.sessions.pop(name, None)
+            if session is not None and not session.closed:
+                await session.close()
+
+    async def post(
+        self,
+        node: str,
+        path: str,
+        data: Any,
+        timeout: float,
+        encode: Optional[Callable[[], bytes]] = None,
+    ) -> Any:
+        """POST a request to a peer and return the decoded JSON reply.
+
+        The request is data as JSON, or what encode() returns in the binary codec.
+        """
+        url, host = peer_url(node, path), peer_host(node)
+        if (
+            encode is not None
+            and self.binary
+            and self.json_peers.get(host, 0.0) <= monotonic()
+        ):
+            try:
+                return await self.send(
+                    node, url, timeout, data=encode(), headers=BINARY_HEADERS
+                )
+            except ClientResponseError as error:
+                logger.warning(
+                    f"'{node}' refused the binary codec ({error.status}), use JSON"
+                    f" for {self.binary_retry_interval} seconds"
+                )
+                self.json_peers[host] = monotonic() + self.binary_retry_interval
+        return await self.send(node, url, timeout, json=data)
+
+    async def send(self, node: str, url: str, timeout: float, **kwargs: Any) -> Any:
+        if not self.pooled:
+            async with ClientSession(json_serialize=json_dumps) as session:
+                async with session.post(
+                    url, timeout=ClientTimeout(timeout), **kwargs
+                ) as resp:
+                    resp.raise_for_status()
+                    return await resp.json()
+
+        session = self.session(node)
+        try:
+            async with session.post(
+                url, timeout=ClientTimeout(timeout), **kwargs
+            ) as resp:
+                resp.raise_for_status()
+                return await resp.json()
+        except ClientConnectionError:
+            # reconnect on the next request; the other requests that were in
+            # flight on this session fail too, they must not close its successor.
+            # A timeout only means the peer is slow: aiohttp drops that one
+            # connection, the pool is shared by every Raft group on the peer
+            if self.sessions.get(peer_host(node)) is session:
+                logger.info(f"Reset connections to '{node}'")
+                await self.close(node)
+            raise
@@ -1,12 +1,12 @@
 import pytest
 from server.raft_node import Node
+from server.state_machine import LogStateMachine
 
 
 @pytest.fixture
 def node():
     node = Node("node1", ["node2", "node3"])
     node.current_term = 1
-    node.state_machine = "_"
     return node
 
 
@@ -37,21 +37,20 @@ def test_append_entries_no_entries_no_change(node: Node) -> None:
 def test_append_entries_commit_length_and_state_machine(node: Node) -> None:
     node.log = [(1, "msg1"), (1, "msg2"), (1, "msg3")]
     node.commit_length = 0
-    node.state_machine = "_"
     node.append_entries(log_length=3, leader_commit=2, entries=[])
     assert node.commit_length == 2
     # state_machine should have applied "msg1" and "msg2"
-    assert node.state_machine == "_msg1_msg2_"
+    assert str(node.state_machine) == "_msg1_msg2_"
 
 
 def test_append_entries_commit_length_does_not_decrease(node: Node) -> None:
     node.log = [(1, "msg1"), (1, "msg2"), (1, "msg3")]
     node.commit_length = 2
-    node.state_machine = "_msg1_msg2_"
+    node.state_machine = LogStateMachine(["msg1", "msg2"])
     node.append_entries(log_length=3, leader_commit=1, entries=[])
     # commit_length should not decrease
     assert node.commit_length == 2
-    assert node.state_machine == "_msg1_msg2_"
+    assert str(node.state_machine) == "_msg1_msg2_"
 
 
 def test_append_entries_partial_truncate_and_append(node: Node) -> None:
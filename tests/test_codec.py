@@ -0,0 +1,90 @@
+import json
+import pytest
+from array import array
+from unittest.mock import AsyncMock, MagicMock
+from server import codec
+from server.raft_node import Node, RequestAppend, RequestVote
+
+
+def test_append_round_trip() -> None:
+    entries = [(1, "msg1"), (2, "ünïcode"), (2, "")]
+    request = RequestAppend(
+        term=2,
+        leader_id="127.0.0.1:9100",
+        log_length=5,
+        log_term=1,
+        entries=entries,
+        leader_commit=4,
+    )
+    data = codec.encode_append(request, codec.encode_entries(entries))
+    assert codec.decode_append(data) == request
+
+
+def test_append_columns() -> None:
+    entries = [(1, "a"), (1, "b"), (3, "c" * 300), (4, "")]
+    runs, lengths, commands = codec.encode_entries(entries)
+    # terms in runs, lengths in as few bytes as the longest command needs
+    assert bytes(runs) == array("Q", [1, 2, 3, 1, 4, 1]).tobytes()
+    assert bytes(lengths) == array("H", [1, 1, 300, 0]).tobytes()
+    assert bytes(codec.encode_entries([(1, "a")])[1]) == b"\x01"
+    request = RequestAppend(
+        term=4,
+        leader_id="node1",
+        log_length=0,
+        log_term=0,
+        entries=entries,
+        leader_commit=0,
+    )
+    assert (
+        codec.decode_append(codec.encode_append(request, (runs, lengths, commands)))[
+            "entries"
+        ]
+        == entries
+    )
+
+
+def test_decode_append_refuses_truncated_commands() -> None:
+    entries = [(1, "msg1"), (1, "msg2")]
+    request = RequestAppend(
+        term=1,
+        leader_id="node1",
+        log_length=0,
+        log_term=0,
+        entries=entries,
+        leader_commit=0,
+    )
+    data = codec.encode_append(request, codec.encode_entries(entries))
+    with pytest.raises(ValueError):
+        codec.decode_append(data[:-1])
+    with pytest.raises(ValueError):
+        codec.decode_append(data + b"x")
+
+
+def test_vote_round_trip() -> None:
+    request = RequestVote(
+        term=3, candidate_id="node2", last_log_index=7, last_log_term=2
+    )
+    assert codec.decode_vote(codec.encode_vote(request)) == request
+
+
+@pytest.mark.asyncio
+async def test_handle_binary_append_entries() -> None:
+    node = Node("node1", ["node2", "node3"])
+    entries = [(1, "msg1"), (1, "msg2")]
+    request_data = RequestAppend(
+        term=1,
+        leader_id="node2",
+        log_length=0,
+        log_term=0,
+        entries=entries,
+        leader_commit=1,
+    )
+    request = MagicMock()
+    request.content_type = codec.CONTENT_TYPE
+    request.read = AsyncMock(
+        return_value=codec.encode_append(request_data, codec.encode_entries(entries))
+    )
+    resp = await node.handle_append_entries(request)
+    assert json.loads(resp.text or "{}") == dict(term=1, ack=2, success=True)
+    assert node.log == entries
+    assert node.commit_length == 1
@@ -1,83 +1,145 @@
 import pytest
+import asyncio
+import pytest_asyncio
+from typing import AsyncIterator, List
 from pytest import MonkeyPatch
 from aioresponses import aioresponses
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock
 from server.raft_node import Node, ResponseVote, RequestVote
 
 
-@pytest.fixture
-def node():
+@pytest_asyncio.fixture
+async def node() -> AsyncIterator[Node]:
     # Create a Node with node_id 'n1' and two other nodes
     node = Node("node1", ["node2", "node3"])
-    node.node_last_activity_time = 0  # for determinism
-    return node
+    yield node
+    await node.transport.close()
 
 
 @pytest.mark.asyncio
-async def test_election_timer_becomes_candidate(
-    monkeypatch: MonkeyPatch, node: Node
-) -> None:
-    node.current_role = "FOLLOWER"
-    node.node_last_activity_time = 0  # Simulate old activity time
-
-    # Patch time to simulate timeout
-    monkeypatch.setattr("server.raft_node.time", lambda: 100)
-    # Patch election to avoid infinite loop
+async def test_election_timer_becomes_candidate(node: Node) -> None:
     node.election = AsyncMock()
+    node.ask_pre_votes = AsyncMock(return_value=True)
+    node.election_timeout = 0.05
+    node.timers_running = True
+    node.reset_election_timer()
 
-    # Run only one iteration of the loop
-    with patch("asyncio.sleep", new=AsyncMock(side_effect=Exception("break"))):
-        try:
-            await node.election_timer()
-        except Exception as e:
-            assert str(e) == "break"
-
+    await asyncio.sleep(0.03)
+    assert node.current_role == "FOLLOWER"
+    for _ in range(100):
+        await asyncio.sleep(0.002)
+        if node.current_role == "CANDIDATE":
+            break
     assert node.current_role == "CANDIDATE"
     node.election.assert_awaited_once()
+    # the next round is due after a random timeout
+    deadline = node.election_deadline - asyncio.get_running_loop().time()
+    assert 0.0 < deadline <= 0.1
+    node.cancel_timers()
 
 
 @pytest.mark.asyncio
-async def test_election_timer_no_election(monkeypatch: MonkeyPatch, node: Node) -> None:
-    node.current_role = "FOLLOWER"
-    node.node_last_activity_time = 100  # Simulate recent activity
-
-    # Patch time to simulate no timeout
-    monkeypatch.setattr("server.raft_node.time", lambda: 101)
+async def test_election_timer_without_pre_votes_stays_follower(node: Node) -> None:
     node.election = AsyncMock()
+    node.ask_pre_votes = AsyncMock(return_value=False)
+    node.election_timeout = 0.02
+    node.timers_running = True
+    node.reset_election_timer()
+
+    await asyncio.sleep(0.05)
+    node.ask_pre_votes.assert_awaited()
+    node.election.assert_not_awaited()
+    assert node.current_role == "FOLLOWER"
+    assert node.current_term == 0
+    node.cancel_timers()
+
 
-    # Run only one iteration of the loop
-    with patch("asyncio.sleep", new=AsyncMock(side_effect=Exception("break"))):
-        try:
-            await node.election_timer()
-        except Exception as e:
-            assert str(e) == "break"
+def test_election_timeout_adapts_to_heartbeat_gaps(node: Node) -> None:
+    node.election_timeout = 5.0
+    node.heartbeat_timeout = 0.1
+    assert node.min_election_timeout() == 5.0
 
-    # Should remain follower - no election started
+    for _ in range(50):
+        node.observe_heartbeat_gap(0.1)
+    assert 0.2 <= node.min_election_timeout() < 0.21
+    # jittery heartbeats leave more room, up to election_timeout
+    for gap in [0.05, 0.3] * 10:
+        node.observe_heartbeat_gap(gap)
+    assert 0.5 < node.min_election_timeout() < 5.0
+    node.observe_heartbeat_gap(60.0)
+    assert node.min_election_timeout() == 5.0
+
+
+@pytest.mark.asyncio
+async def test_ask_pre_votes_majority(monkeypatch: MonkeyPatch, node: Node) -> None:
+    node.current_term = 3
+    node.log = [(3, "msg1")]
+    sent: List[RequestVote] = []
+
+    async def mock_post_request_vote(
+        node_id: str, request_data: RequestVote, path: str
+    ) -> ResponseVote:
+        assert path == "/pre_vote"
+        sent.append(request_data)
+        return ResponseVote(node_id=node_id, term=3, vote_granted=node_id == "node2")
+
+    monkeypatch.setattr(node, "post_request_vote", mock_post_request_vote)
+
+    assert await node.ask_pre_votes()
+    assert sent[0]["term"] == 4
+    assert sent[0]["last_log_index"] == 1
+    # nothing changes until the real election
+    assert node.current_term == 3
+    assert node.voted_for is None
     assert node.current_role == "FOLLOWER"
-    node.election.assert_not_awaited()
 
 
 @pytest.mark.asyncio
-async def test_election_timer_not_follower(
+async def test_ask_pre_votes_learns_higher_term(
     monkeypatch: MonkeyPatch, node: Node
 ) -> None:
-    node.current_role = "LEADER"  # Not a follower
-    node.node_last_activity_time = 0  # Old activity time
+    node.current_term = 3
 
-    # Patch time to simulate timeout
-    monkeypatch.setattr("server.raft_node.time", lambda: 100)
-    node.election = AsyncMock()
+    async def mock_post_request_vote(
+        node_id: str, request_data: RequestVote, path: str
+    ) -> ResponseVote:
+        return ResponseVote(node_id="", term=7, vote_granted=False)
+
+    monkeypatch.setattr(node, "post_request_vote", mock_post_request_vote)
 
-    # Run only one iteration of the loop
-    with patch("asyncio.sleep", new=AsyncMock(side_effect=Exception("break"))):
-        try:
-            await node.election_timer()
-        except Exception as e:
-            assert str(e) == "break"
+    assert not await node.ask_pre_votes()
+    assert node.current_term == 7
+    assert node.current_role == "FOLLOWER"
 
-    # Should remain leader - no election for non-followers
-    assert node.current_role == "LEADER"
+
+@pytest.mark.asyncio
+async def test_election_timer_reset_postpones_election(node: Node) -> None:
+    node.election = AsyncMock()
+    node.election_timeout = 0.05
+    node.timers_running = True
+    node.reset_election_timer()
+
+    for _ in range(3):
+        await asyncio.sleep(0.03)
+        node.reset_election_timer()  # e.g. AppendEntries from the leader
+    assert node.current_role == "FOLLOWER"
     node.election.assert_not_awaited()
+    node.cancel_timers()
+
+
+@pytest.mark.asyncio
+async def test_election_timer_not_armed_for_leader(node: Node) -> None:
+    node.timers_running = True
+    node.current_role = "LEADER"
+    node.reset_election_timer()
+    assert node.election_handle is None
+    assert node.heartbeat_handle is not None
+
+    # stepping down arms the election timer again
+    node.current_role = "FOLLOWER"
+    assert node.election_handle is not None
+    assert node.heartbeat_handle is None
+    node.cancel_timers()
 
 
 @pytest.mark.asyncio
@@ -153,17 +215,10 @@ async def test_election_no_quorum(monkeypatch: MonkeyPatch, node: Node) -> None:
 
     monkeypatch.setattr(node, "post_request_vote", mock_post_request_vote)
 
-    # Patch asyncio.sleep to break the election loop after one round
-    with patch("server.raft_node.asyncio.sleep", new=AsyncMock()) as mock_sleep:
-        # Set current_role to something else after first round to exit loop
-        async def set_follower(timeout: float) -> None:
-            node.current_role = "FOLLOWER"
-
-        mock_sleep.side_effect = set_follower
-
-        await node.election()
+    await node.election()
 
-    assert node.current_role == "FOLLOWER"
+    # the election timer starts the next round
+    assert node.current_role == "CANDIDATE"
     assert node.current_term == 2
     assert node.current_leader == ""
     assert node.voted_for == "node1"
@@ -171,8 +226,7 @@ async def test_election_no_quorum(monkeypatch: MonkeyPatch, node: Node) -> None:
 
 
 @pytest.mark.asyncio
-async def test_post_request_vote_success():
-    node = Node("node1", ["node2", "node3"])
+async def test_post_request_vote_success(node: Node) -> None:
     request_data = RequestVote(
         term=1,
         candidate_id="node1",
@@ -185,17 +239,21 @@ async def test_post_request_vote_success():
         vote_granted=True,
     )
 
+    node.heartbeat_timeout = 0.05
+
     with aioresponses() as mock:
         # Mock the HTTP request
         mock.post("http://node2:8080/request_vote", payload=response)  # type: ignore
 
         result = await node.post_request_vote("node2", request_data)
         assert result == response
+        (call,) = [call for calls in mock.requests.values() for call in calls]  # type: ignore
+    # the node's own heartbeat timeout, it may be far below the default
+    assert call.kwargs["timeout"].total == 0.05
 
 
 @pytest.mark.asyncio
-async def test_post_request_vote_exception():
-    node = Node("node1", ["node2", "node3"])
+async def test_post_request_vote_exception(node: Node) -> None:
     node.current_term = 5
     request_data = RequestVote(
         term=node.current_term,
@@ -1,77 +1,182 @@
 import pytest
 import asyncio
-from pytest import MonkeyPatch
-from unittest.mock import AsyncMock
-from server.raft_node import Node, HEARTBEAT_TIMEOUT
+from unittest.mock import AsyncMock, MagicMock
+from server.raft_node import Node, RequestAppend, RequestHeartbeat
 
 
-@pytest.mark.asyncio
-async def test_generate_heartbeats_leader_sends_heartbeat(
-    monkeypatch: MonkeyPatch,
-) -> None:
+def make_leader() -> Node:
     node = Node("node1", ["node2", "node3"])
-    node.current_role = "LEADER"
-    node.node_last_activity_time = 0
-
-    # Patch time to simulate timeout
-    monkeypatch.setattr("server.raft_node.time", lambda: HEARTBEAT_TIMEOUT + 1)
-    # Patch replicate_log to track calls
+    node.timers_running = True
+    node.heartbeat_timeout = 0.05
     node.replicate_log = AsyncMock(return_value=True)
+    return node
 
-    # Patch asyncio.sleep to break the loop after one iteration
-    async def fake_sleep(_: float):
-        raise asyncio.CancelledError()
-
-    monkeypatch.setattr("server.raft_node.asyncio.sleep", fake_sleep)
 
-    with pytest.raises(asyncio.CancelledError):
-        await node.generate_heartbeats()
+@pytest.mark.asyncio
+async def test_heartbeat_timer_sends_heartbeats() -> None:
+    node = make_leader()
+    node.current_role = "LEADER"
 
-    # Should call replicate_log for each node
-    assert node.replicate_log.await_count == len(node.nodes)
+    await asyncio.sleep(0.03)
+    node.replicate_log.assert_not_awaited()
+    await asyncio.sleep(0.03)
+    # one AppendEntries per follower, and the next heartbeat is scheduled
+    assert sorted(c.args[0] for c in node.replicate_log.await_args_list) == [
+        "node2",
+        "node3",
+    ]
+    assert node.heartbeat_handle is not None
+    node.cancel_timers()
 
 
 @pytest.mark.asyncio
-async def test_generate_heartbeats_leader_no_heartbeat(
-    monkeypatch: MonkeyPatch,
-) -> None:
-    node = Node("node1", ["node2", "node3"])
+async def test_heartbeat_skips_follower_with_request_in_flight() -> None:
+    node = make_leader()
     node.current_role = "LEADER"
-    node.node_last_activity_time = 10
+    release = asyncio.Event()
+
+    async def replicate_log(follower_id: str) -> bool:
+        if follower_id == "node2":
+            await release.wait()
+        return True
 
-    # Patch time so that not enough time has passed
-    monkeypatch.setattr("server.raft_node.time", lambda: 10.5)
-    node.replicate_log = AsyncMock()
+    node.replicate_log = AsyncMock(side_effect=replicate_log)
+    node.cancel_timers()
+    node.on_heartbeat()
+    await asyncio.sleep(0)
+    node.on_heartbeat()
+    await asyncio.sleep(0)
 
-    # Patch asyncio.sleep to break the loop after one iteration
-    async def fake_sleep(_: float):
-        raise asyncio.CancelledError()
+    followers = [c.args[0] for c in node.replicate_log.await_args_list]
+    assert sorted(followers) == ["node2", "node3", "node3"]
+    release.set()
+    node.cancel_timers()
 
-    monkeypatch.setattr("server.raft_node.asyncio.sleep", fake_sleep)
 
-    with pytest.raises(asyncio.CancelledError):
-        await node.generate_heartbeats()
+@pytest.mark.asyncio
+async def test_heartbeat_timer_follower() -> None:
+    node = make_leader()
+    node.on_heartbeat()
+    await asyncio.sleep(0)
 
-    # Should not call replicate_log
     node.replicate_log.assert_not_awaited()
+    assert node.heartbeat_handle is None
 
 
 @pytest.mark.asyncio
-async def test_generate_heartbeats_follower(monkeypatch: MonkeyPatch) -> None:
-    node = Node("node1", ["node2", "node3"])
-    node.current_role = "FOLLOWER"
-    node.node_last_activity_time = 0
+async def test_caught_up_follower_gets_heartbeat() -> None:
+    node = make_leader()
+    node.log = [(1, "msg1")]
+    node.current_term = 1
+    node.become_leader()
+    node.send_heartbeat = AsyncMock(return_value=True)
+    node.acked_length["node2"] = 1
+    node.commit_acked["node2"] = 0
 
-    node.replicate_log = AsyncMock()
+    node.on_heartbeat()
+    await asyncio.sleep(0)
+    node.cancel_timers()
 
-    # Patch asyncio.sleep to break the loop after one iteration
-    async def fake_sleep(_: float):
-        raise asyncio.CancelledError()
+    # only term and commit length for node2, entries for node3
+    node.send_heartbeat.assert_awaited_once_with("node2")
+    node.replicate_log.assert_awaited_once_with("node3")
 
-    monkeypatch.setattr("server.raft_node.asyncio.sleep", fake_sleep)
 
-    with pytest.raises(asyncio.CancelledError):
-        await node.generate_heartbeats()
+@pytest.mark.asyncio
+async def test_quiescent_follower_gets_fewer_heartbeats() -> None:
+    node = make_leader()
+    node.log = [(1, "msg1")]
+    node.current_term = 1
+    node.become_leader()
+    node.commit_length = 1
+    node.election_timeout = 0.5
+    node.quiesce_timeout = 2.0  # heartbeats every 0.2 s instead of 0.05 s
+    node.send_heartbeat = AsyncMock(return_value=True)
+    for follower in node.nodes:
+        node.acked_length[follower] = 1
+    node.commit_acked["node2"] = 1  # has everything committed
+    node.commit_acked["node3"] = 0
+    node.cancel_timers()
+    node.schedule_heartbeat = MagicMock()  # the test ticks the heartbeat timer
+
+    for _ in range(4):
+        node.on_heartbeat()
+        await asyncio.sleep(0.05)
+
+    followers = [c.args[0] for c in node.send_heartbeat.await_args_list]
+    assert followers.count("node2") == 1
+    assert followers.count("node3") == 4
 
-    # Should not call replicate_log
-    node.replicate_log.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_heartbeat_refused_falls_back_to_append_entries() -> None:
+    node = make_leader()
+    node.log = [(1, "msg1")]
+    node.current_term = 1
+    node.become_leader()
+    node.acked_length["node2"] = 1
+    node.commit_acked["node2"] = 1
+    node.post_heartbeat = AsyncMock(return_value={"term": 1, "success": False})
+
+    assert await node.send_heartbeat("node2")
+
+    # the follower restarted: its log is matched again from our end on
+    node.replicate_log.assert_awaited_once_with("node2")
+    assert node.acked_length["node2"] == 0
+    assert node.sent_length["node2"] == 1
+    assert "node2" not in node.commit_acked
+
+
+@pytest.mark.asyncio
+async def test_process_heartbeat_commits_matched_log() -> None:
+    node = Node("node1", ["node2", "node3"])
+    node.quiesce_timeout = 4.0
+    await node.process_append_entries(
+        RequestAppend(
+            term=1,
+            leader_id="node2",
+            log_length=0,
+            log_term=0,
+            entries=[(1, "msg1"), (1, "msg2")],
+            leader_commit=0,
+        )
+    )
+    assert node.matched == (1, 2)
+    assert not node.quiescent
+
+    data = await node.process_heartbeat(
+        RequestHeartbeat(term=1, leader_id="node2", leader_commit=1)
+    )
+    assert data == {"term": 1, "success": True}
+    assert node.commit_length == 1
+    assert not node.quiescent
+
+    # everything we have is committed, the leader may quiesce
+    await node.process_heartbeat(
+        RequestHeartbeat(term=1, leader_id="node2", leader_commit=2)
+    )
+    assert node.commit_length == 2
+    assert node.quiescent
+    assert node.min_election_timeout() == 4.0
+
+
+@pytest.mark.asyncio
+async def test_process_heartbeat_without_matched_log() -> None:
+    node = Node("node1", ["node2", "node3"])
+    node.log = [(1, "msg1"), (1, "stale")]
+    node.current_term = 1
+
+    # e.g. after a restart, we don't know whether our log matches the leader's
+    data = await node.process_heartbeat(
+        RequestHeartbeat(term=2, leader_id="node2", leader_commit=2)
+    )
+    assert data == {"term": 2, "success": False}
+    assert node.current_leader == "node2"
+    assert node.commit_length == 0
+
+    # a stale leader is refused
+    data = await node.process_heartbeat(
+        RequestHeartbeat(term=1, leader_id="node3", leader_commit=2)
+    )
+    assert data == {"term": 2, "success": False}
+    assert node.current_leader == "node2"
@@ -143,3 +143,35 @@ async def test_handle_append_entries_term_too_low(node: Node) -> None:
     assert data["success"] is False
     assert data["term"] == 5
     assert data["ack"] == 0
+
+
+@pytest.mark.asyncio
+async def test_handle_append_entries_conflict_hints(node: Node) -> None:
+    node.current_term = 4
+    node.log = [(1, "msg1"), (2, "msg2"), (2, "msg3"), (2, "msg4")]
+
+    async def reject(log_length: int, log_term: int) -> dict:
+        request_data = dict(
+            term=4,
+            leader_id="node2",
+            log_length=log_length,
+            log_term=log_term,
+            entries=[],
+            leader_commit=1,
+        )
+        request = MagicMock()
+        request.json = AsyncMock(return_value=request_data)
+        resp = await node.handle_append_entries(request)
+        return json.loads(getattr(resp, "text", "{}"))
+
+    # conflicting entry: its term and the log length before that term starts
+    data = await reject(log_length=3, log_term=3)
+    assert data["success"] is False
+    assert data["conflict_term"] == 2
+    assert data["conflict_index"] == 1
+
+    # log too short: the follower's log length
+    data = await reject(log_length=10, log_term=4)
+    assert data["success"] is False
+    assert data["conflict_term"] == 0
+    assert data["conflict_index"] == 4
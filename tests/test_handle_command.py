@@ -1,9 +1,18 @@
 import pytest
+import asyncio
+from typing import List
 from pytest import MonkeyPatch
 from unittest.mock import AsyncMock, MagicMock
 from server.raft_node import Node
 
 
+def ack(node: Node, follower_id: str) -> bool:
+    """What the follower's response does: ack the whole log, which may commit it."""
+    node.acked_length[follower_id] = node.log_length()
+    node.advance_commit()
+    return True
+
+
 @pytest.mark.asyncio
 async def test_handle_command_not_leader(monkeypatch: MonkeyPatch) -> None:
     node = Node("node1", ["node2", "node3"])
@@ -32,7 +41,7 @@ async def test_handle_command_leader_success(monkeypatch: MonkeyPatch) -> None:
     node.majority = 2
 
     # Patch replicate_log to always succeed
-    node.replicate_log = AsyncMock(return_value=True)
+    node.replicate_log = AsyncMock(side_effect=lambda f: ack(node, f))
 
     # Mock request with a command
     request = MagicMock()
@@ -44,6 +53,7 @@ async def test_handle_command_leader_success(monkeypatch: MonkeyPatch) -> None:
     text = resp.text
     assert text is not None, "Response text should not be None"
     assert "OK: Command 'msg1' added to log" in text
+    assert "committed at index 1 in term 1" in text
     assert node.log[-1] == (1, "msg1")
 
 
@@ -55,6 +65,7 @@ async def test_handle_command_leader_no_quorum(monkeypatch: MonkeyPatch) -> None
     node.acked_length = {"node1": 0, "node2": 0, "node3": 0}
     node.sent_length = {"node2": 0, "node3": 0}
     node.majority = 2  # Require majority for quorum
+    monkeypatch.setattr("server.raft_node.COMMAND_TIMEOUT", 0.05)
 
     # Patch replicate_log: only one follower succeeds
     results = False
@@ -70,6 +81,7 @@ async def test_handle_command_leader_no_quorum(monkeypatch: MonkeyPatch) -> None
     assert "ERROR: Not enough quorum to commit the command" in text
     # Command should still be added to log even without quorum
     assert node.log[-1] == (1, "msg1")
+    assert node.commit_waiters == []
 
 
 @pytest.mark.asyncio
@@ -87,3 +99,199 @@ async def test_handle_command_empty_command(monkeypatch: MonkeyPatch) -> None:
     assert "ERROR: No command" in text
     # Log should not be modified
     assert len(node.log) == 0
+
+
+def make_leader() -> Node:
+    node = Node("node1", ["node2", "node3"])
+    node.current_role = "LEADER"
+    node.current_term = 1
+    node.acked_length = {"node1": 0, "node2": 0, "node3": 0}
+    node.sent_length = {"node2": 0, "node3": 0}
+    return node
+
+
+def command_request(command: str) -> MagicMock:
+    request = MagicMock()
+    request.json = AsyncMock(return_value={"command": command})
+    return request
+
+
+@pytest.mark.asyncio
+async def test_handle_command_batches_concurrent_commands() -> None:
+    node = make_leader()
+    release = asyncio.Event()
+    log_lengths: List[int] = []
+
+    async def slow_replicate_log(follower_id: str) -> bool:
+        log_lengths.append(len(node.log))
+        await release.wait()
+        return ack(node, follower_id)
+
+    node.replicate_log = slow_replicate_log  # type: ignore
+
+    # first command starts a round, the others queue up behind it
+    first = asyncio.create_task(node.handle_command(command_request("msg1")))
+    await asyncio.sleep(0)
+    others = [
+        asyncio.create_task(node.handle_command(command_request(f"msg{i}")))
+        for i in range(2, 6)
+    ]
+    await asyncio.sleep(0)
+    release.set()
+    responses = await asyncio.gather(first, *others)
+
+    assert all("OK" in (resp.text or "") for resp in responses)
+    assert node.log == [(1, f"msg{i}") for i in range(1, 6)]
+    # two rounds to each follower: [msg1] and [msg2..msg5]
+    assert log_lengths == [1, 1, 5, 5]
+    assert node.acked_length["node1"] == 5
+
+
+@pytest.mark.asyncio
+async def test_handle_command_batch_size_limit() -> None:
+    node = make_leader()
+    node.batch_size = 2
+    node.replicate_log = AsyncMock(side_effect=lambda f: ack(node, f))
+
+    responses = await asyncio.gather(
+        *[node.handle_command(command_request(f"msg{i}")) for i in range(1, 6)]
+    )
+
+    assert all("OK" in (resp.text or "") for resp in responses)
+    assert len(node.log) == 5
+    # 3 rounds (2 + 2 + 1 commands) to 2 followers
+    assert node.replicate_log.await_count == 6
+
+
+@pytest.mark.asyncio
+async def test_handle_command_batch_linger(monkeypatch: MonkeyPatch) -> None:
+    node = make_leader()
+    node.batch_linger = 0.01
+    node.replicate_log = AsyncMock(side_effect=lambda f: ack(node, f))
+
+    responses = await asyncio.gather(
+        *[node.handle_command(command_request(f"msg{i}")) for i in range(1, 4)]
+    )
+
+    assert all("OK" in (resp.text or "") for resp in responses)
+    # the linger collects all three commands into a single round
+    assert node.replicate_log.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_handle_command_answers_on_commit() -> None:
+    node = make_leader()
+    node.batch_size = 1
+    stuck = asyncio.Event()
+    sent: List[str] = []
+
+    async def replicate_log(follower_id: str) -> bool:
+        sent.append(follower_id)
+        if follower_id == "node3":
+            await stuck.wait()  # a slow follower
+        return ack(node, follower_id)
+
+    node.replicate_log = replicate_log  # type: ignore
+
+    responses = await asyncio.gather(
+        *[node.handle_command(command_request(f"msg{i}")) for i in range(1, 4)]
+    )
+
+    # node2 and we are a majority, nobody waits for node3
+    assert ["committed at index" in (resp.text or "") for resp in responses] == [
+        True
+    ] * 3
+    assert node.commit_length == 3
+    # node3 keeps the request for the first batch, no more pile up behind it
+    assert sent == ["node2", "node3", "node2", "node2"]
+    stuck.set()
+    await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_handle_command_waits_for_a_busy_follower() -> None:
+    node = make_leader()
+    busy = asyncio.Event()
+    sent: List[str] = []
+
+    async def replicate_log(follower_id: str) -> bool:
+        sent.append(follower_id)
+        if follower_id == "node2":
+            return False  # unreachable
+        return ack(node, follower_id)
+
+    node.replicate_log = replicate_log  # type: ignore
+    # node3 is busy with an earlier request when the batch goes out
+    node.replication_tasks["node3"] = asyncio.create_task(busy.wait())
+
+    command = asyncio.create_task(node.handle_command(command_request("msg1")))
+    await asyncio.sleep(0.01)
+    assert not command.done()
+    assert sent == ["node2"]
+
+    # the batch follows node3's request and commits
+    busy.set()
+    resp = await command
+    assert "committed at index 1 in term 1" in (resp.text or "")
+    assert sent == ["node2", "node3"]
+
+
+@pytest.mark.asyncio
+async def test_commit_waiters() -> None:
+    node = make_leader()
+    node.log = [(1, "msg1"), (1, "msg2"), (1, "msg3")]
+    later = node.commit_waiter(3)
+    first = node.commit_waiter(2)
+
+    # the later waiter doesn't hold back the first one
+    node.commit(2)
+    assert first.done() and first.result()
+    assert not later.done()
+
+    # we stop leading, the next leader may overwrite msg3
+    node.current_role = "FOLLOWER"
+    assert later.done() and not later.result()
+    assert node.commit_waiters == []
+
+    # an entry truncated by the leader is lost
+    lost = node.commit_waiter(3)
+    node.append_entries(2, 2, [(2, "other")])
+    assert lost.done() and not lost.result()
+    assert node.commit_waiters == []
+
+
+@pytest.mark.asyncio
+async def test_handle_command_session_retry() -> None:
+    node = Node("node1", [])
+    node.current_term = 1
+    node.become_leader()
+    request = MagicMock()
+    request.json = AsyncMock(
+        return_value={"command": "msg1", "client_id": "c1", "seq": 1}
+    )
+
+    resp = await node.handle_command(request)
+    assert "committed at index 1 in term 1" in (resp.text or "")
+    # the retry, e.g. to the next leader, reports where the command committed
+    node.current_term = 2
+    node.become_leader()
+    node.log.append((2, ""))
+    node.commit(2)
+    resp = await node.handle_command(request)
+    assert "committed at index 1 in term 1" in (resp.text or "")
+    assert node.log_length() == 2
+    assert str(node.state_machine) == "_msg1_"
+
+    # a client without a session can't know whether command 2 was applied
+    request.json = AsyncMock(
+        return_value={"command": "msg2", "client_id": "c2", "seq": 2}
+    )
+    resp = await node.handle_command(request)
+    assert "ERROR: Session expired" in (resp.text or "")
+    assert node.log_length() == 2
+
+    # clients can't forge session entries
+    request.json = AsyncMock(return_value={"command": node.log.command(0)})
+    resp = await node.handle_command(request)
+    assert "ERROR: Reserved command" in (resp.text or "")
+    assert node.log_length() == 2
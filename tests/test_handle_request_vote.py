@@ -7,7 +7,6 @@ from server.raft_node import Node
 @pytest.fixture
 def node():
     node = Node("node1", ["node2", "node3"])
-    node.node_last_activity_time = 0  # for determinism
     return node
 
 
@@ -135,3 +134,61 @@ async def test_handle_request_vote_updates_term_and_role(node: Node) -> None:
     assert node.current_role == "FOLLOWER"
     assert node.voted_for == "node2"
     assert data["vote_granted"] is True
+
+
+@pytest.mark.asyncio
+async def test_handle_request_vote_one_vote_per_term(node: Node) -> None:
+    # a candidate has voted for itself in its term
+    node.current_term = 2
+    node.current_role = "CANDIDATE"
+    node.voted_for = "node1"
+
+    request = MagicMock()
+    request.json = AsyncMock(
+        return_value=dict(
+            term=2, candidate_id="node2", last_log_index=0, last_log_term=0
+        )
+    )
+    resp = await node.handle_request_vote(request)
+    assert json.loads(resp.text or "{}")["vote_granted"] is False
+    assert node.current_role == "CANDIDATE"
+
+    # a newer term frees the vote
+    request.json.return_value["term"] = 3
+    resp = await node.handle_request_vote(request)
+    assert json.loads(resp.text or "{}")["vote_granted"] is True
+    assert node.voted_for == "node2"
+
+
+@pytest.mark.asyncio
+async def test_handle_pre_vote_changes_nothing(node: Node) -> None:
+    node.current_term = 2
+    request = MagicMock()
+    request.json = AsyncMock(
+        return_value=dict(
+            term=3, candidate_id="node2", last_log_index=0, last_log_term=0
+        )
+    )
+    resp = await node.handle_pre_vote(request)
+    data = json.loads(getattr(resp, "text", "{}"))
+
+    assert data == {"node_id": "node1", "term": 2, "vote_granted": True}
+    assert node.current_term == 2
+    assert node.voted_for is None
+
+
+@pytest.mark.asyncio
+async def test_handle_pre_vote_refused_while_leader_is_heard(node: Node) -> None:
+    node.current_term = 2
+    node.follow_leader(2, "node3")
+    request = MagicMock()
+    request.json = AsyncMock(
+        return_value=dict(
+            term=3, candidate_id="node2", last_log_index=0, last_log_term=0
+        )
+    )
+    resp = await node.handle_pre_vote(request)
+    data = json.loads(getattr(resp, "text", "{}"))
+
+    assert data["vote_granted"] is False
+    assert node.current_term == 2
@@ -0,0 +1,269 @@
+import asyncio
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from server.host import GroupAppend, GroupHeartbeat, Host, group_node
+from server.raft_node import Node
+
+
+def make_host(address: str = "node1", groups: int = 3) -> Host:
+    return Host(address, ["node2", "node3"], groups, data_dir=None)
+
+
+def test_groups_of_a_host() -> None:
+    host = make_host()
+    assert [node.node_id for node in host.groups] == [
+        "node1/groups/0",
+        "node1/groups/1",
+        "node1/groups/2",
+    ]
+    assert host.groups[1].nodes == ["node2/groups/1", "node3/groups/1"]
+    assert all(node.transport is host.transport for node in host.groups)
+    # keys are spread over the groups, always to the same one
+    owners = {host.group_of(f"key{i}").node_id for i in range(100)}
+    assert len(owners) == 3
+    assert host.group_of("key1") is host.group_of("key1")
+    # and so are the preferred leaders over the hosts
+    assert [host.preferred_host(group) for group in range(3)] == [
+        "node1",
+        "node2",
+        "node3",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_handle_heartbeats_of_many_groups() -> None:
+    host = make_host()
+    requests = [
+        GroupAppend(
+            group=group,
+            term=2,
+            leader_id=group_node("node2", group),
+            log_length=0,
+            log_term=0,
+            entries=[],
+            leader_commit=0,
+        )
+        for group in (0, 2)
+    ]
+    request = MagicMock()
+    request.json = AsyncMock(return_value=requests)
+
+    resp = await host.handle_heartbeats(request)
+
+    data = json.loads(resp.text or "[]")
+    assert data == [{"term": 2, "ack": 0, "success": True}] * 2
+    assert host.groups[0].current_leader == "node2/groups/0"
+    assert host.groups[2].current_term == 2
+    assert host.groups[1].current_term == 0
+
+
+@pytest.mark.asyncio
+async def test_heartbeats_coalesced_per_peer_host() -> None:
+    host = make_host(groups=2)
+    sent: dict = {}
+
+    async def send_heartbeats(peer: str, batch: list) -> None:
+        sent[peer] = [(node.node_id, follower) for node, follower, _ in batch]
+
+    host.send_heartbeats = send_heartbeats  # type: ignore
+    host.groups[1].log = [(1, "msg1")]
+    for node in host.groups:
+        node.current_term = 1
+        node.become_leader()
+        node.replicate_log = AsyncMock(return_value=True)
+    # a follower missing entries is caught up by its group
+    host.groups[1].sent_length["node3/groups/1"] = 0
+
+    host.on_heartbeat()
+    await asyncio.sleep(0)
+    host.heartbeat_handle.cancel()
+
+    assert sent == {
+        "node2": [
+            ("node1/groups/0", "node2/groups/0"),
+            ("node1/groups/1", "node2/groups/1"),
+        ],
+        "node3": [("node1/groups/0", "node3/groups/0")],
+    }
+    host.groups[1].replicate_log.assert_awaited_once_with("node3/groups/1")
+
+
+@pytest.mark.asyncio
+async def test_caught_up_groups_get_light_heartbeats() -> None:
+    host = make_host(groups=2)
+    sent: dict = {}
+
+    async def send_heartbeats(peer: str, batch: list) -> None:
+        sent[peer] = [request_data for _, _, request_data in batch]
+
+    host.send_heartbeats = send_heartbeats  # type: ignore
+    for node in host.groups:
+        node.current_term = 1
+        node.become_leader()
+        node.quiesce_timeout = 10 * node.election_timeout
+    # group 0 is caught up on node2, group 1 is quiescent there
+    for group, node in enumerate(host.groups):
+        node.ack_commit(group_node("node2", group), 0)
+    host.groups[1].heartbeat_sent_at["node2/groups/1"] = 1e12
+
+    host.on_heartbeat()
+    await asyncio.sleep(0)
+    host.heartbeat_handle.cancel()
+
+    assert sent["node2"] == [
+        {"group": 0, "term": 1, "leader_id": "node1/groups/0", "leader_commit": 0}
+    ]
+    # node3 hasn't matched the new leaders' logs yet
+    assert [data["group"] for data in sent["node3"]] == [0, 1]
+    assert all("entries" in data for data in sent["node3"])
+
+    # both kinds are handled by the groups of the peer host
+    peer = make_host("node2", groups=2)
+    request = MagicMock()
+    request.json = AsyncMock(return_value=sent["node2"] + sent["node3"][1:])
+    resp = await peer.handle_heartbeats(request)
+    assert json.loads(resp.text or "[]") == [
+        {"term": 1, "success": False},
+        {"term": 1, "ack": 0, "success": True},
+    ]
+    assert peer.groups[0].current_leader == "node1/groups/0"
+
+
+@pytest.mark.asyncio
+async def test_heartbeats_for_unknown_groups_are_refused() -> None:
+    host = make_host(groups=2)
+    requests = [
+        GroupHeartbeat(
+            group=group,  # type: ignore
+            term=2,
+            leader_id=group_node("node2", 1),
+            leader_commit=0,
+        )
+        for group in (-1, 1, 2, "0")
+    ]
+    request = MagicMock()
+    request.json = AsyncMock(return_value=requests)
+
+    resp = await host.handle_heartbeats(request)
+
+    data = json.loads(resp.text or "[]")
+    assert [response.get("error") for response in data] == [
+        "No group -1",
+        None,
+        "No group 2",
+        "No group '0'",
+    ]
+    assert host.groups[1].current_term == 2
+    assert host.groups[0].current_term == 0
+
+
+@pytest.mark.asyncio
+async def test_balance_loop_survives_failed_transfers() -> None:
+    host = make_host(groups=3)
+    host.balance_interval = 0.01
+    for group in (1, 2):
+        node = host.groups[group]
+        node.current_role = "LEADER"
+        node.acked_length[group_node(host.preferred_host(group), group)] = 0
+    host.groups[1].transfer_leadership = AsyncMock(side_effect=RuntimeError)  # type: ignore
+    host.groups[2].transfer_leadership = AsyncMock(return_value=False)  # type: ignore
+
+    task = asyncio.create_task(host.balance_loop())
+    await asyncio.sleep(0.05)
+    # group 1 fails every round, group 2 is still handed over and the loop goes on
+    assert host.groups[1].transfer_leadership.await_count > 1  # type: ignore
+    assert host.groups[2].transfer_leadership.await_count > 1  # type: ignore
+
+    # a transfer in progress is left alone
+    host.groups[2].transfer_target = "node3/groups/2"
+    host.groups[2].transfer_leadership.reset_mock()  # type: ignore
+    await asyncio.sleep(0.03)
+    host.groups[2].transfer_leadership.assert_not_awaited()  # type: ignore
+    task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_groups_of_a_host_campaign_in_turn() -> None:
+    host = make_host(groups=3)
+    slots = asyncio.Semaphore(1)  # one election at a time
+    release = asyncio.Event()
+    campaigns = []
+
+    async def run_campaign(node: Node) -> None:
+        campaigns.append(node.node_id)
+        await release.wait()
+
+    for node in host.groups:
+        node.campaign_slots = slots
+        node.run_campaign = lambda node=node: run_campaign(node)  # type: ignore
+    tasks = [asyncio.create_task(node.campaign()) for node in host.groups]
+    # a second timeout of a group while its campaign waits is dropped
+    tasks.append(asyncio.create_task(host.groups[1].campaign()))
+    await asyncio.sleep(0)
+    assert campaigns == ["node1/groups/0"]
+
+    # group 2 heard from a leader while it waited, it doesn't campaign
+    host.groups[2].leader_heard_at += 1
+    release.set()
+    await asyncio.gather(*tasks)
+    assert campaigns == ["node1/groups/0", "node1/groups/1"]
+
+
+@pytest.mark.asyncio
+async def test_hosts_elect_spread_leaders() -> None:
+    addresses = [f"127.0.0.1:{9450 + i}" for i in range(3)]
+    hosts = [
+        Host(address, [a for a in addresses if a != address], 6, data_dir=None)
+        for address in addresses
+    ]
+    for host in hosts:
+        host.heartbeat_timeout = 0.02
+        for node in host.groups:
+            node.election_timeout = 0.2
+            node.heartbeat_timeout = 0.02
+    for host, address in zip(hosts, addresses):
+        await host.start(int(address.split(":")[1]))
+    try:
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            leaders = [
+                [
+                    node
+                    for host in hosts
+                    for node in [host.groups[group]]
+                    if node.current_role == "LEADER"
+                ]
+                for group in range(6)
+            ]
+            if all(len(group) == 1 for group in leaders):
+                break
+        assert all(len(group) == 1 for group in leaders)
+        # every host leads the groups that prefer it
+        for group, (leader,) in enumerate(leaders):
+            assert leader.node_id == group_node(hosts[0].preferred_host(group), group)
+        assert (await leaders[0][0].submit_command("msg1")).committed
+    finally:
+        for host in hosts:
+            await host.stop()
+
+
+@pytest.mark.asyncio
+async def test_removing_a_group_member_keeps_the_shared_connections() -> None:
+    host = make_host()
+    host.transport.close = AsyncMock()  # type: ignore
+    node = host.groups[0]
+    node.log = [(1, "msg1")]
+    node.current_term = 1
+    node.become_leader()
+    node.commit_length = 1
+    node.change_config = AsyncMock(return_value=True)  # type: ignore
+    request = MagicMock()
+    request.json = AsyncMock(return_value={"remove": "node3/groups/0"})
+
+    resp = await node.handle_membership(request)
+
+    assert resp.text == "OK: Members ['node1/groups/0', 'node2/groups/0']"
+    # the other groups still talk to node3 over the same connections
+    host.transport.close.assert_not_awaited()
+    node.cancel_timers()
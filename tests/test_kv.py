@@ -0,0 +1,112 @@
+import json
+import pytest
+from typing import Any, Dict
+from unittest.mock import AsyncMock, MagicMock
+from aiohttp import web
+from server.raft_node import Node
+from server.state_machine import KVStateMachine
+
+
+def kv_request(key: str, body: Dict[str, Any] = {}) -> MagicMock:
+    request = MagicMock()
+    request.match_info = {"key": key}
+    request.json = AsyncMock(return_value=body)
+    return request
+
+
+def test_kv_apply() -> None:
+    kv = KVStateMachine()
+    put = json.dumps({"op": "put", "key": "a", "value": 1})
+    assert kv.apply(1, put) == {"ok": True}
+    cas = {"op": "cas", "key": "a", "expected": 2, "value": 3}
+    assert kv.apply(2, json.dumps(cas)) == {"ok": False, "value": 1}
+    cas["expected"] = 1
+    assert kv.apply(3, json.dumps(cas)) == {"ok": True}
+    assert kv.read({"key": "a"}) == {"key": "a", "value": 3}
+    assert kv.apply(4, json.dumps({"op": "delete", "key": "a"})) == {"ok": True}
+    assert kv.apply(5, json.dumps({"op": "delete", "key": "a"})) == {"ok": False}
+    # create only if absent
+    cas = {"op": "cas", "key": "b", "expected": None, "value": "x"}
+    assert kv.apply(6, json.dumps(cas)) == {"ok": True}
+    # anything else is ignored
+    assert kv.apply(7, "msg1") is None
+    assert kv.apply(8, json.dumps({"op": "get", "key": "b"})) is None
+    assert kv.data == {"b": "x"}
+
+    restored = KVStateMachine()
+    restored.restore(kv.snapshot())
+    assert restored.data == {"b": "x"}
+
+
+@pytest.mark.asyncio
+async def test_kv_endpoints() -> None:
+    node = Node("node1", [], state_machine=KVStateMachine())
+    node.current_term = 1
+    node.become_leader()
+
+    resp = await node.handle_kv_put(kv_request("a", {"value": "1"}))
+    assert json.loads(resp.text or "{}") == {"ok": True}
+    resp = await node.handle_kv_cas(kv_request("a", {"expected": "0", "value": "2"}))
+    assert json.loads(resp.text or "{}") == {"ok": False, "value": "1"}
+    resp = await node.handle_kv_get(kv_request("a"))
+    assert json.loads(resp.text or "{}") == {"key": "a", "value": "1"}
+    resp = await node.handle_kv_delete(kv_request("a"))
+    assert json.loads(resp.text or "{}") == {"ok": True}
+    with pytest.raises(web.HTTPNotFound):
+        await node.handle_kv_get(kv_request("a"))
+
+    assert node.log_length() == 3
+    assert node.apply_results == {}
+
+
+@pytest.mark.asyncio
+async def test_kv_put_on_follower() -> None:
+    node = Node("node1", ["node2"], state_machine=KVStateMachine())
+    node.current_leader = "node2"
+    resp = await node.handle_kv_put(kv_request("a", {"value": "1"}))
+    assert resp.status == 421
+    assert json.loads(resp.text or "{}")["leader"] == "node2"
+
+
+@pytest.mark.asyncio
+async def test_kv_retry_in_session() -> None:
+    node = Node("node1", [], state_machine=KVStateMachine())
+    node.current_term = 1
+    node.become_leader()
+
+    cas = {"expected": None, "value": "1", "client_id": "c1", "seq": 1}
+    resp = await node.handle_kv_cas(kv_request("a", cas))
+    assert json.loads(resp.text or "{}") == {"ok": True}
+    # the retry gets the first answer and isn't appended again
+    resp = await node.handle_kv_cas(kv_request("a", cas))
+    assert json.loads(resp.text or "{}") == {"ok": True}
+    assert node.log_length() == 1
+    assert node.sessions.clients["c1"][:2] == [1, {"ok": True}]
+
+    # a session entry applied twice, e.g. a retry sent to the next leader
+    node.log.append(node.log[0])
+    node.commit(2)
+    assert node.state_machine.data == {"a": "1"}
+
+    with pytest.raises(web.HTTPBadRequest):
+        await node.handle_kv_put(kv_request("a", {"value": "2", "client_id": "c1"}))
+
+    # the session of c2 expired or was evicted, its retry is refused
+    put = {"value": "3", "client_id": "c2", "seq": 2}
+    resp = await node.handle_kv_put(kv_request("a", put))
+    assert resp.status == 400
+    assert json.loads(resp.text or "{}") == {"error": "session expired"}
+    assert node.state_machine.data == {"a": "1"}
+
+
+def test_kv_snapshot_with_sessions_key() -> None:
+    node = Node("node1", [], state_machine=KVStateMachine())
+    node.log = [(1, json.dumps({"op": "put", "key": "sessions", "value": "1"}))]
+    node.commit(1)
+    node.take_snapshot()
+
+    restarted = Node("node1", [], state_machine=KVStateMachine())
+    assert node.snapshot is not None
+    restarted.restore_snapshot(node.snapshot)
+    assert restarted.state_machine.data == {"sessions": "1"}
+    assert len(restarted.sessions) == 0
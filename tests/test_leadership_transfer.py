@@ -0,0 +1,140 @@
+import json
+import pytest
+from time import monotonic
+from typing import Dict
+from unittest.mock import AsyncMock, MagicMock
+from server import codec
+from server.raft_node import Node, RequestVote
+from tests.test_snapshot import LocalTransport
+
+
+def cluster() -> Dict[str, Node]:
+    names = ["node1", "node2", "node3"]
+    nodes = {name: Node(name, [n for n in names if n != name]) for name in names}
+    transport = LocalTransport(nodes)
+    for node in nodes.values():
+        node.transport = transport  # type: ignore
+        node.heartbeat_timeout = 0.01
+        node.current_term = 1
+    leader = nodes["node1"]
+    leader.log = [(1, "msg1"), (1, "msg2")]
+    leader.become_leader()
+    return nodes
+
+
+def transfer_request(body: Dict[str, str]) -> MagicMock:
+    request = MagicMock()
+    request.body_exists = bool(body)
+    request.json = AsyncMock(return_value=body)
+    return request
+
+
+@pytest.mark.asyncio
+async def test_transfer_leadership_to_target() -> None:
+    nodes = cluster()
+    leader = nodes["node1"]
+
+    resp = await leader.handle_transfer_leadership(
+        transfer_request({"target": "node2"})
+    )
+
+    assert resp.text == "OK: Leadership transferred to 'node2'"
+    assert nodes["node2"].current_role == "LEADER"
+    assert nodes["node2"].current_term == 2
+    # the new leader had the whole log before its election
+    assert nodes["node2"].log == [(1, "msg1"), (1, "msg2")]
+    assert leader.current_role == "FOLLOWER"
+    assert leader.transfer_target == ""
+
+
+@pytest.mark.asyncio
+async def test_transfer_leadership_picks_most_caught_up_follower() -> None:
+    nodes = cluster()
+    leader = nodes["node1"]
+    leader.acked_length["node3"] = 2
+    nodes["node3"].follow_leader(1, "node1")  # it got the log from us
+
+    resp = await leader.handle_transfer_leadership(transfer_request({}))
+
+    assert resp.text == "OK: Leadership transferred to 'node3'"
+    assert nodes["node3"].current_role == "LEADER"
+
+
+@pytest.mark.asyncio
+async def test_transfer_leadership_refuses_commands() -> None:
+    nodes = cluster()
+    leader = nodes["node1"]
+    leader.transfer_target = "node2"
+
+    request = MagicMock()
+    request.json = AsyncMock(return_value={"command": "msg3"})
+    resp = await leader.handle_command(request)
+    assert (
+        resp.text == "ERROR: Leadership transfer in progress, retry with the new LEADER"
+    )
+    resp = await leader.handle_transfer_leadership(transfer_request({}))
+    assert resp.text == "ERROR: Leadership transfer to 'node2' in progress"
+    assert leader.log_length() == 2
+
+
+@pytest.mark.asyncio
+async def test_transfer_leadership_revokes_lease() -> None:
+    nodes = cluster()
+    leader = nodes["node1"]
+    leader.read_mode = "lease"
+    leader.election_timeout = 0.05
+    leader.acked_length["node2"] = 2
+    sent_at = monotonic()
+    for follower in leader.nodes:
+        leader.renew_lease(follower, sent_at)
+    assert leader.lease_valid()
+    # node2 is elected, but we don't hear of its term in time
+    leader.transport = MagicMock()
+    leader.transport.post = AsyncMock(return_value={"term": 1, "success": True})
+
+    assert not await leader.transfer_leadership("node2")
+
+    assert leader.current_role == "LEADER"
+    assert not leader.lease_valid()
+    # acks of heartbeats sent before TimeoutNow don't bring the lease back
+    leader.renew_lease("node3", sent_at)
+    assert leader.lease_acks == {}
+    leader.renew_lease("node3", monotonic())
+    assert leader.lease_valid()
+
+
+@pytest.mark.asyncio
+async def test_timeout_now_from_old_term_is_refused() -> None:
+    node = Node("node2", ["node1", "node3"])
+    node.current_term = 3
+    request = MagicMock()
+    request.json = AsyncMock(return_value={"term": 2, "leader_id": "node1"})
+
+    resp = await node.handle_timeout_now(request)
+
+    assert json.loads(resp.text or "{}") == {"term": 3, "success": False}
+    assert node.current_role == "FOLLOWER"
+
+
+@pytest.mark.asyncio
+async def test_timeout_now_from_another_node_is_refused() -> None:
+    node = Node("node2", ["node1", "node3"])
+    node.follow_leader(3, "node1")
+    request = MagicMock()
+    request.json = AsyncMock(return_value={"term": 3, "leader_id": "node3"})
+
+    resp = await node.handle_timeout_now(request)
+
+    assert json.loads(resp.text or "{}") == {"term": 3, "success": False}
+    assert node.current_role == "FOLLOWER"
+
+
+def test_leadership_transfer_vote_round_trip() -> None:
+    request = RequestVote(
+        term=3,
+        candidate_id="node2",
+        last_log_index=7,
+        last_log_term=2,
+        leadership_transfer=True,
+    )
+    assert codec.decode_vote(codec.encode_vote(request)) == request
@@ -0,0 +1,93 @@
+import pytest
+from typing import List, Tuple
+from server import codec
+from server.log_store import LogStore
+
+
+def test_log_store_behaves_like_a_list() -> None:
+    entries = [(1, "msg1"), (2, "ünïcode"), (2, ""), (3, "msg4")]
+    log = LogStore(entries[:1])
+    log.append(entries[1])
+    log.extend(entries[2:])
+
+    assert log == entries
+    assert list(log) == entries
+    assert log[1] == (2, "ünïcode")
+    assert log[-1] == (3, "msg4")
+    assert log[1:3] == entries[1:3]
+    assert list(log.terms) == [1, 2, 2, 3]
+    with pytest.raises(IndexError):
+        log[4]
+
+    del log[3:]
+    assert log == entries[:3]
+    del log[:1]
+    assert log == entries[1:3]
+    log.append((4, "msg5"))
+    assert log == [*entries[1:3], (4, "msg5")]
+    with pytest.raises(ValueError):
+        del log[1:2]
+
+
+def test_log_store_columns_are_the_binary_codec() -> None:
+    entries = [(1, f"msg{i}") for i in range(5)] + [(2, "ünïcode")]
+    log = LogStore(entries)
+    assert b"".join(log.columns(2, 6)) == b"".join(codec.encode_entries(entries[2:6]))
+    assert log.size(0, 2) == 8
+
+
+def test_log_slice_follows_compaction() -> None:
+    log = LogStore([(1, f"msg{i}") for i in range(5)])
+    view = log.view(2, 4)
+    assert view == [(1, "msg2"), (1, "msg3")]
+
+    # a dropped prefix moves the entries, the view still finds them
+    log.drop(1)
+    assert view == [(1, "msg2"), (1, "msg3")]
+    assert b"".join(view.columns()) == b"".join(log.columns(1, 3))
+
+    # once they may have been replaced it refuses to read them
+    log.truncate(3)
+    with pytest.raises(LookupError):
+        list(view)
+
+    # or once they have been dropped
+    stale = log.view(0, 1)
+    log.drop(1)
+    with pytest.raises(LookupError):
+        stale.columns()
+
+
+class ListSource:
+    def __init__(self, entries: List[Tuple[int, str]]) -> None:
+        self.entries = entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def term(self, index: int) -> int:
+        return self.entries[index][0]
+
+    def command(self, index: int) -> str:
+        return self.entries[index][1]
+
+    def size_of(self, start: int, stop: int) -> int:
+        return sum(len(c.encode()) for _, c in self.entries[start:stop])
+
+
+def test_log_store_with_cold_entries() -> None:
+    entries = [(1, f"msg{i}") for i in range(6)]
+    log = LogStore(cold=[ListSource(entries[:2]), ListSource(entries[2:4])])
+    log.extend(entries[4:])
+    assert log == entries
+    assert log.size(1, 5) == 16
+    # columns across the cold entries are encoded, the rest are views
+    assert b"".join(log.columns(3, 6)) == b"".join(codec.encode_entries(entries[3:]))
+
+    view = log.view(3, 5)
+    del log[:3]
+    assert view == entries[3:5]
+    del log[1:]
+    assert log == entries[3:4]
+    log.append((2, "msg4b"))
+    assert log == [entries[3], (2, "msg4b")]
@@ -0,0 +1,168 @@
+import pytest
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+from server.raft_node import Node, config_command
+from server.storage import DiskStorage
+from tests.test_leadership_transfer import cluster
+
+
+def membership_request(body: dict) -> MagicMock:
+    request = MagicMock()
+    request.json = AsyncMock(return_value=body)
+    return request
+
+
+@pytest.mark.asyncio
+async def test_add_node_through_the_log() -> None:
+    nodes = cluster()
+    leader = nodes["node1"]
+    await leader.submit_command("msg3")  # an entry of our term is committed
+    nodes["node4"] = Node("node4", ["node1", "node2", "node3"], joining=True)
+    nodes["node4"].transport = leader.transport
+    assert nodes["node4"].nodes == []
+
+    resp = await leader.handle_membership(membership_request({"add": "node4"}))
+
+    assert resp.text == "OK: Members ['node1', 'node2', 'node3', 'node4']"
+    assert leader.nodes == ["node2", "node3", "node4"]
+    assert leader.majority == 3
+    assert leader.acked_length["node4"] == leader.log_length() == 4
+    # the new node caught up and knows the members from the log
+    assert nodes["node4"].nodes == ["node1", "node2", "node3"]
+    assert nodes["node4"].log.command(3) == config_command(
+        ["node1", "node2", "node3", "node4"]
+    )
+    # configuration entries are not applied to the state machine
+    assert str(leader.state_machine) == "_msg1_msg2_msg3_"
+
+
+@pytest.mark.asyncio
+async def test_remove_node_through_the_log() -> None:
+    nodes = cluster()
+    leader = nodes["node1"]
+    await leader.submit_command("msg3")
+
+    resp = await leader.handle_membership(membership_request({"remove": "node3"}))
+
+    assert resp.text == "OK: Members ['node1', 'node2']"
+    assert leader.nodes == ["node2"]
+    assert leader.majority == 2
+    assert "node3" not in leader.acked_length
+    assert nodes["node2"].nodes == ["node1"]
+    # the removed node doesn't start elections any more
+    nodes["node3"].log = leader.log
+    nodes["node3"].configs = list(leader.configs)
+    nodes["node3"].on_election_timeout()
+    assert nodes["node3"].current_role == "FOLLOWER"
+
+
+@pytest.mark.asyncio
+async def test_membership_change_refused() -> None:
+    nodes = cluster()
+    leader = nodes["node1"]
+
+    # nothing of our term committed yet
+    resp = await leader.handle_membership(membership_request({"add": "node4"}))
+    assert resp.text == "ERROR: Membership change in progress, retry"
+    await leader.submit_command("msg3")
+    resp = await leader.handle_membership(membership_request({"remove": "node1"}))
+    assert resp.text == "ERROR: Transfer leadership before removing the LEADER"
+    resp = await leader.handle_membership(membership_request({"add": "node2"}))
+    assert resp.text == "ERROR: No membership change"
+
+    request = MagicMock()
+    request.json = AsyncMock(return_value={"command": config_command(["node1"])})
+    resp = await leader.handle_command(request)
+    assert resp.text == "ERROR: Reserved command, use /membership"
+
+
+def test_truncated_configuration_is_dropped() -> None:
+    node = Node("node1", ["node2", "node3"])
+    config = config_command(["node1", "node2", "node3", "node4"])
+    node.append_entries(0, 0, [(1, "msg1"), (1, config)])
+    assert node.nodes == ["node2", "node3", "node4"]
+    assert node.majority == 3
+
+    # a new leader overwrites the uncommitted entry
+    node.append_entries(1, 0, [(2, "msg2")])
+    assert node.nodes == ["node2", "node3"]
+    assert node.majority == 2
+    assert node.configs == [
+        (0, {"members": ["node1", "node2", "node3"], "learners": []})
+    ]
+
+
+def test_configurations_survive_restart(tmp_path: Path) -> None:
+    node = Node("node1", ["node2", "node3"], data_dir=str(tmp_path))
+    config = config_command(["node1", "node2"])
+    node.append_entries(0, 0, [(1, "msg1"), (1, config)])
+    node.storage.close()
+
+    node = Node("node1", ["node2", "node3"], data_dir=str(tmp_path))
+    assert node.nodes == ["node2"]
+    node.storage.close()
+
+    # a configuration whose entry didn't reach the log is ignored
+    storage = DiskStorage(str(tmp_path))
+    storage.save_configs(
+        [
+            (0, {"members": ["node1", "node2"], "learners": []}),
+            (5, {"members": ["node1"], "learners": []}),
+        ]
+    )
+    node = Node("node1", ["node2", "node3"], data_dir=str(tmp_path))
+    assert node.nodes == ["node2"]
+    assert node.configs == [(0, {"members": ["node1", "node2"], "learners": []})]
+    node.storage.close()
+
+
+@pytest.mark.asyncio
+async def test_learner_gets_the_log_without_voting() -> None:
+    nodes = cluster()
+    leader = nodes["node1"]
+    await leader.submit_command("msg3")
+    nodes["node4"] = Node("node4", ["node1", "node2", "node3"], joining=True)
+    nodes["node4"].transport = leader.transport
+
+    resp = await leader.handle_membership(membership_request({"add_learner": "node4"}))
+
+    assert resp.text == "OK: Members ['node1', 'node2', 'node3'], learners ['node4']"
+    assert leader.nodes == ["node2", "node3", "node4"]
+    assert leader.voters == ["node2", "node3"]
+    assert leader.majority == 2
+    assert nodes["node4"].log_length() == 4
+    assert nodes["node4"].voters == ["node1", "node2", "node3"]
+    # a learner far behind doesn't hold back commits
+    leader.acked_length["node4"] = 0
+    leader.acked_length["node2"] = 4
+    assert leader.quorum_length() == 4
+    # nor does it start elections
+    nodes["node4"].on_election_timeout()
+    assert nodes["node4"].current_role == "FOLLOWER"
+
+
+@pytest.mark.asyncio
+async def test_learner_promoted_once_caught_up() -> None:
+    nodes = cluster()
+    leader = nodes["node1"]
+    leader.learner_max_lag = 1
+    await leader.submit_command("msg3")
+    nodes["node4"] = Node("node4", ["node1", "node2", "node3"], joining=True)
+    nodes["node4"].transport = leader.transport
+    await leader.handle_membership(membership_request({"add_learner": "node4"}))
+
+    leader.acked_length["node4"] = 0
+    resp = await leader.handle_membership(membership_request({"promote": "node4"}))
+    assert resp.text == "ERROR: 'node4' is 4 entries behind, retry later"
+
+    leader.acked_length["node4"] = leader.log_length()
+    resp = await leader.handle_membership(membership_request({"promote": "node4"}))
+    assert resp.text == "OK: Members ['node1', 'node2', 'node3', 'node4']"
+    assert leader.voters == ["node2", "node3", "node4"]
+    assert leader.majority == 3
+    assert nodes["node4"].configs[-1][1]["members"] == [
+        "node1",
+        "node2",
+        "node3",
+        "node4",
+    ]
@@ -0,0 +1,245 @@
+import json
+import pytest
+import asyncio
+from time import monotonic
+from typing import Any, List, Tuple
+from unittest.mock import AsyncMock, MagicMock
+from server.raft_node import ELECTION_TIMEOUT, NOOP, Node, ResponseAppend
+
+
+class ConfirmTransport:
+    """Answers every AppendEntries in the given term once the test releases it."""
+
+    def __init__(self, term: int = 1) -> None:
+        self.term = term
+        self.requests: List[Tuple[str, Any]] = []
+        self.release = asyncio.Event()
+
+    async def post(
+        self, node: str, path: str, data: Any, timeout: float, encode: Any = None
+    ) -> Any:
+        self.requests.append((node, data))
+        await self.release.wait()
+        ack = data["log_length"] + len(data["entries"])
+        return ResponseAppend(term=self.term, ack=ack, success=True)
+
+
+async def settle() -> None:
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def make_leader(transport: ConfirmTransport) -> Node:
+    node = Node("node1", ["node2", "node3"])
+    node.current_term = 1
+    node.log = [(1, "msg1")]
+    node.transport = transport  # type: ignore
+    node.become_leader()
+    node.commit(1)
+    return node
+
+
+@pytest.mark.asyncio
+async def test_reads_share_one_heartbeat_round() -> None:
+    transport = ConfirmTransport()
+    node = make_leader(transport)
+
+    reads = [asyncio.create_task(node.read_index()) for _ in range(5)]
+    await settle()
+    assert sorted(n for n, _ in transport.requests) == ["node2", "node3"]
+    assert transport.requests[0][1]["entries"] == []
+
+    transport.release.set()
+    assert await asyncio.gather(*reads) == [1] * 5
+    # reads never grow the log
+    assert node.log == [(1, "msg1")]
+
+
+@pytest.mark.asyncio
+async def test_read_waits_for_a_round_started_after_it() -> None:
+    transport = ConfirmTransport()
+    node = make_leader(transport)
+
+    first = asyncio.create_task(node.read_index())
+    await settle()
+    second = asyncio.create_task(node.read_index())
+    await settle()
+    assert len(transport.requests) == 2
+
+    transport.release.set()
+    assert await first == 1
+    assert await second == 1
+    assert len(transport.requests) == 4
+
+
+@pytest.mark.asyncio
+async def test_read_fails_after_newer_term() -> None:
+    transport = ConfirmTransport(term=2)
+    transport.release.set()
+    node = make_leader(transport)
+
+    assert await node.read_index() is None
+    assert node.current_role == "FOLLOWER"
+    assert node.current_term == 2
+
+
+@pytest.mark.asyncio
+async def test_read_commits_noop_in_new_term() -> None:
+    transport = ConfirmTransport(term=2)
+    transport.release.set()
+    node = make_leader(transport)
+    node.current_term = 2
+    node.become_leader()
+
+    assert await node.read_index() == 2
+    assert node.log == [(1, "msg1"), (2, NOOP)]
+    # the no-op is not applied
+    assert str(node.state_machine) == "_msg1_"
+
+
+@pytest.mark.asyncio
+async def test_handle_read() -> None:
+    node = Node("node1", [])
+    node.current_term = 1
+    node.log = [(1, "msg1"), (1, "msg2")]
+    node.become_leader()
+    node.commit(2)
+
+    request = MagicMock()
+    request.query = {"offset": "1"}
+    resp = await node.handle_read(request)
+    assert json.loads(resp.text or "{}")["commands"] == ["msg2"]
+
+    # a follower without a leader cannot get a read index
+    node.current_role = "FOLLOWER"
+    node.current_leader = ""
+    resp = await node.handle_read(request)
+    assert resp.status == 503
+
+
+@pytest.mark.asyncio
+async def test_lease_read_skips_the_round() -> None:
+    transport = ConfirmTransport()
+    transport.release.set()
+    node = make_leader(transport)
+    node.read_mode = "lease"
+
+    # no lease yet, the first read confirms leadership and takes the lease
+    assert await node.read_index() == 1
+    assert len(transport.requests) == 2
+    assert node.lease_valid()
+    assert await node.read_index() == 1
+    assert len(transport.requests) == 2
+
+    # the lease ends ELECTION_TIMEOUT - lease_drift after the acked requests were sent
+    node.lease_acks = {"node2": monotonic() - ELECTION_TIMEOUT, "node3": 0.0}
+    assert not node.lease_valid()
+    assert await node.read_index() == 1
+    assert len(transport.requests) == 4
+
+
+def test_replication_renews_lease() -> None:
+    node = make_leader(ConfirmTransport())
+    node.read_mode = "lease"
+    request_data = node.append_request(1)
+    sent_at = monotonic()
+    node.process_append_response(
+        "node2", request_data, ResponseAppend(term=1, ack=1, success=True), sent_at
+    )
+    assert node.lease_acks == {"node2": sent_at}
+    assert node.lease_valid()
+
+
+@pytest.mark.asyncio
+async def test_lease_follower_keeps_its_leader() -> None:
+    node = Node("node2", ["node1", "node3"])
+    node.read_mode = "lease"
+    node.follow_leader(1, "node1")
+
+    request = MagicMock()
+    request.json = AsyncMock(
+        return_value=dict(
+            term=2, candidate_id="node3", last_log_index=0, last_log_term=0
+        )
+    )
+    resp = await node.handle_request_vote(request)
+    assert json.loads(resp.text or "{}")["vote_granted"] is False
+
+    node.leader_heard_at -= ELECTION_TIMEOUT
+    resp = await node.handle_request_vote(request)
+    assert json.loads(resp.text or "{}")["vote_granted"] is True
+
+
+@pytest.mark.asyncio
+async def test_lease_follower_restart_keeps_its_leader(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Any
+) -> None:
+    monkeypatch.setattr("server.raft_node.READ_MODE", "lease")
+    node = Node("node2", ["node1", "node3"], data_dir=str(tmp_path))
+    node.follow_leader(1, "node1")
+    await node.stop()
+
+    # the leader's lease may still count on the restarted node
+    node = Node("node2", ["node1", "node3"], data_dir=str(tmp_path))
+    request = MagicMock()
+    request.json = AsyncMock(
+        return_value=dict(
+            term=2, candidate_id="node3", last_log_index=0, last_log_term=0
+        )
+    )
+    resp = await node.handle_request_vote(request)
+    assert json.loads(resp.text or "{}")["vote_granted"] is False
+    assert node.current_term == 1
+
+    node.leader_heard_at -= ELECTION_TIMEOUT
+    resp = await node.handle_request_vote(request)
+    assert json.loads(resp.text or "{}")["vote_granted"] is True
+    await node.stop()
+
+
+class LeaderTransport:
+    """Delivers ReadIndex requests to an in-process leader."""
+
+    def __init__(self, leader: Node) -> None:
+        self.leader = leader
+        self.requests = 0
+
+    async def post(
+        self, node: str, path: str, data: Any, timeout: float, encode: Any = None
+    ) -> Any:
+        assert (node, path) == ("node1", "/read_index")
+        self.requests += 1
+        resp = await self.leader.handle_read_index(MagicMock())
+        return json.loads(resp.text or "{}")
+
+
+@pytest.mark.asyncio
+async def test_follower_read_waits_for_apply() -> None:
+    confirm = ConfirmTransport()
+    confirm.release.set()
+    leader = make_leader(confirm)
+    follower = Node("node2", ["node1", "node3"])
+    follower.follow_leader(1, "node1")
+    follower.log = [(1, "msg1")]
+    follower.transport = LeaderTransport(leader)  # type: ignore
+
+    reads = [asyncio.create_task(follower.read_index()) for _ in range(3)]
+    await settle()
+    # one request to the leader for all reads, then they wait for msg1
+    assert follower.transport.requests == 1  # type: ignore
+    assert not any(read.done() for read in reads)
+
+    follower.commit(1)
+    assert await asyncio.gather(*reads) == [1, 1, 1]
+    assert follower.apply_waiters == []
+
+
+@pytest.mark.asyncio
+async def test_follower_read_without_leader_confirmation() -> None:
+    leader = make_leader(ConfirmTransport(term=2))
+    leader.transport.release.set()  # type: ignore
+    follower = Node("node2", ["node1", "node3"])
+    follower.follow_leader(1, "node1")
+    follower.transport = LeaderTransport(leader)  # type: ignore
+
+    assert await follower.read_index() is None
@@ -1,10 +1,14 @@
 import pytest
-from aioresponses import aioresponses
+import pytest_asyncio
+from typing import Any, AsyncIterator
+from aioresponses import CallbackResult, aioresponses
+from server.codec import decode_append
 from server.raft_node import Node
+from server.state_machine import LogStateMachine
 
 
-@pytest.fixture
-def node() -> Node:
+@pytest_asyncio.fixture
+async def node() -> AsyncIterator[Node]:
     node = Node("node1", ["node2", "node3"])
     node.current_role = "LEADER"
     node.current_term = 2
@@ -13,8 +17,8 @@ def node() -> Node:
     node.acked_length = {"node1": 2, "node2": 1, "node3": 0}
     node.commit_length = 0
     node.majority = 2
-    node.state_machine = "_"
-    return node
+    yield node
+    await node.transport.close()
 
 
 @pytest.mark.asyncio
@@ -31,7 +35,7 @@ async def test_replicate_log_successful_update_simple(node: Node) -> None:
         assert node.sent_length["node2"] == 2
         assert node.acked_length["node2"] == 2
         assert node.commit_length == 2
-        assert node.state_machine == "_msg1_msg2_"
+        assert str(node.state_machine) == "_msg1_msg2_"
 
 
 @pytest.mark.asyncio
@@ -57,8 +61,8 @@ async def test_replicate_log_unsuccessful(node: Node) -> None:
     response = dict(term=2, ack=0, success=False)
 
     with aioresponses() as mock:
-        # Mock the HTTP request
-        mock.post("http://node2:8080/append_entries", payload=response)  # type: ignore
+        # Mock the HTTP request, the retry from sent_length 0 is rejected too
+        mock.post("http://node2:8080/append_entries", payload=response, repeat=True)  # type: ignore
         result = await node.replicate_log("node2")
 
         assert result is True
@@ -68,9 +72,160 @@ async def test_replicate_log_unsuccessful(node: Node) -> None:
 @pytest.mark.asyncio
 async def test_replicate_log_exception_returns_false(node: Node) -> None:
     with aioresponses() as mock:
-        mock.post( # type: ignore
+        mock.post(  # type: ignore
             "http://node2:8080/append_entries", exception=Exception("network error")
         )
         result = await node.replicate_log("node2")
 
         assert result is False
+
+
+@pytest.mark.asyncio
+async def test_replicate_log_follower_behind_jumps_to_its_log_length(
+    node: Node,
+) -> None:
+    node.log = [(1, f"msg{i}") for i in range(1, 101)]
+    node.sent_length["node2"] = 100
+    node.acked_length["node1"] = 100
+
+    with aioresponses() as mock:
+        mock.post(  # type: ignore
+            "http://node2:8080/append_entries",
+            payload=dict(
+                term=2, ack=0, success=False, conflict_term=0, conflict_index=40
+            ),
+        )
+        mock.post(  # type: ignore
+            "http://node2:8080/append_entries",
+            payload=dict(term=2, ack=100, success=True),
+        )
+        result = await node.replicate_log("node2")
+
+        assert result is True
+        requests = [
+            decode_append(call.kwargs["data"])
+            for calls in mock.requests.values()  # type: ignore
+            for call in calls
+        ]
+        assert [r["log_length"] for r in requests] == [100, 40]
+        assert len(requests[1]["entries"]) == 60
+        assert node.sent_length["node2"] == 100
+        assert node.acked_length["node2"] == 100
+
+
+@pytest.mark.asyncio
+async def test_replicate_log_skips_conflicting_term(node: Node) -> None:
+    # the follower has entries of term 3 from a leader we never heard of
+    node.current_term = 4
+    node.log = [(1, "msg1"), (1, "msg2"), (2, "msg3"), (4, "msg4"), (4, "msg5")]
+    node.sent_length["node2"] = 5
+
+    response = dict(term=4, ack=0, success=False, conflict_term=3, conflict_index=3)
+    assert node.backtrack(5, response) == 3  # type: ignore
+
+    # the follower's conflicting entry has a term we know: stop after our last one
+    response = dict(term=4, ack=0, success=False, conflict_term=1, conflict_index=0)
+    assert node.backtrack(5, response) == 2  # type: ignore
+
+    # without hints fall back to one entry at a time
+    response = dict(term=4, ack=0, success=False)
+    assert node.backtrack(5, response) == 4  # type: ignore
+
+
+def test_quorum_length() -> None:
+    node = Node("node1", ["node2", "node3", "node4", "node5"])
+    assert node.quorum_length() == 0
+    node.acked_length = {"node1": 9, "node2": 7, "node3": 3, "node4": 8, "node5": 0}
+    # 9, 8, 7 are acked by three of five nodes
+    assert node.quorum_length() == 7
+
+
+@pytest.mark.asyncio
+async def test_replicate_log_does_not_commit_previous_term_by_counting(
+    node: Node,
+) -> None:
+    # the majority has msg1 of term 1, but nothing of the current term 2
+    response = dict(term=2, ack=1, success=True)
+    node.acked_length["node1"] = 1
+
+    with aioresponses() as mock:
+        mock.post("http://node2:8080/append_entries", payload=response)  # type: ignore
+        await node.replicate_log("node2")
+
+    assert node.acked_length["node2"] == 1
+    assert node.commit_length == 0
+
+
+@pytest.mark.asyncio
+async def test_replicate_log_commit_length_does_not_decrease(node: Node) -> None:
+    node.commit_length = 2
+    node.state_machine = LogStateMachine(["msg1", "msg2"])
+    node.acked_length = {"node1": 2, "node2": 0, "node3": 0}
+    response = dict(term=2, ack=1, success=True)
+
+    with aioresponses() as mock:
+        mock.post("http://node2:8080/append_entries", payload=response)  # type: ignore
+        await node.replicate_log("node2")
+
+    assert node.commit_length == 2
+    assert str(node.state_machine) == "_msg1_msg2_"
+
+
+@pytest.mark.asyncio
+async def test_replicate_log_catches_up_in_chunks(node: Node) -> None:
+    node.log = [(2, f"msg{i}") for i in range(1, 11)]
+    node.sent_length["node2"] = 0
+    node.append_max_entries = 4
+    node.catchup_timeout = 30.0
+
+    def ack(url: Any, **kwargs: Any) -> CallbackResult:
+        request = decode_append(kwargs["data"])
+        length = request["log_length"] + len(request["entries"])
+        return CallbackResult(payload=dict(term=2, ack=length, success=True))
+
+    with aioresponses() as mock:
+        mock.post("http://node2:8080/append_entries", callback=ack, repeat=True)  # type: ignore
+        assert await node.replicate_log("node2") is True
+        calls = [call for calls in mock.requests.values() for call in calls]  # type: ignore
+
+    requests = [decode_append(call.kwargs["data"]) for call in calls]
+    assert [r["log_length"] for r in requests] == [0, 4, 8]
+    assert [len(r["entries"]) for r in requests] == [4, 4, 2]
+    assert [call.kwargs["timeout"].total for call in calls] == [30.0, 30.0, 30.0]
+    assert node.acked_length["node2"] == 10
+
+
+@pytest.mark.asyncio
+async def test_replicate_log_full_last_chunk_gets_catchup_timeout(node: Node) -> None:
+    node.log = [(2, f"msg{i}") for i in range(1, 9)]
+    node.sent_length["node2"] = 0
+    node.append_max_entries = 4
+    node.catchup_timeout = 30.0
+
+    def ack(url: Any, **kwargs: Any) -> CallbackResult:
+        request = decode_append(kwargs["data"])
+        length = request["log_length"] + len(request["entries"])
+        return CallbackResult(payload=dict(term=2, ack=length, success=True))
+
+    with aioresponses() as mock:
+        mock.post("http://node2:8080/append_entries", callback=ack, repeat=True)  # type: ignore
+        assert await node.replicate_log("node2") is True
+        # a heartbeat without entries keeps the short timeout
+        assert await node.replicate_log("node2") is True
+        calls = [call for calls in mock.requests.values() for call in calls]  # type: ignore
+
+    requests = [decode_append(call.kwargs["data"]) for call in calls]
+    # the last chunk is a full one that reaches the end of the log
+    assert [len(r["entries"]) for r in requests] == [4, 4, 0]
+    assert [call.kwargs["timeout"].total for call in calls] == [30.0, 30.0, 1.0]
+    assert node.acked_length["node2"] == 8
+
+
+def test_append_request_byte_cap(node: Node) -> None:
+    node.log = [(2, "x" * 100) for _ in range(10)]
+    node.append_max_bytes = 250
+    # cut after the entry that reaches the cap
+    assert len(node.append_request(0)["entries"]) == 3
+    assert len(node.append_request(0, max_bytes=100)["entries"]) == 1
+    node.append_max_bytes = 0
+    assert len(node.append_request(0)["entries"]) == 10
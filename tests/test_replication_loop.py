@@ -0,0 +1,135 @@
+import pytest
+import asyncio
+from typing import Any, List, Tuple
+from unittest.mock import AsyncMock, MagicMock
+from server.raft_node import Node, RequestAppend, ResponseAppend
+
+
+class FakeTransport:
+    """Holds every AppendEntries request until the test answers it."""
+
+    def __init__(self) -> None:
+        self.requests: List[Tuple[str, RequestAppend, asyncio.Future[Any]]] = []
+
+    async def post(
+        self, node: str, path: str, data: Any, timeout: float, encode: Any = None
+    ) -> Any:
+        future: asyncio.Future[Any] = asyncio.get_running_loop().create_future()
+        self.requests.append((node, data, future))
+        return await future
+
+
+async def settle() -> None:
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+async def step_down(node: Node) -> None:
+    """Let the replication loops of a test leader exit."""
+    node.current_role = "FOLLOWER"
+    for event in node.replication_events.values():
+        event.set()
+    await settle()
+
+
+def make_leader() -> Node:
+    node = Node("node1", ["node2"])
+    node.replication_window = 3
+    node.current_term = 1
+    node.log = [(1, "msg1")]
+    node.transport = FakeTransport()  # type: ignore
+    node.become_leader()
+    node.acked_length[node.node_id] = len(node.log)
+    return node
+
+
+@pytest.mark.asyncio
+async def test_replication_loop_keeps_window_in_flight() -> None:
+    node = make_leader()
+    transport: FakeTransport = node.transport  # type: ignore
+    for i in range(2, 7):
+        node.log.append((1, f"msg{i}"))
+        node.acked_length[node.node_id] = len(node.log)
+        node.replication_events["node2"].set()
+        await settle()
+
+    # three requests in flight, none acked yet, sent_length is optimistic
+    assert [r["log_length"] for _, r, _ in transport.requests] == [1, 2, 3]
+    assert node.sent_length["node2"] == 4
+    assert node.acked_length["node2"] == 0
+
+    # the first ack opens the window for the rest of the log
+    _, request, future = transport.requests[0]
+    future.set_result(ResponseAppend(term=1, ack=2, success=True))
+    await settle()
+    assert [r["log_length"] for _, r, _ in transport.requests] == [1, 2, 3, 4]
+    assert transport.requests[3][1]["entries"] == [(1, "msg5"), (1, "msg6")]
+    assert node.sent_length["node2"] == 6
+    assert node.acked_length["node2"] == 2
+    assert node.commit_length == 2
+
+    await step_down(node)
+
+
+@pytest.mark.asyncio
+async def test_replication_loop_rolls_back_on_rejection() -> None:
+    node = make_leader()
+    transport: FakeTransport = node.transport  # type: ignore
+    node.sent_length["node2"] = 1
+    node.log.append((1, "msg2"))
+    node.replication_events["node2"].set()
+    await settle()
+
+    _, request, future = transport.requests[0]
+    assert request["log_length"] == 1
+    future.set_result(ResponseAppend(term=1, ack=0, success=False))
+    await settle()
+
+    # resent from one entry earlier
+    _, request, _ = transport.requests[1]
+    assert request["log_length"] == 0
+    assert request["entries"] == [(1, "msg1"), (1, "msg2")]
+    assert node.sent_length["node2"] == 2
+
+    await step_down(node)
+
+
+@pytest.mark.asyncio
+async def test_replication_loop_byte_budget() -> None:
+    node = make_leader()
+    transport: FakeTransport = node.transport  # type: ignore
+    node.replication_window_bytes = 40
+    node.log.extend([(1, "x" * 10) for _ in range(4)])
+    node.replication_events["node2"].set()
+    await settle()
+
+    # two entries of 26 bytes use up the budget, even for heartbeats
+    assert [len(r["entries"]) for _, r, _ in transport.requests] == [2]
+    node.heartbeat_due.add("node2")
+    node.replication_events["node2"].set()
+    await settle()
+    assert len(transport.requests) == 1
+
+    await step_down(node)
+
+
+@pytest.mark.asyncio
+async def test_handle_command_pipelined_waits_for_commit() -> None:
+    node = make_leader()
+    transport: FakeTransport = node.transport  # type: ignore
+    request = MagicMock()
+    request.json = AsyncMock(return_value={"command": "msg2"})
+    response = asyncio.create_task(node.handle_command(request))
+    await settle()
+
+    _, request_data, future = transport.requests[0]
+    assert request_data["entries"] == [(1, "msg2")]
+    assert not response.done()
+
+    future.set_result(ResponseAppend(term=1, ack=2, success=True))
+    resp = await response
+    assert "OK: Command 'msg2' added to log" in (resp.text or "")
+    assert node.commit_length == 2
+    assert node.commit_waiters == []
+
+    await step_down(node)
@@ -0,0 +1,158 @@
+import json
+import pytest
+from pathlib import Path
+from typing import Any, Dict
+from unittest.mock import AsyncMock, MagicMock
+from aiohttp import web
+from server.raft_node import Node
+from server.storage import DiskStorage, Snapshot
+from server.transport import json_dumps
+
+
+class LocalTransport:
+    """Delivers requests straight to the handlers of in-process nodes."""
+
+    def __init__(self, nodes: Dict[str, Node]) -> None:
+        self.nodes = nodes
+        self.paths: list[str] = []
+
+    async def post(
+        self, node: str, path: str, data: Any, timeout: float, encode: Any = None
+    ) -> Any:
+        self.paths.append(path)
+        handler = getattr(self.nodes[node], "handle" + path.replace("/", "_"))
+        request = MagicMock()
+        request.json = AsyncMock(return_value=json.loads(json_dumps(data)))
+        resp: web.Response = await handler(request)
+        return json.loads(resp.text or "{}")
+
+    async def close(self, node: Any = None) -> None:
+        pass
+
+
+def append_request(log_length: int, entries: Any, leader_commit: int) -> MagicMock:
+    request = MagicMock()
+    request.json = AsyncMock(
+        return_value=dict(
+            term=1,
+            leader_id="node2",
+            log_length=log_length,
+            log_term=1 if log_length else 0,
+            entries=entries,
+            leader_commit=leader_commit,
+        )
+    )
+    return request
+
+
+@pytest.mark.asyncio
+async def test_commit_takes_snapshot_after_entry_count() -> None:
+    node = Node("node1", ["node2", "node3"])
+    node.snapshot_entries = 3
+    entries = [(1, f"msg{i}") for i in range(1, 5)]
+    await node.handle_append_entries(append_request(0, entries, 3))
+
+    assert node.log_base == 3
+    assert node.snapshot_term == 1
+    assert node.log == [(1, "msg4")]
+    assert node.snapshot == Snapshot(3, 1, b'["msg1", "msg2", "msg3"]')
+
+    # indices stay absolute after compaction
+    await node.handle_append_entries(append_request(4, [(1, "msg5")], 5))
+    assert node.log_length() == 5
+    assert node.log == [(1, "msg4"), (1, "msg5")]
+    assert str(node.state_machine) == "_msg1_msg2_msg3_msg4_msg5_"
+
+
+def test_snapshot_after_bytes() -> None:
+    node = Node("node1", ["node2", "node3"])
+    node.snapshot_bytes = 10
+    node.log = [(1, "aaaa"), (1, "bbbb"), (1, "cccc")]
+    node.commit(1)
+    assert node.log_base == 0
+    node.commit(2)
+    assert node.log_base == 2
+    assert node.applied_bytes == 0
+
+
+@pytest.mark.asyncio
+async def test_append_entries_skips_entries_in_snapshot() -> None:
+    node = Node("node1", ["node2", "node3"])
+    node.current_term = 1
+    node.restore_snapshot(Snapshot(2, 1, b'["msg1", "msg2"]'))
+
+    resp = await node.handle_append_entries(
+        append_request(0, [(1, "msg1"), (1, "msg2"), (1, "msg3")], 3)
+    )
+    data = json.loads(resp.text or "{}")
+    assert data == dict(term=1, ack=3, success=True)
+    assert node.log == [(1, "msg3")]
+    assert str(node.state_machine) == "_msg1_msg2_msg3_"
+
+
+@pytest.mark.asyncio
+async def test_install_snapshot_in_chunks() -> None:
+    follower = Node("node2", ["node1"])
+    follower.log = [(1, "old")]
+    leader = Node("node1", ["node2"])
+    leader.transport = LocalTransport({"node2": follower})  # type: ignore
+    leader.snapshot_chunk_size = 4
+    leader.current_term = 2
+    leader.log = [(1, "msg1"), (2, "msg2"), (2, "msg3")]
+    leader.commit(2)
+    leader.take_snapshot()
+    leader.become_leader()
+    leader.sent_length["node2"] = 0
+
+    assert await leader.replicate_log("node2")
+
+    transport: LocalTransport = leader.transport  # type: ignore
+    assert transport.paths.count("/install_snapshot") == 4  # 16 bytes
+    assert transport.paths[-1] == "/append_entries"
+    assert follower.current_term == 2
+    assert follower.log_base == 2
+    assert follower.log == [(2, "msg3")]
+    assert follower.commit_length == 2
+    assert str(follower.state_machine) == "_msg1_msg2_"
+    assert leader.acked_length["node2"] == 3
+
+
+@pytest.mark.asyncio
+async def test_install_snapshot_refuses_chunk_out_of_order() -> None:
+    node = Node("node1", ["node2"])
+    request = MagicMock()
+    request.json = AsyncMock(
+        return_value=dict(
+            term=1,
+            leader_id="node2",
+            last_index=5,
+            last_term=1,
+            offset=4,
+            data="YWJjZA==",
+            done=True,
+        )
+    )
+    resp = await node.handle_install_snapshot(request)
+    assert json.loads(resp.text or "{}") == dict(term=1, offset=0)
+    assert node.log_base == 0
+    assert node.commit_length == 0
+
+
+def test_restart_restores_snapshot(tmp_path: Path) -> None:
+    node = Node("node1", ["node2", "node3"], data_dir=str(tmp_path))
+    node.snapshot_entries = 2
+    entries = [(1, "msg1"), (1, "msg2"), (1, "msg3")]
+    node.storage.append(0, entries)
+    node.log = list(entries)
+    node.commit(2)
+    node.storage.close()
+
+    restarted = Node("node1", ["node2", "node3"], data_dir=str(tmp_path))
+    assert restarted.log_base == 2
+    assert restarted.log == [(1, "msg3")]
+    assert restarted.commit_length == 2
+    assert str(restarted.state_machine) == "_msg1_msg2_"
+    assert DiskStorage(str(tmp_path)).load_snapshot() == Snapshot(
+        2, 1, b'["msg1", "msg2"]'
+    )
+    restarted.storage.close()
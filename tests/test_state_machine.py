@@ -0,0 +1,124 @@
+import json
+import pytest
+from pytest import MonkeyPatch
+from unittest.mock import MagicMock
+from server import state_machine as state_machine_module
+from server.raft_node import Node
+from server.state_machine import (
+    SESSION_EXPIRED,
+    LogStateMachine,
+    Sessions,
+    StateMachine,
+    session_command,
+)
+
+
+def test_log_state_machine_chunks_and_pages(monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setattr(state_machine_module, "CHUNK_SIZE", 3)
+    machine = LogStateMachine()
+    for i in range(1, 9):
+        machine.apply(i, f"msg{i}")
+
+    assert [len(chunk) for chunk in machine.chunks] == [3, 3, 2]
+    assert len(machine) == 8
+    assert str(machine) == "_" + "".join(f"msg{i}_" for i in range(1, 9))
+    assert machine.commands(2, 4) == ["msg3", "msg4", "msg5", "msg6"]
+    assert machine.commands(7, 10) == ["msg8"]
+    assert machine.commands(9, 10) == []
+    assert machine.read({"offset": "5", "limit": "2"}) == {
+        "offset": 5,
+        "commands": ["msg6", "msg7"],
+        "total": 8,
+    }
+
+
+def test_state_machine_needs_every_method() -> None:
+    class Partial(StateMachine):
+        def apply(self, index: int, command: str) -> None:
+            pass
+
+    with pytest.raises(TypeError):
+        Partial()  # type: ignore
+
+
+def test_log_state_machine_snapshot_restore() -> None:
+    machine = LogStateMachine(["a_b", "c"])
+    restored = LogStateMachine()
+    restored.restore(machine.snapshot())
+    assert restored.commands(0, 10) == ["a_b", "c"]
+    assert str(restored) == "_a_b_c_"
+
+
+def test_sessions_apply_each_command_once() -> None:
+    machine = LogStateMachine()
+    sessions = Sessions(timeout=10.0, max_clients=2)
+    sessions.apply(1, 1, session_command("a1", "a", 1, 100.0), machine)
+    sessions.apply(2, 1, session_command("b1", "b", 1, 101.0), machine)
+    # a retry of a1 that was appended twice
+    sessions.apply(3, 1, session_command("a1", "a", 1, 102.0), machine)
+    assert str(machine) == "_a1_b1_"
+    # result, index and term of the first copy
+    assert sessions.applied("a", 1) == (None, 1, 1)
+    assert sessions.applied("a", 2) is None
+
+    # b is the least recently used and goes first
+    sessions.apply(4, 1, session_command("c1", "c", 1, 103.0), machine)
+    assert list(sessions.clients) == ["a", "c"]
+    # by leader time, an earlier clock of a new leader doesn't bring a back
+    sessions.apply(5, 1, session_command("c2", "c", 2, 112.5), machine)
+    sessions.apply(6, 1, session_command("c3", "c", 3, 90.0), machine)
+    assert list(sessions.clients) == ["c"]
+    assert str(machine) == "_a1_b1_c1_c2_c3_"
+
+    restored = Sessions()
+    state = restored.restore(sessions.snapshot(machine.snapshot()))
+    assert restored.clients == {"c": [3, None, 112.5, 6, 1]}
+    assert restored.now == 112.5
+    assert state == machine.snapshot()
+    # snapshots taken before any session are the state machine's alone
+    assert Sessions().snapshot(b"[]") == b"[]"
+    assert restored.restore(b"[]") == b"[]"
+    assert len(restored) == 0
+
+
+def test_sessions_refuse_commands_they_cannot_tell_about() -> None:
+    machine = LogStateMachine()
+    sessions = Sessions(timeout=10.0, max_clients=1)
+    sessions.apply(1, 1, session_command("a1", "a", 1, 100.0), machine)
+    sessions.apply(2, 1, session_command("a2", "a", 2, 101.0), machine)
+    # only the result of the last command is kept
+    assert sessions.applied("a", 1) == (SESSION_EXPIRED, 0, 0)
+    assert sessions.apply(3, 1, session_command("a1", "a", 1, 102.0), machine) is (
+        SESSION_EXPIRED
+    )
+
+    # b evicts a, a retry of a2 is not applied again
+    sessions.apply(4, 1, session_command("b1", "b", 1, 103.0), machine)
+    assert sessions.applied("a", 2) == (SESSION_EXPIRED, 0, 0)
+    assert sessions.apply(5, 1, session_command("a2", "a", 2, 104.0), machine) is (
+        SESSION_EXPIRED
+    )
+    # nor is a command of b once its session expired
+    assert sessions.apply(6, 1, session_command("b2", "b", 2, 120.0), machine) is (
+        SESSION_EXPIRED
+    )
+    assert len(sessions) == 0
+    assert str(machine) == "_a1_a2_b1_"
+    # a new session starts with command 1
+    assert sessions.applied("c", 1) is None
+
+
+@pytest.mark.asyncio
+async def test_handle_state_machine() -> None:
+    node = Node("node1", ["node2", "node3"])
+    node.log = [(1, "msg1"), (1, "msg2"), (1, "msg3")]
+    node.commit(3)
+
+    request = MagicMock()
+    request.query = {"offset": "1", "limit": "1"}
+    resp = await node.handle_state_machine(request)
+    assert json.loads(resp.text or "{}") == {
+        "offset": 1,
+        "commands": ["msg2"],
+        "total": 3,
+    }
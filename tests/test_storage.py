@@ -0,0 +1,234 @@
+import os
+import json
+import pytest
+import asyncio
+from pathlib import Path
+from pytest import MonkeyPatch
+from typing import Callable, Iterator, List
+from unittest.mock import AsyncMock, MagicMock
+from server import storage as storage_module
+from server.storage import DiskStorage
+from server.raft_node import Node
+
+OpenStorage = Callable[..., DiskStorage]
+
+
+@pytest.fixture
+def open_storage(tmp_path: Path) -> Iterator[OpenStorage]:
+    """Opens DiskStorage in tmp_path, and closes every one after the test."""
+    opened: List[DiskStorage] = []
+
+    def open_storage(batched: bool = True) -> DiskStorage:
+        storage = DiskStorage(str(tmp_path), batched)
+        opened.append(storage)
+        return storage
+
+    yield open_storage
+    for storage in opened:
+        storage.close()
+
+
+def test_append_and_load(open_storage: OpenStorage) -> None:
+    storage = open_storage()
+    storage.load()
+    storage.save_state(3, "node2")
+    storage.append(0, [(1, "msg1"), (2, "msg2")])
+    storage.append(2, [(3, "msg3")])
+    storage.close()
+
+    assert open_storage().load() == (
+        3,
+        "node2",
+        0,
+        [(1, "msg1"), (2, "msg2"), (3, "msg3")],
+    )
+
+
+def test_truncate(open_storage: OpenStorage) -> None:
+    storage = open_storage()
+    storage.load()
+    storage.append(0, [(1, "msg1"), (1, "msg2"), (1, "msg3")])
+    storage.truncate(1)
+    storage.append(1, [(2, "msgX")])
+    storage.close()
+
+    _, _, _, log = open_storage().load()
+    assert log == [(1, "msg1"), (2, "msgX")]
+
+
+def test_segments_roll_over_and_truncate(
+    tmp_path: Path, open_storage: OpenStorage, monkeypatch: MonkeyPatch
+) -> None:
+    monkeypatch.setattr(storage_module, "SEGMENT_SIZE", 50)
+    storage = open_storage()
+    storage.load()
+    for i in range(10):
+        storage.append(i, [(1, f"message-{i}")])
+    assert len(storage.segments) > 2
+    assert storage.segments[1].first > 0
+
+    storage.truncate(storage.segments[1].first)
+    assert len(storage.segments) == 1
+    storage.close()
+
+    _, _, _, log = open_storage().load()
+    assert log == [(1, f"message-{i}") for i in range(len(log))]
+    assert os.listdir(tmp_path) == ["00000000000000000000.wal"]
+
+
+def test_load_drops_torn_tail(open_storage: OpenStorage) -> None:
+    storage = open_storage()
+    storage.load()
+    storage.append(0, [(1, "msg1"), (1, "msg2")])
+    storage.close()
+    path = storage.segments[0].path
+    with open(path, "r+b") as file:
+        file.truncate(os.path.getsize(path) - 2)
+
+    storage = open_storage()
+    assert storage.load()[3] == [(1, "msg1")]
+    # the log continues after the last good entry
+    storage.append(1, [(2, "msg3")])
+    storage.close()
+    assert open_storage().load()[3] == [(1, "msg1"), (2, "msg3")]
+
+
+@pytest.mark.asyncio
+async def test_sync_batches_fsync(
+    open_storage: OpenStorage, monkeypatch: MonkeyPatch
+) -> None:
+    storage = open_storage()
+    storage.load()
+    storage.append(0, [(1, "msg0")])
+    await storage.sync()
+
+    fsyncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(
+        storage_module.os, "fsync", lambda fd: fsyncs.append(fd) or real_fsync(fd)
+    )
+
+    async def append(i: int) -> None:
+        storage.append(i, [(1, f"msg{i}")])
+        await storage.sync()
+
+    await asyncio.gather(*[append(i) for i in range(1, 51)])
+
+    # one flush of the single segment covers all 50 appends
+    assert len(fsyncs) == 1
+    assert storage.synced == storage.written
+    storage.close()
+
+
+def test_unbatched_syncs_every_change(
+    open_storage: OpenStorage, monkeypatch: MonkeyPatch
+) -> None:
+    storage = open_storage(batched=False)
+    storage.load()
+    fsyncs = []
+    monkeypatch.setattr(storage_module.os, "fsync", lambda fd: fsyncs.append(fd))
+
+    storage.append(0, [(1, "msg1")])
+    storage.append(1, [(1, "msg2")])
+
+    assert fsyncs.count(storage.segments[0].file.fileno()) == 2
+    assert storage.synced == storage.written
+
+
+@pytest.mark.asyncio
+async def test_node_restores_persistent_state(tmp_path: Path) -> None:
+    node = Node("node1", ["node2", "node3"], data_dir=str(tmp_path))
+    request = MagicMock()
+    request.json = AsyncMock(
+        return_value=dict(
+            term=2,
+            leader_id="node2",
+            log_length=0,
+            log_term=0,
+            entries=[(1, "msg1"), (2, "msg2")],
+            leader_commit=0,
+        )
+    )
+    resp = await node.handle_append_entries(request)
+    assert json.loads(getattr(resp, "text", "{}"))["success"] is True
+    # acked entries are already durable
+    assert node.storage.synced == node.storage.written  # type: ignore
+    node.storage.close()
+
+    restarted = Node("node1", ["node2", "node3"], data_dir=str(tmp_path))
+    assert restarted.current_term == 2
+    assert restarted.voted_for is None
+    assert restarted.log == [(1, "msg1"), (2, "msg2")]
+    assert restarted.commit_length == 0
+    restarted.storage.close()
+
+
+def test_compact_and_reset(open_storage: OpenStorage, monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setattr(storage_module, "SEGMENT_SIZE", 50)
+    storage = open_storage()
+    storage.load()
+    for i in range(10):
+        storage.append(i, [(1, f"message-{i}")])
+    first = storage.segments[1].first
+    storage.compact(first + 1)
+    storage.close()
+
+    # whole segments below the base are gone, the rest is loaded from its index
+    _, _, index, log = open_storage().load()
+    assert index == first
+    assert log == [(1, f"message-{i}") for i in range(first, 10)]
+
+    storage = open_storage()
+    storage.load()
+    storage.reset(20)
+    storage.append(20, [(2, "message-20")])
+    storage.close()
+    assert open_storage().load()[2:] == (20, [(2, "message-20")])
+
+
+def test_load_reads_only_the_last_segment(
+    open_storage: OpenStorage, monkeypatch: MonkeyPatch
+) -> None:
+    monkeypatch.setattr(storage_module, "SEGMENT_SIZE", 50)
+    storage = open_storage()
+    storage.load()
+    for i in range(10):
+        storage.append(i, [(i, f"message-{i}")])
+    storage.close()
+
+    storage = open_storage()
+    _, _, _, log = storage.load()
+    assert len(log) == 10
+    assert [segment.indexed for segment in storage.segments] == [False] * (
+        len(storage.segments) - 1
+    ) + [True]
+    # enough to vote: the term of the last entry
+    assert log[9] == (9, "message-9")
+
+    # the other segments are indexed when their entries are first read
+    assert log[0] == (0, "message-0")
+    assert storage.segments[0].indexed
+    assert log == [(i, f"message-{i}") for i in range(10)]
+
+
+def test_restarted_log_truncates_and_grows(
+    tmp_path: Path, monkeypatch: MonkeyPatch
+) -> None:
+    monkeypatch.setattr(storage_module, "SEGMENT_SIZE", 50)
+    node = Node("node1", ["node2"], data_dir=str(tmp_path))
+    node.append_entries(0, 0, [(1, f"message-{i}") for i in range(10)])
+    node.storage.close()
+
+    node = Node("node1", ["node2"], data_dir=str(tmp_path))
+    assert node.log_length() == 10
+    # a new leader replaces entries that were only read from disk
+    node.append_entries(3, 0, [(2, "message-3b"), (2, "message-4b")])
+    expected = [(1, f"message-{i}") for i in range(3)]
+    expected += [(2, "message-3b"), (2, "message-4b")]
+    assert node.log == expected
+    assert node.log.size(0, 5) == sum(len(c.encode()) for _, c in expected)
+    node.storage.close()
+
+    node = Node("node1", ["node2"], data_dir=str(tmp_path))
+    assert node.log == expected
+    node.storage.close()